@@ -0,0 +1,95 @@
+# Разбор суммы виртов: «12кк», «12,5 кк», «12kk», «500к», «12 000 000».
+# Одно совпадение с заранее скомпилированным шаблоном, дальше целочисленная арифметика
+# в виртах: результат — точный Decimal в кк без промежуточных float
+import re
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+UNITS_PER_KK = 1_000_000
+
+# Число без суффикса меньше этого порога — в кк («12»), иначе в виртах («12000000»)
+BARE_KK_LIMIT = 1000
+
+# Сумма заказа в кк: бот принимает только суммы в этих границах
+MIN_ORDER_KK = 1
+MAX_ORDER_KK = 100
+
+# Длиннее суммы не бывают; отсекаем мусор до разбора
+MAX_LENGTH = 40
+
+# Пользователи пишут одни и те же суммы; Decimal неизменяем, результат можно отдавать из кэша
+CACHE_SIZE = 4096
+
+# Целая часть (можно с пробелами между тысячами), дробная через точку или запятую, суффикс.
+# Цифры — любые десятичные Unicode, как \d в прежнем разборе («٥кк»); int() их понимает
+_AMOUNT = re.compile(
+    r"\s*(\d{1,3}(?:[ \u00a0\u2009\u202f]\d{3})+|\d+)(?:[.,](\d+))?\s*([^\s\d.,]*)\s*"
+)
+_GROUP_SEPARATORS = str.maketrans("", "", " \u00a0\u2009\u202f")
+
+# Суффикс в нижнем регистре → сколько знаков после запятой у кк в виртах;
+# латинская и кириллическая «к» взаимозаменяемы
+_SUFFIX_DIGITS = {}
+for _kk in ("кк", "kk", "кk", "kк", "млн", "м", "m"):
+    _SUFFIX_DIGITS[_kk] = 6
+for _k in ("к", "k"):
+    _SUFFIX_DIGITS[_k] = 3
+
+_SCALE = [10 ** digits for digits in range(7)]
+_ONE = Decimal(1)
+
+
+# Сумма в кк или None, если строка не похожа на сумму или дробит вирт
+def parse_kk(text):
+    if not text or len(text) > MAX_LENGTH:
+        return None
+    return _parse(text)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(text):
+    # Самая частая запись — «12кк»; ей шаблон не нужен. isdecimal, а не isdigit:
+    # надстрочные «²» int() не разбирает
+    number = text[:-2]
+    if text.endswith("кк") and number.isdecimal():
+        return Decimal(int(number))
+    match = _AMOUNT.fullmatch(text)
+    if match is None:
+        return None
+    whole, fraction, suffix = match.groups()
+    if len(whole) > 3 and not whole.isdecimal():
+        whole = whole.translate(_GROUP_SEPARATORS)
+
+    if suffix:
+        digits = _SUFFIX_DIGITS.get(suffix.lower())
+        if digits is None:
+            return None
+    else:
+        digits = 6 if int(whole) < BARE_KK_LIMIT else 0
+
+    # Вирты целым числом: лишние знаки дроби допустимы, только если это нули
+    if fraction:
+        extra = len(fraction) - digits
+        if extra > 0:
+            if fraction[digits:].strip("0"):
+                return None
+            fraction = fraction[:digits]
+            extra = 0
+        units = int(whole + fraction) * _SCALE[-extra]
+    else:
+        units = int(whole) * _SCALE[digits]
+
+    if units % UNITS_PER_KK == 0:
+        return Decimal(units // UNITS_PER_KK)
+    return Decimal(units) / UNITS_PER_KK
+
+
+# Каноническая запись без экспоненты и лишних нулей: 12, 12.5
+def format_kk(amount):
+    return f"{Decimal(amount).normalize():f}"
+
+
+# Цена в целых рублях; amount_kk — Decimal, строка из format_kk или int из старых данных
+def price_rub(amount_kk, price_per_kk):
+    price = Decimal(amount_kk) * price_per_kk
+    return int(price.quantize(_ONE, rounding=ROUND_HALF_UP))
@@ -0,0 +1,15 @@
+# Бенчмарки запускают bot.py — импортом или отдельным процессом. Чтобы после них в рабочем
+# каталоге не оставались лог, checkpoint polling'а и базы, по умолчанию всё это выключено
+# или уходит во временный каталог; явно заданные переменные окружения не трогаются
+import atexit
+import os
+import shutil
+import tempfile
+
+if "LEDGER_PATH" not in os.environ or "FSM_SQLITE_PATH" not in os.environ:
+    _state_dir = tempfile.mkdtemp(prefix="bot-bench-")
+    atexit.register(shutil.rmtree, _state_dir, ignore_errors=True)
+    os.environ.setdefault("LEDGER_PATH", os.path.join(_state_dir, "orders.sqlite3"))
+    os.environ.setdefault("FSM_SQLITE_PATH", os.path.join(_state_dir, "fsm.sqlite3"))
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("POLL_CHECKPOINT", "")
@@ -0,0 +1,69 @@
+# Разбор суммы: сравнение скорости amount.parse_kk с прежним путём через регулярное выражение.
+# Свойства разбора и совместимость с прежним проверяет tests/test_amount.py
+#
+#   python -m benchmarks.amount_parser --iterations 200000
+import argparse
+import re
+import time
+
+import amount
+from amount import parse_kk
+
+# Прежний разбор: только целые «кк» без пробелов
+LEGACY_PATTERN = r'^(\d{1,3})кк$'
+LEGACY_COMPILED = re.compile(LEGACY_PATTERN)
+
+
+def legacy_parse(text):
+    match = re.match(LEGACY_PATTERN, text or "")
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+def legacy_parse_compiled(text):
+    match = LEGACY_COMPILED.match(text or "")
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+# Разбор без кэша результатов — цена первой встречи строки
+def parse_uncached(text):
+    if not text or len(text) > amount.MAX_LENGTH:
+        return None
+    return amount._parse.__wrapped__(text)
+
+
+def bench(name, parse, inputs, iterations):
+    count = len(inputs)
+    started = time.perf_counter()
+    for i in range(iterations):
+        parse(inputs[i % count])
+    elapsed = time.perf_counter() - started
+    accepted = sum(parse(text) is not None for text in inputs)
+    print(f"   {name:<22} {elapsed / iterations * 1e9:8.0f} ns/call   accepts {accepted}/{count} inputs")
+
+
+def run(args):
+    inputs = [
+        "12кк", "100кк", "7кк", "12.5кк", "12 кк", "12kk", "12000000", "12 000 000",
+        "500к", "абв", "", "5кк", "99кк", "12,5 КК", "٥кк",
+    ]
+    print(f"== parse speed, {args.iterations} calls over {len(inputs)} typical inputs")
+    bench("re.match (legacy)", legacy_parse, inputs, args.iterations)
+    bench("precompiled regex", legacy_parse_compiled, inputs, args.iterations)
+    bench("parse_kk, uncached", parse_uncached, inputs, args.iterations)
+    bench("parse_kk", parse_kk, inputs, args.iterations)
+    simple = ["12кк", "100кк", "7кк", "55кк"]
+    print("== parse speed, plain «Nкк» only")
+    bench("re.match (legacy)", legacy_parse, simple, args.iterations)
+    bench("precompiled regex", legacy_parse_compiled, simple, args.iterations)
+    bench("parse_kk, uncached", parse_uncached, simple, args.iterations)
+    bench("parse_kk", parse_kk, simple, args.iterations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    run(parser.parse_args())
@@ -0,0 +1,154 @@
+# Холодный старт: настоящий bot.py против заглушки Bot API с задержкой сети.
+# У Telegram уже ждёт сообщение; во втором варианте от прошлого деплоя ещё и остался вебхук:
+# пока его не удалят, getUpdates отвечает 409. Меряется время от запуска процесса до первого getUpdates
+# и до ответа на ждущее сообщение; фазы запуска и импорт по пакетам — из отчёта
+# STARTUP_PROFILE=1, который бот пишет в лог.
+#
+# Второй замер — SIGHUP супервизору с двумя воркерами: пользователи пишут /help раз
+# в секунду, пока воркеры по очереди перезапускаются; видна самая долгая пауза ответа.
+#
+#   python -m benchmarks.cold_start --runs 3 --latency-ms 100
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_api
+from benchmarks.common import percentile
+from benchmarks.load import BOT_SCRIPT, bot_env, update_dict, wait_ready
+
+CHAT = 700_000
+REPORT_LINES = ("Started in", "First update", "Startup phases", "Import time by package")
+
+
+async def read_lines(stream, keep):
+    async for line in stream:
+        text = line.decode(errors="replace").rstrip()
+        for marker in REPORT_LINES:
+            if marker in text:
+                keep[marker] = text.partition(" - INFO - ")[2] or text
+
+
+async def cold_start(args, webhook):
+    api = fake_api.from_arguments(args)
+    _, runner = await fake_api.start(api=api)
+    marks = {}
+    get_updates = api.api_getUpdates
+
+    async def first_get_updates(params):
+        marks.setdefault("getUpdates", time.perf_counter())
+        return await get_updates(params)
+
+    api.api_getUpdates = first_get_updates
+    api.on_message = lambda chat_id, params: marks.setdefault("reply", time.perf_counter())
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bot_env(args, runner.addresses[0][1], None, tmp)
+        env.update({
+            "LOG_LEVEL": "INFO",
+            "STARTUP_PROFILE": "1",
+            "POLL_CHECKPOINT": os.path.join(tmp, "polling.checkpoint.json"),
+        })
+        api.push_update(update_dict(CHAT, "/help"))
+        # Вебхук ставится после обновления, чтобы оно осталось в очереди getUpdates
+        if webhook:
+            api.webhook_url = "https://previous-deploy.example/webhook"
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, BOT_SCRIPT, env=env, stderr=asyncio.subprocess.PIPE
+        )
+        reader = asyncio.create_task(read_lines(process.stderr, report))
+        deadline = time.monotonic() + 60
+        while "reply" not in marks and time.monotonic() < deadline and process.returncode is None:
+            await asyncio.sleep(0.005)
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+        await reader
+    await api.close()
+    await runner.cleanup()
+    if "reply" not in marks:
+        raise RuntimeError("bot.py did not answer the queued update")
+    return marks["getUpdates"] - started, marks["reply"] - started, dict(api.calls), report
+
+
+async def rolling_restart(args):
+    api = fake_api.from_arguments(args)
+    _, runner = await fake_api.start(api=api)
+    sent = {}
+    latencies = []
+
+    def on_message(chat_id, params):
+        queue = sent.get(chat_id)
+        if queue:
+            latencies.append(time.perf_counter() - queue.pop(0))
+
+    api.on_message = on_message
+    args.workers = 2
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bot_env(args, runner.addresses[0][1], None, tmp)
+        # Порт метрик занят старым воркером, пока новый уже запущен
+        env["METRICS_PORT"] = str(args.metrics_port)
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=env)
+        await wait_ready(api, "polling", process)
+        stop = asyncio.Event()
+
+        async def chatter(chat_id, delay):
+            await asyncio.sleep(delay)
+            while not stop.is_set():
+                sent.setdefault(chat_id, []).append(time.perf_counter())
+                api.push_update(update_dict(chat_id, "/help"))
+                await asyncio.sleep(1.0)
+
+        chats = [asyncio.create_task(chatter(CHAT + 1 + i, i / args.chats)) for i in range(args.chats)]
+        await asyncio.sleep(2)
+        process.send_signal(signal.SIGHUP)
+        await asyncio.sleep(args.window)
+        stop.set()
+        await asyncio.gather(*chats)
+        await asyncio.sleep(2)
+        unanswered = sum(len(queue) for queue in sent.values())
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+    await api.close()
+    await runner.cleanup()
+    return latencies, unanswered
+
+
+async def run(args):
+    print(f"API latency {args.latency_ms} ms, one update waiting in getUpdates")
+    for name, webhook in (("clean", False), ("leftover webhook", True)):
+        results = []
+        for _ in range(args.runs):
+            results.append(await cold_start(args, webhook))
+        ready = sorted(result[0] for result in results)
+        reply = sorted(result[1] for result in results)
+        print(f"== cold start, {name}, {args.runs} runs (median / min / max)")
+        print(f"   first getUpdates: {ready[len(ready) // 2]:6.2f} / {ready[0]:6.2f} / {ready[-1]:6.2f} s")
+        print(f"   first reply:      {reply[len(reply) // 2]:6.2f} / {reply[0]:6.2f} / {reply[-1]:6.2f} s")
+        calls, report = results[-1][2], results[-1][3]
+        print("   API calls: " + ", ".join(f"{method}={count}" for method, count in sorted(calls.items())))
+        for marker in REPORT_LINES:
+            if marker in report:
+                print(f"   {report[marker]}")
+
+    if args.chats:
+        latencies, unanswered = await rolling_restart(args)
+        print(f"== rolling restart of 2 workers, {args.chats} chats writing once a second for {args.window} s")
+        print(f"   reply latency p50 {percentile(latencies, 50) * 1000:7.1f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:7.1f} ms, max {max(latencies) * 1000:7.1f} ms")
+        print(f"   replies: {len(latencies)}, unanswered: {unanswered}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--chats", type=int, default=20, help="0 — без замера перезапуска воркеров")
+    parser.add_argument("--window", type=float, default=15.0, help="секунд наблюдения после SIGHUP")
+    parser.add_argument("--metrics-port", type=int, default=19390, help="порт метрик супервизора; воркеры берут следующие")
+    parser.set_defaults(mode="polling", workers=1, storage="sqlite", scheduler=False)
+    fake_api.add_arguments(parser)
+    parser.set_defaults(latency_ms=100.0)
+    asyncio.run(run(parser.parse_args()))
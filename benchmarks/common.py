@@ -0,0 +1,177 @@
+# Общие вспомогательные функции для локальных бенчмарков
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.base import BaseStorage
+
+
+# Сессия-заглушка: отвечает на запросы к Bot API без сети
+class FakeSession(BaseSession):
+    def __init__(self, latency=0.0, serializer=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        # Сессия, которой сериализуются запросы — чтобы учесть её CPU, как в настоящей отправке
+        self.serializer = serializer
+        self.calls = {}
+        self.updates = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+        if name == "getUpdates":
+            return await self._get_updates(method)
+        if self.serializer is not None:
+            self.serializer.build_form_data(bot, method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "getMe":
+            return types.User(id=bot.id, is_bot=True, first_name="Bench", username="bench_bot")
+        if name in ("sendMessage", "editMessageText"):
+            return types.Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=types.Chat(id=int(method.chat_id), type="private"),
+                text=method.text
+            )
+        return True
+
+    async def _get_updates(self, method):
+        # Эмулируем long polling: ждём первое обновление, затем забираем накопившиеся
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=method.timeout or 1)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while len(batch) < (method.limit or 100) and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+_update_ids = itertools.count(1)
+
+
+# Синтетический Update с текстовым сообщением от пользователя
+def make_update(user_id, text, update_id=None):
+    if update_id is None:
+        update_id = next(_update_ids)
+    return types.Update(
+        update_id=update_id,
+        message=types.Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=types.Chat(id=user_id, type="private"),
+            from_user=types.User(id=user_id, is_bot=False, first_name="User", username=f"user{user_id}"),
+            text=text
+        )
+    )
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(title, latencies, elapsed, extra=None):
+    count = len(latencies)
+    print(f"== {title}")
+    print(f"   updates:     {count}")
+    print(f"   elapsed:     {elapsed:.3f} s")
+    print(f"   updates/sec: {count / elapsed if elapsed else 0:.1f}")
+    print(f"   p50:         {percentile(latencies, 50) * 1000:.2f} ms")
+    print(f"   p99:         {percentile(latencies, 99) * 1000:.2f} ms")
+    for key, value in (extra or {}).items():
+        print(f"   {key + ':':<12} {value}")
+
+
+# Middleware, отмечающее момент завершения обработки каждого обновления
+class CompletionRecorder:
+    def __init__(self):
+        self.started = {}
+        self.latencies = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def expect(self, update_id):
+        self.started[update_id] = time.perf_counter()
+        self.expected += 1
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            started = self.started.pop(event.update_id, None)
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+# Обёртка над хранилищем FSM, считающая обращения к нему
+class CountingStorage(BaseStorage):
+    def __init__(self, inner):
+        self.inner = inner
+        self.ops = {}
+        if hasattr(inner, "set_state_and_data"):
+            self.set_state_and_data = self._counted("set_state_and_data", inner.set_state_and_data)
+
+    def _counted(self, name, func):
+        async def wrapper(*args, **kwargs):
+            self.ops[name] = self.ops.get(name, 0) + 1
+            return await func(*args, **kwargs)
+        return wrapper
+
+    @property
+    def total(self):
+        return sum(self.ops.values())
+
+    def reset(self):
+        self.ops.clear()
+
+    async def set_state(self, key, state=None):
+        return await self._counted("set_state", self.inner.set_state)(key=key, state=state)
+
+    async def get_state(self, key):
+        return await self._counted("get_state", self.inner.get_state)(key=key)
+
+    async def set_data(self, key, data):
+        return await self._counted("set_data", self.inner.set_data)(key=key, data=data)
+
+    async def get_data(self, key):
+        return await self._counted("get_data", self.inner.get_data)(key=key)
+
+    async def update_data(self, key, data):
+        return await self._counted("update_data", self.inner.update_data)(key=key, data=data)
+
+    async def close(self):
+        await self.inner.close()
+
+
+# Полный сценарий заказа: от /start до подтверждения
+ORDER_FLOW = ["/start", "💸 Купить", "GTA5RP", "Alta", "12кк", "📱 СБП", "✅ Подтвердить"]
+
+
+# Ставит пользователя на шаг подтверждения с заполненным заказом
+async def prepare_confirm(storage, bot, user_id, state):
+    from aiogram.fsm.storage.base import StorageKey
+
+    key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+    await storage.set_state(key, state)
+    await storage.set_data(key, {
+        "action": "Купить", "project": "GTA5RP", "server": "Alta", "amount_kk": 12,
+        "price_rub": 19200, "payment_type": "СБП", "user_id": user_id, "username": f"user{user_id}"
+    })
@@ -0,0 +1,224 @@
+# Локальная замена Bot API: бот подключается к ней через TELEGRAM_API_URL
+#
+#   python -m benchmarks.fake_api --port 8081 --latency-ms 50 --error-429 0.01
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 python bot.py
+#
+# getUpdates подтверждает обновления через offset, как настоящий Bot API;
+# после setWebhook обновления доставляются POST-запросом на адрес вебхука.
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import ClientError, ClientSession, web
+
+
+class ApiError(Exception):
+    def __init__(self, status, description, parameters=None):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeBotApi:
+    # error_429 и error_5xx — доля запросов к error_methods, на которые отвечаем ошибкой
+    def __init__(self, latency=0.0, jitter=0.0, error_429=0.0, error_5xx=0.0, retry_after=1,
+                 error_methods=("sendMessage",), seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.error_methods = set(error_methods)
+        self.random = random.Random(seed)
+
+        self.calls = {}
+        self.errors = {}
+        self.last_text = {}
+        # Вызывается на каждое отправленное ботом сообщение: on_message(chat_id, params)
+        self.on_message = None
+
+        self._pending = []
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._http = None
+        self._deliveries = set()
+        self.webhook_failures = 0
+
+    def push_update(self, update):
+        if self.webhook_url is not None:
+            task = asyncio.create_task(self._deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            self._pending.append(update)
+            self._new_updates.set()
+
+    # Telegram повторяет доставку на вебхук, пока не получит 2xx
+    async def _deliver(self, update, attempts=5):
+        if self._http is None:
+            self._http = ClientSession()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+        for attempt in range(attempts):
+            try:
+                async with self._http.post(self.webhook_url, json=update, headers=headers) as resp:
+                    if resp.status < 300:
+                        return
+            except ClientError:
+                pass
+            self.webhook_failures += 1
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+    @staticmethod
+    async def _params(request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(request.query)
+        params.update(await request.post())
+        return params
+
+    def _inject_error(self, method):
+        if method not in self.error_methods:
+            return
+        roll = self.random.random()
+        if roll < self.error_429:
+            raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}",
+                           {"retry_after": self.retry_after})
+        if roll < self.error_429 + self.error_5xx:
+            raise ApiError(502, "Bad Gateway")
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await self._params(request)
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+        try:
+            self._inject_error(method)
+            handler = getattr(self, "api_" + method, None)
+            result = await handler(params) if handler is not None else True
+        except ApiError as e:
+            key = f"{method} {e.status}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+            body = {"ok": False, "error_code": e.status, "description": e.description}
+            if e.parameters:
+                body["parameters"] = e.parameters
+            return web.json_response(body, status=e.status)
+        return web.json_response({"ok": True, "result": result})
+
+    async def api_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    async def api_getUpdates(self, params):
+        if self.webhook_url is not None:
+            raise ApiError(409, "Conflict: can't use getUpdates method while webhook is active")
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._pending = [update for update in self._pending if update["update_id"] >= offset]
+        if not self._pending:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0) or 0.1)
+            except asyncio.TimeoutError:
+                return []
+        return self._pending[:int(params.get("limit") or 100)]
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params["url"]
+        self.webhook_secret = params.get("secret_token")
+        # Неподтверждённое через getUpdates уходит на вебхук
+        pending, self._pending = self._pending, []
+        for update in pending:
+            self.push_update(update)
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        if str(params.get("drop_pending_updates", "")).lower() in ("true", "1"):
+            self._pending = []
+        return True
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        self.last_text[chat_id] = params["text"]
+        if self.on_message is not None:
+            self.on_message(chat_id, params)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": params["text"],
+        }
+
+    # Служебный эндпоинт: обновления для getUpdates или вебхука, JSON-список
+    async def push(self, request):
+        for update in await request.json():
+            self.push_update(update)
+        return web.json_response({"ok": True})
+
+    # Служебный эндпоинт: счётчики вызовов и на каком тексте остановился каждый чат
+    async def stats(self, request):
+        endings = {}
+        for text in self.last_text.values():
+            endings[text] = endings.get(text, 0) + 1
+        return web.json_response({
+            "calls": self.calls,
+            "errors": self.errors,
+            "chats": len(self.last_text),
+            "last_text": endings,
+        })
+
+    async def close(self):
+        for task in list(self._deliveries):
+            task.cancel()
+        if self._http is not None:
+            await self._http.close()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_updates", self.push)
+        return app
+
+
+async def start(host="127.0.0.1", port=0, api=None):
+    api = api or FakeBotApi()
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return api, runner
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-429", type=float, default=0.0, help="доля sendMessage с ответом 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="доля sendMessage с ответом 502")
+    parser.add_argument("--retry-after", type=int, default=1)
+
+
+def from_arguments(args):
+    return FakeBotApi(
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        error_429=args.error_429, error_5xx=args.error_5xx, retry_after=args.retry_after
+    )
+
+
+async def serve(args):
+    _, runner = await start(args.host, args.port, from_arguments(args))
+    print(f"Fake Bot API listening on http://{args.host}:{runner.addresses[0][1]}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,145 @@
+# Честные пользователи проходят заказ, пока спамеры шлют /help с заданной частотой,
+# а часть обновлений доставляется повторно (как при повторе вебхука).
+# Без FloodGuard спам проходит FSM и хендлеры и копит отправки в планировщике,
+# с ним — отбрасывается до чтения состояния.
+#
+#   python -m benchmarks.flood_control --users 50 --spammers 10 --spam-rate 50
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks.common import FakeSession, make_update, percentile
+from flood import FloodGuard
+from ledger import OrderLedger
+from notify import AdminNotifier
+from sender import SendScheduler
+
+SCRIPT = ["💸 Купить", "GTA5RP", "Alta", "10кк", "📱 СБП", "✅ Подтвердить"]
+LEGIT_BASE = 900_000
+SPAM_BASE = 990_000
+
+
+# Отмечает, когда чат получил очередной ответ
+class ReplyTracker(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.replies = {}
+        self.menus = set()
+
+    async def make_request(self, bot, method, timeout=None):
+        if method.__api_method__ == "sendMessage":
+            chat_id = int(method.chat_id)
+            self.replies[chat_id] = self.replies.get(chat_id, 0) + 1
+            if method.reply_markup is not None:
+                self.menus.add(chat_id)
+        return await super().make_request(bot, method, timeout)
+
+
+async def run_mode(name, guard, args, tmp):
+    session = app.bot.session = ReplyTracker()
+    # Общий лимит бота снят, чтобы задержка отражала обработку, а не 30 сообщений в секунду;
+    # лимит на чат остаётся и не даёт спаму ответов больше одного в секунду в обоих режимах
+    scheduler = SendScheduler(global_rate=10_000, global_burst=10_000)
+    session.middleware(scheduler)
+    app.ledger = OrderLedger(os.path.join(tmp, f"{name}.sqlite3"))
+    await app.ledger.start()
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(app.create_router())
+    if guard is not None:
+        guard.install(dp)
+
+    rng = random.Random(7)
+    tasks = set()
+    spam_sent = 0
+
+    # Обновление обрабатывается отдельной задачей, как в polling с handle_as_tasks
+    def feed(update):
+        task = asyncio.create_task(dp.feed_update(app.bot, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    async def legit(user_id):
+        latencies = []
+        feed(make_update(user_id, "/start"))
+        while user_id not in session.menus:
+            await asyncio.sleep(0.05)
+        for text in SCRIPT:
+            await asyncio.sleep(args.think)
+            update = make_update(user_id, text)
+            started = time.perf_counter()
+            task = feed(update)
+            if rng.random() < args.duplicates:
+                feed(update)
+            await task
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    async def spammer(user_id, stop):
+        nonlocal spam_sent
+        interval = 1 / args.spam_rate
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            feed(make_update(user_id, "/help"))
+            spam_sent += 1
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    stop = asyncio.Event()
+    spammers = [asyncio.create_task(spammer(SPAM_BASE + i, stop)) for i in range(args.spammers)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(legit(LEGIT_BASE + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*spammers)
+
+    backlog = scheduler.queue_depth
+    in_flight = len(tasks)
+    for task in list(tasks):
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await app.sequencer.close()
+    await app.ledger.close()
+
+    latencies = [value for user in results for value in user]
+    spam_replies = sum(count for chat, count in session.replies.items() if chat >= SPAM_BASE)
+    print(f"== {name}: {args.users} orders in {elapsed:.2f} s")
+    print(f"   step latency p50/p99/max: {percentile(latencies, 50) * 1000:8.1f} / "
+          f"{percentile(latencies, 99) * 1000:8.1f} / {max(latencies) * 1000:8.1f} ms")
+    print(f"   orders recorded:          {app.ledger.written:8d}")
+    print(f"   spam updates sent:        {spam_sent:8d}")
+    print(f"   spam replies delivered:   {spam_replies:8d}")
+    print(f"   updates still in flight:  {in_flight:8d}  (send backlog {backlog})")
+    if guard is not None:
+        print("   guard: " + ", ".join(f"{key}={value}" for key, value in guard.stats().items()))
+
+
+async def run(args):
+    logging.disable(logging.CRITICAL)
+    print(f"users: {args.users}, spammers: {args.spammers} x {args.spam_rate}/s, "
+          f"think time: {args.think} s, duplicate deliveries: {args.duplicates:.0%}")
+    with tempfile.TemporaryDirectory() as tmp:
+        app.notifier = AdminNotifier(app.bot, os.path.join(tmp, "notify.sqlite3"))
+        await app.notifier.start(deliver=False)
+        await run_mode("no guard", None, args, tmp)
+        guard = FloodGuard(rate=app.FLOOD_RATE, burst=app.FLOOD_BURST, dedupe_window=app.UPDATE_DEDUPE_WINDOW)
+        await run_mode("FloodGuard", guard, args, tmp)
+        await app.notifier.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--spammers", type=int, default=10)
+    parser.add_argument("--spam-rate", type=float, default=50.0)
+    parser.add_argument("--think", type=float, default=0.5)
+    parser.add_argument("--duplicates", type=float, default=0.1)
+    asyncio.run(run(parser.parse_args()))
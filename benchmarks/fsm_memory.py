@@ -0,0 +1,144 @@
+# Память процесса на сессии FSM: MemoryStorage aiogram против CompactStorage.
+# Каждый замер — в отдельном процессе: N пользователей, часть из них только открыла бота
+# (FSMContextMiddleware всё равно читает их состояние), остальные бросили заказ на случайном
+# шаге OrderForm с данными, как их собирают хендлеры. Байты на пользователя — прирост RSS / N;
+# время операции — get_state + get_data + set_state_and_data, как у StateTransactionMiddleware.
+#
+#   python -m benchmarks.fsm_memory --users 100000 1000000 --cap 100000
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import CompactStorage
+
+BOT_ID = 42
+STEPS = ("action", "project", "server", "amount", "payment_type", "confirm")
+
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def make_key(user_id):
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+# Брошенный заказ: состояние шага и данные, собранные до него
+def abandoned_order(rng, app, snapshot, projects, user_id):
+    step = rng.randrange(len(STEPS))
+    data = {}
+    if step > 0:
+        data["action"] = rng.choice(list(app.ACTIONS.values()))
+    if step > 1:
+        data["project"] = project = rng.choice(projects)
+    if step > 2:
+        data["server"] = rng.choice(list(snapshot.server_options[project].values()))
+    if step > 3:
+        data["amount_kk"] = app.format_kk(Decimal(rng.randint(1, 1000)) / 10)
+        data["price_rub"] = rng.randint(100, 100_000)
+    if step > 4:
+        data["payment_type"] = rng.choice(list(app.PAYMENT_METHODS.values()))
+        data["user_id"] = user_id
+        data["username"] = f"user_{user_id:x}"
+    return f"OrderForm:{STEPS[step]}", data
+
+
+async def fill(storage, users, idle, seed):
+    import bot as app
+
+    rng = random.Random(seed)
+    snapshot = app.catalog.snapshot
+    projects = list(snapshot.project_options.values())
+    compact = isinstance(storage, CompactStorage)
+    gc.collect()
+    before = rss()
+    for i in range(users):
+        user_id = 10 ** 9 + i
+        key = make_key(user_id)
+        if rng.random() < idle:
+            await storage.get_state(key)
+            continue
+        state, data = abandoned_order(rng, app, snapshot, projects, user_id)
+        if compact:
+            await storage.set_state_and_data(key, state, data)
+        else:
+            await storage.set_state(key, state)
+            await storage.set_data(key, data)
+    gc.collect()
+    grown = rss() - before
+    sessions = len(storage._sessions) if compact else len(storage.storage)
+
+    # Обновление от случайного пользователя: чтение состояния и данных, запись следующего шага
+    ops = min(users, 100_000)
+    keys = [make_key(10 ** 9 + rng.randrange(users)) for _ in range(ops)]
+    started = time.perf_counter()
+    for key in keys:
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        data["payment_type"] = "СБП"
+        if compact:
+            await storage.set_state_and_data(key, "OrderForm:confirm", data)
+        else:
+            await storage.set_state(key, "OrderForm:confirm")
+            await storage.set_data(key, data)
+    update_us = (time.perf_counter() - started) / ops * 1e6
+    return {"bytes": grown, "sessions": sessions, "update_us": update_us}
+
+
+def child(args):
+    if args.child == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = CompactStorage(max_sessions=args.cap)
+    result = asyncio.run(fill(storage, args.child_users, args.idle, args.seed))
+    print(json.dumps(result))
+
+
+def measure(args, backend, users, cap=None):
+    command = [sys.executable, "-m", "benchmarks.fsm_memory", "--child", backend,
+               "--child-users", str(users), "--cap", str(cap or users),
+               "--idle", str(args.idle), "--seed", str(args.seed)]
+    env = dict(os.environ, BOT_TOKEN=os.getenv("BOT_TOKEN", "42:TEST"), LOG_LEVEL="WARNING")
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(args):
+    print(f"{args.idle * 100:.0f} % of users only opened the bot, the rest left an order on a random step")
+    for users in args.users:
+        rows = [("memory", None), ("compact", None)]
+        if args.cap and args.cap < users:
+            rows.append(("compact", args.cap))
+        for backend, cap in rows:
+            result = measure(args, backend, users, cap)
+            name = backend if cap is None else f"{backend}, cap {cap}"
+            kept = result["sessions"]
+            print(f"{users:>8} users  {name:<20} RSS +{result['bytes'] / 2 ** 20:7.1f} MiB  "
+                  f"{result['bytes'] / users:5.0f} B/user  records {kept:>8}  "
+                  f"{result['bytes'] / kept:5.0f} B/record  update {result['update_us']:5.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--idle", type=float, default=0.5, help="доля пользователей без заказа")
+    parser.add_argument("--cap", type=int, default=100_000, help="FSM_MAX_SESSIONS для третьего замера")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", choices=("memory", "compact"), help=argparse.SUPPRESS)
+    parser.add_argument("--child-users", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        run(args)
@@ -0,0 +1,94 @@
+# Отправка сообщений, пока висит long polling: один общий пул соединений против
+# отдельных пулов для getUpdates и для отправки (PooledSession).
+# Заглушка Bot API работает в том же процессе, задержка ответа — --latency-ms.
+#
+#   python -m benchmarks.http_pool --messages 500 --pool-size 4
+#   python -m benchmarks.http_pool --pool-size 1 --poll-timeout 2
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError
+
+from benchmarks import fake_api
+from benchmarks.common import percentile
+from http_session import PooledSession
+from keyboards import CachedMarkupSession
+
+
+async def long_poll(bot, timeout, stop):
+    while not stop.is_set():
+        await bot.get_updates(timeout=timeout, request_timeout=timeout + 5)
+
+
+async def run_mode(name, session, args):
+    bot = Bot(token="42:TEST", session=session)
+    stop = asyncio.Event()
+    poller = asyncio.create_task(long_poll(bot, args.poll_timeout, stop))
+    # Даём getUpdates занять соединение
+    await asyncio.sleep(0.1)
+
+    latencies = []
+    failed = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(i):
+        nonlocal failed
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await bot.send_message(chat_id=700_000 + i, text="ping", request_timeout=args.send_timeout)
+            except TelegramNetworkError:
+                failed += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(args.messages)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await poller
+    print(f"== {name}")
+    print(f"   messages/sec: {len(latencies) / elapsed:10.1f}")
+    print(f"   timed out:    {failed:10d}")
+    if not latencies:
+        latencies = [float("nan")]
+    print(f"   send p50:     {percentile(latencies, 50) * 1000:10.1f} ms")
+    print(f"   send p99:     {percentile(latencies, 99) * 1000:10.1f} ms")
+    print(f"   send max:     {max(latencies) * 1000:10.1f} ms")
+    if isinstance(session, PooledSession):
+        for pool, stats in session.pool_stats().items():
+            print(f"   pool {pool}: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+    await session.close()
+
+
+async def run(args):
+    api = fake_api.FakeBotApi(latency=args.latency_ms / 1000)
+    _, runner = await fake_api.start(api=api)
+    base = TelegramAPIServer.from_base(f"http://127.0.0.1:{runner.addresses[0][1]}")
+
+    print(f"messages: {args.messages}, concurrency: {args.concurrency}, pool size: {args.pool_size}, "
+          f"API latency: {args.latency_ms} ms, getUpdates timeout: {args.poll_timeout} s")
+    await run_mode("shared pool", CachedMarkupSession(api=base, limit=args.pool_size), args)
+    await run_mode(
+        "separate poll/send pools",
+        PooledSession(api=base, pool_size=args.pool_size, poll_pool_size=1),
+        args
+    )
+
+    await api.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--poll-timeout", type=int, default=2)
+    parser.add_argument("--send-timeout", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
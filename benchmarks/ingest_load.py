@@ -0,0 +1,103 @@
+# Нагрузочный тест приёма обновлений: polling против webhook
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.ingest_load --updates 5000 --concurrency 100
+#
+# Bot API заменён на FakeSession, поэтому измеряется только наша сторона:
+# приём обновления, диспетчеризация и работа хендлеров.
+import argparse
+import asyncio
+import time
+
+from aiohttp import ClientSession, web
+
+import bot as app
+from benchmarks.common import CompletionRecorder, FakeSession, make_update, report
+
+SECRET = "bench-secret"
+
+
+async def bench_polling(dp, recorder, updates):
+    session = app.bot.session
+    polling = asyncio.create_task(
+        dp.start_polling(app.bot, handle_signals=False, close_bot_session=False, polling_timeout=1)
+    )
+    started = time.perf_counter()
+    for update in updates:
+        recorder.expect(update.update_id)
+        session.updates.put_nowait(update)
+    await recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    report("polling", recorder.latencies, elapsed)
+
+
+async def bench_webhook(dp, recorder, updates, concurrency):
+    app.WEBHOOK_SECRET = SECRET
+    runner = web.AppRunner(app.build_webhook_app(dp))
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f"http://{host}:{port}{app.WEBHOOK_PATH}"
+
+    ack_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async def post(client, update):
+        payload = update.model_dump(mode="json", exclude_none=True)
+        async with semaphore:
+            recorder.expect(update.update_id)
+            sent = time.perf_counter()
+            async with client.post(url, json=payload, headers=headers) as resp:
+                await resp.read()
+                assert resp.status == 200, resp.status
+            ack_latencies.append(time.perf_counter() - sent)
+
+    started = time.perf_counter()
+    async with ClientSession() as client:
+        await asyncio.gather(*(post(client, update) for update in updates))
+    await recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+
+    ack_latencies.sort()
+    report("webhook", recorder.latencies, elapsed, extra={
+        "ack p99": f"{ack_latencies[int(0.99 * (len(ack_latencies) - 1))] * 1000:.2f} ms"
+    })
+
+
+async def run(args):
+    from aiogram import Dispatcher
+
+    app.bot.session = FakeSession(latency=args.api_latency)
+    dp = Dispatcher(storage=app.storage)
+    dp.include_router(app.create_router())
+
+    for mode in ("polling", "webhook") if args.mode == "both" else (args.mode,):
+        recorder = CompletionRecorder()
+        dp.update.outer_middleware.register(recorder)
+        updates = [make_update(1000 + i % args.users, args.text) for i in range(args.updates)]
+        if mode == "polling":
+            await bench_polling(dp, recorder, updates)
+        else:
+            await bench_webhook(dp, recorder, updates, args.concurrency)
+        dp.update.outer_middleware.unregister(recorder)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--text", default="/help")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="искусственная задержка Bot API, с")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Запросы к Bot API и байты на один заказ: reply-клавиатуры против inline-карточки
+# (UI_MODE=inline). Виртуальный пользователь проходит заказ с одним «Назад»;
+# в inline-режиме он нажимает кнопки последней полученной клавиатуры.
+#
+#   python -m benchmarks.inline_ui --users 500
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from aiogram import Dispatcher, types
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks.common import FakeSession, make_update
+from inline_ui import InlineScreen
+from keyboards import INLINE_TITLES, CachedMarkupSession
+from ledger import OrderLedger
+from notify import AdminNotifier
+
+SCRIPT = ["💸 Купить", "GTA5RP", "⬅ Назад", "GTA5RP", "Alta", "10кк", "📱 СБП", "✅ Подтвердить"]
+
+_ids = itertools.count(1)
+
+
+# Считает вызовы и размер тела запроса так, как его отправила бы настоящая сессия
+class RecordingSession(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.serializer = CachedMarkupSession(registry=app.catalog.snapshot.keyboards)
+        self.bytes = 0
+        self.cards = {}
+        self.markups = {}
+        self.menus = set()
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.bytes += self.serializer.build_form_data(bot, method)().size
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name == "answerCallbackQuery":
+            return True
+        if name == "editMessageText":
+            chat_id, message_id = int(method.chat_id), method.message_id
+        else:
+            chat_id, message_id = int(method.chat_id), next(self._message_ids)
+        if method.reply_markup is not None:
+            self.menus.add(chat_id)
+        if isinstance(method.reply_markup, types.InlineKeyboardMarkup):
+            self.cards[chat_id] = message_id
+            self.markups[chat_id] = method.reply_markup
+        return types.Message(
+            message_id=message_id,
+            date=datetime.now(),
+            chat=types.Chat(id=chat_id, type="private"),
+            text=method.text
+        )
+
+
+def callback_update(user_id, session, text):
+    title = INLINE_TITLES.get(text, text)
+    markup = session.markups[user_id]
+    data = next(
+        button.callback_data for row in markup.inline_keyboard for button in row if button.text == title
+    )
+    update_id = next(_ids)
+    user = types.User(id=user_id, is_bot=False, first_name="User", username=f"user{user_id}")
+    return types.Update(
+        update_id=update_id,
+        callback_query=types.CallbackQuery(
+            id=str(update_id),
+            from_user=user,
+            chat_instance=str(user_id),
+            data=data,
+            message=types.Message(
+                message_id=session.cards[user_id],
+                date=datetime.now(),
+                chat=types.Chat(id=user_id, type="private"),
+                text="…"
+            )
+        )
+    )
+
+
+async def run_mode(name, inline, users, tmp):
+    session = app.bot.session = RecordingSession()
+    app.UI_MODE = "inline" if inline else "reply"
+    app.inline_screen = None
+    if inline:
+        app.inline_screen = InlineScreen(lambda: app.catalog.snapshot.keyboards)
+        session.middleware(app.inline_screen)
+    app.ledger = OrderLedger(os.path.join(tmp, f"{name}.sqlite3"))
+    await app.ledger.start()
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(app.create_router())
+
+    async def user(user_id):
+        await dp.feed_update(app.bot, make_update(user_id, "/start"))
+        # Меню после приветствия приходит через секунду; пользователь его дожидается
+        while user_id not in session.menus:
+            await asyncio.sleep(0.05)
+        for text in SCRIPT:
+            if inline and text in app.catalog.snapshot.keyboards._index:
+                update = callback_update(user_id, session, text)
+            else:
+                update = make_update(user_id, text)
+            await dp.feed_update(app.bot, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(800_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await app.sequencer.close()
+    await app.ledger.close()
+
+    messages = session.calls.get("sendMessage", 0) + session.calls.get("editMessageText", 0)
+    total = sum(session.calls.values())
+    print(f"== {name}: {users} orders in {elapsed:.2f} s")
+    print(f"   API calls per order:       {total / users:6.2f}  {dict(sorted(session.calls.items()))}")
+    print(f"   rate-limited per order:    {messages / users:6.2f}  (sendMessage + editMessageText)")
+    print(f"   request bytes per order:   {session.bytes / users:8.0f}")
+    print(f"   orders recorded:           {app.ledger.written:6d}")
+    if inline:
+        print(f"   card edits skipped:        {app.inline_screen.unchanged:6d}  (content already shown)")
+    return total / users, messages / users, session.bytes / users
+
+
+async def run(users):
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        app.notifier = AdminNotifier(app.bot, os.path.join(tmp, "notify.sqlite3"))
+        await app.notifier.start(deliver=False)
+        reply = await run_mode("reply", False, users, tmp)
+        inline = await run_mode("inline", True, users, tmp)
+        await app.notifier.stop()
+    print(f"== inline vs reply: calls x{inline[0] / reply[0]:.2f}, "
+          f"rate-limited x{inline[1] / reply[1]:.2f}, bytes x{inline[2] / reply[2]:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.users))
@@ -0,0 +1,97 @@
+# Микробенчмарк CPU на сообщение: сборка клавиатур на лету против реестра
+# и повторная сериализация reply_markup против кэша JSON.
+#
+#   python -m benchmarks.keyboard_cpu --messages 5000
+import argparse
+import asyncio
+import time
+import timeit
+
+from aiogram import Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+
+import bot as app
+from benchmarks.common import FakeSession, make_update
+from keyboards import CachedMarkupSession
+
+
+# Так клавиатура серверов собиралась в каждом хендлере до реестра
+def build_servers_inline(project):
+    servers = app.catalog.snapshot.project_servers[project]
+    server_buttons = []
+    for i in range(0, len(servers), 2):
+        row = [types.KeyboardButton(text=server) for server in servers[i:i + 2]]
+        server_buttons.append(row)
+    server_buttons.append([types.KeyboardButton(text="⬅ Назад")])
+    return types.ReplyKeyboardMarkup(keyboard=server_buttons, resize_keyboard=True, one_time_keyboard=True)
+
+
+# Эмуляция старого поведения: новая разметка на каждое сообщение
+class RebuildServers(dict):
+    def __getitem__(self, project):
+        return build_servers_inline(project)
+
+    def get(self, project, default=None):
+        return build_servers_inline(project)
+
+
+def micro(number):
+    keyboards = app.catalog.snapshot.keyboards
+    plain = AiohttpSession()
+    cached = CachedMarkupSession(registry=keyboards)
+    inline = SendMessage(chat_id=1, text="❌", reply_markup=build_servers_inline("GTA5RP"))
+    prebuilt = SendMessage(chat_id=1, text="❌", reply_markup=keyboards.servers["GTA5RP"])
+
+    rows = [
+        ("build inline", lambda: build_servers_inline("GTA5RP")),
+        ("registry lookup", lambda: keyboards.servers["GTA5RP"]),
+        ("serialize plain", lambda: plain.build_form_data(app.bot, inline)),
+        ("serialize cached", lambda: cached.build_form_data(app.bot, prebuilt)),
+    ]
+    for title, func in rows:
+        seconds = timeit.timeit(func, number=number)
+        print(f"{title:<18} {seconds / number * 1e6:8.2f} us/op")
+
+
+async def handler_cpu(messages, serializer, inline):
+    app.bot.session = FakeSession(serializer=serializer)
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(app.create_router())
+
+    # Пользователь стоит на выборе сервера и шлёт неверный ввод — хендлер отвечает клавиатурой серверов
+    user_id = 777
+    key = StorageKey(bot_id=app.bot.id, chat_id=user_id, user_id=user_id)
+    await storage.set_state(key, app.OrderForm.server)
+    await storage.set_data(key, {"action": "Купить", "project": "GTA5RP"})
+
+    keyboards = app.catalog.snapshot.keyboards
+    registry_servers = keyboards.servers
+    if inline:
+        keyboards.servers = RebuildServers()
+    updates = [make_update(user_id, "Nowhere") for _ in range(messages)]
+    started = time.process_time()
+    for update in updates:
+        await dp.feed_update(app.bot, update)
+    spent = time.process_time() - started
+    keyboards.servers = registry_servers
+    return spent / messages
+
+
+async def run(messages):
+    before = await handler_cpu(messages, AiohttpSession(), inline=True)
+    registry = app.catalog.snapshot.keyboards
+    after = await handler_cpu(messages, CachedMarkupSession(registry=registry), inline=False)
+    print(f"handler CPU, rebuild + serialize: {before * 1e6:8.1f} us/message")
+    print(f"handler CPU, registry + cache:    {after * 1e6:8.1f} us/message")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+    micro(args.messages)
+    asyncio.run(run(args.messages))
@@ -0,0 +1,92 @@
+# Пропускная способность подтверждения заказа с журналом заказов:
+#   off    — журнал отключён
+#   inline — синхронный INSERT + COMMIT прямо в хендлере
+#   ledger — OrderLedger с фоновой групповой записью
+#
+#   python -m benchmarks.ledger_confirm --orders 2000
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks.common import FakeSession, make_update, prepare_confirm
+from ledger import ORDER_FIELDS, SCHEMA, OrderIdGenerator, OrderLedger
+from notify import AdminNotifier
+
+
+class NoLedger:
+    def __init__(self):
+        self.ids = OrderIdGenerator()
+
+    async def add(self, order):
+        return self.ids.next_id()
+
+
+# Так выглядела бы запись без фонового писателя: fsync на каждом заказе в event loop
+class InlineLedger(NoLedger):
+    def __init__(self, path):
+        super().__init__()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+    async def add(self, order):
+        order = dict(order, id=self.ids.next_id(), status="pending_payment")
+        self.conn.execute(
+            f"INSERT INTO orders ({', '.join(ORDER_FIELDS)}) VALUES ({', '.join('?' for _ in ORDER_FIELDS)})",
+            tuple(order.get(field) for field in ORDER_FIELDS)
+        )
+        self.conn.commit()
+        return order["id"]
+
+
+async def run_mode(name, ledger, orders):
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(app.create_router())
+    app.ledger = ledger
+    for i in range(orders):
+        await prepare_confirm(storage, app.bot, 10_000 + i, app.OrderForm.confirm)
+
+    updates = [make_update(10_000 + i, app.CONFIRM_BUTTON) for i in range(orders)]
+    started = time.perf_counter()
+    await asyncio.gather(*(dp.feed_update(app.bot, update) for update in updates))
+    handled = time.perf_counter() - started
+    if isinstance(ledger, OrderLedger):
+        await ledger.flush()
+    durable = time.perf_counter() - started
+
+    extra = ""
+    if isinstance(ledger, OrderLedger):
+        extra = f"  ({ledger.written} rows in {ledger.batches} commits)"
+    print(f"{name:<7} {orders / handled:8.0f} confirms/sec, all durable after {durable:.3f} s{extra}")
+
+
+async def run(orders):
+    app.bot.session = FakeSession()
+    with tempfile.TemporaryDirectory() as tmp:
+        app.notifier = AdminNotifier(app.bot, os.path.join(tmp, "notify.sqlite3"))
+        await app.notifier.start()
+        await run_mode("off", NoLedger(), orders)
+        await run_mode("inline", InlineLedger(os.path.join(tmp, "inline.sqlite3")), orders)
+        ledger = OrderLedger(os.path.join(tmp, "ledger.sqlite3"))
+        await ledger.start()
+        await run_mode("ledger", ledger, orders)
+        sample = await ledger.orders_by_server("GTA5RP", "Alta", since=0)
+        print(f"query by project/server returned {len(sample)} orders")
+        await ledger.close()
+        await app.notifier.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.orders))
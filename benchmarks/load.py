@@ -0,0 +1,210 @@
+# Сквозной нагрузочный тест: настоящий bot.py в отдельном процессе против локальной
+# заглушки Bot API. Виртуальные пользователи проходят заказ от /start до подтверждения.
+#
+#   python -m benchmarks.load --users 2000 --concurrency 500
+#   python -m benchmarks.load --mode webhook --workers 2 --storage sqlite
+#   python -m benchmarks.load --latency-ms 50 --error-429 0.01 --error-5xx 0.01 --scheduler
+#
+# Шаг считается выполненным, когда бот прислал сообщение с клавиатурой следующего шага.
+# Задержки: "first reply" — до первого ответа бота, "step" — до клавиатуры следующего шага
+# (для /start сюда входит пауза перед меню).
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_api
+from benchmarks.common import ORDER_FLOW, percentile
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+WEBHOOK_SECRET = "load-test-secret"
+
+_update_ids = itertools.count(1)
+
+
+def update_dict(user_id, text):
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+# Ожидание ответа бота в чате виртуального пользователя
+class Waiter:
+    __slots__ = ("first", "done")
+
+    def __init__(self, loop):
+        self.first = loop.create_future()
+        self.done = loop.create_future()
+
+
+class LoadTest:
+    def __init__(self, api, step_timeout):
+        self.api = api
+        self.step_timeout = step_timeout
+        self.waiters = {}
+        self.first_reply = {text: [] for text in ORDER_FLOW}
+        self.step = {text: [] for text in ORDER_FLOW}
+        self.timeouts = {text: 0 for text in ORDER_FLOW}
+        self.completed = 0
+        api.on_message = self.on_message
+
+    def on_message(self, chat_id, params):
+        waiter = self.waiters.get(chat_id)
+        if waiter is None:
+            return
+        now = time.perf_counter()
+        if not waiter.first.done():
+            waiter.first.set_result(now)
+        if '"keyboard"' in str(params.get("reply_markup", "")) and not waiter.done.done():
+            waiter.done.set_result(now)
+
+    async def user(self, user_id, semaphore):
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            for text in ORDER_FLOW:
+                waiter = self.waiters[user_id] = Waiter(loop)
+                sent = time.perf_counter()
+                self.api.push_update(update_dict(user_id, text))
+                try:
+                    done = await asyncio.wait_for(waiter.done, self.step_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts[text] += 1
+                    return
+                finally:
+                    del self.waiters[user_id]
+                self.first_reply[text].append(waiter.first.result() - sent)
+                self.step[text].append(done - sent)
+            self.completed += 1
+
+
+def bot_env(args, api_port, webhook_port, tmp):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "BOT_MODE": args.mode,
+        "BOT_WORKERS": str(args.workers),
+        "WORKER_ID": "0",
+        "SEND_SCHEDULER": "on" if args.scheduler else "off",
+        "FSM_STORAGE": args.storage,
+        "FSM_SQLITE_PATH": os.path.join(tmp, "fsm.sqlite3"),
+        "LEDGER_PATH": os.path.join(tmp, "orders.sqlite3"),
+        "METRICS_PORT": "0",
+        "LOG_FILE": "",
+        "LOG_LEVEL": "WARNING",
+    })
+    if args.mode == "webhook":
+        env.update({
+            "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(webhook_port),
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        })
+    return env
+
+
+async def wait_ready(api, mode, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"bot.py exited with code {process.returncode}")
+        if mode == "webhook" and api.webhook_url:
+            return
+        if mode == "polling" and api.calls.get("getUpdates"):
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError("bot.py did not start in time")
+
+
+def count_orders(path):
+    if not os.path.exists(path):
+        return 0
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def print_latencies(title, samples):
+    merged = [value for values in samples.values() for value in values]
+    print(f"   {title + ':':<13} p50 {percentile(merged, 50) * 1000:8.1f} ms   "
+          f"p99 {percentile(merged, 99) * 1000:8.1f} ms")
+
+
+async def run(args):
+    api = fake_api.from_arguments(args)
+    _, runner = await fake_api.start(port=args.api_port, api=api)
+    api_port = runner.addresses[0][1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, BOT_SCRIPT, env=bot_env(args, api_port, args.webhook_port, tmp)
+        )
+        try:
+            started = time.perf_counter()
+            await wait_ready(api, args.mode, process)
+            startup = time.perf_counter() - started
+
+            test = LoadTest(api, args.step_timeout)
+            semaphore = asyncio.Semaphore(args.concurrency)
+            started = time.perf_counter()
+            await asyncio.gather(*(test.user(600_000 + i, semaphore) for i in range(args.users)))
+            elapsed = time.perf_counter() - started
+        finally:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+            await process.wait()
+        orders = count_orders(os.path.join(tmp, "orders.sqlite3"))
+
+    await api.close()
+    await runner.cleanup()
+
+    steps = sum(len(values) for values in test.step.values())
+    timeouts = sum(test.timeouts.values())
+    sent = api.calls.get("sendMessage", 0)
+    errors = sum(count for key, count in api.errors.items() if key.startswith("sendMessage"))
+
+    print(f"== {args.mode}, {args.workers} worker(s), storage={args.storage}, "
+          f"scheduler={'on' if args.scheduler else 'off'}")
+    print(f"   startup:      {startup:.2f} s")
+    print(f"   users:        {args.users} (concurrency {args.concurrency}), finished: {test.completed}")
+    print(f"   elapsed:      {elapsed:.2f} s")
+    print(f"   steps/sec:    {steps / elapsed:.1f}")
+    print(f"   orders/sec:   {test.completed / elapsed:.1f}")
+    print_latencies("first reply", test.first_reply)
+    print_latencies("step", test.step)
+    for text in ORDER_FLOW:
+        values = test.step[text]
+        print(f"     {text:<16} p50 {percentile(values, 50) * 1000:8.1f} ms   "
+              f"p99 {percentile(values, 99) * 1000:8.1f} ms   timeouts {test.timeouts[text]}")
+    print(f"   step timeouts: {timeouts} ({timeouts / max(1, steps + timeouts) * 100:.2f} %)")
+    print(f"   sendMessage:   {sent} calls, {errors} injected errors ({errors / max(1, sent) * 100:.2f} %)")
+    if api.errors:
+        print(f"   API errors:    {api.errors}")
+    # Заказ может попасть в журнал, даже если ответ на подтверждение не дошёл до пользователя
+    print(f"   orders in ledger: {orders} (users who finished the flow: {test.completed})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--storage", choices=("compact", "memory", "sqlite"), default="compact")
+    parser.add_argument("--scheduler", action="store_true", help="с лимитами Telegram на отправку")
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--api-port", type=int, default=0)
+    parser.add_argument("--webhook-port", type=int, default=8182)
+    fake_api.add_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
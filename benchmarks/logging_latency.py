@@ -0,0 +1,115 @@
+# Задержка обработки обновлений в зависимости от логирования:
+#   off   — логирование выключено
+#   sync  — прежняя схема: FileHandler пишет прямо из event loop
+#   queue — LazyQueueHandler + QueueListener из logging_setup
+#
+# --stall-ms эмулирует медленный диск: каждая --stall-every запись в файл
+# блокирует пишущий поток на указанное время.
+#
+#   python -m benchmarks.logging_latency --users 2000 --stall-ms 20
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks.common import ORDER_FLOW, FakeSession, make_update, percentile
+from logging_setup import TEXT_FORMAT, LazyQueueHandler
+
+# Без подтверждения: журнал заказов в этом бенчмарке не запущен
+STEPS = ORDER_FLOW[:-1]
+
+
+class StalledFileHandler(logging.FileHandler):
+    def __init__(self, path, stall, every):
+        super().__init__(path, encoding="utf-8")
+        self.stall = stall
+        self.every = every
+        self.count = 0
+
+    def emit(self, record):
+        super().emit(record)
+        self.count += 1
+        if self.stall and self.count % self.every == 0:
+            time.sleep(self.stall)
+
+
+def install(mode, path, stall, every):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    logging.disable(logging.NOTSET)
+    root.setLevel(logging.INFO)
+    if mode == "off":
+        logging.disable(logging.CRITICAL)
+        return None, None, None
+
+    file_handler = StalledFileHandler(path, stall, every)
+    file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    if mode == "sync":
+        root.addHandler(file_handler)
+        return file_handler, None, None
+
+    queue_handler = LazyQueueHandler(queue.Queue(maxsize=100_000))
+    root.addHandler(queue_handler)
+    listener = QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    return file_handler, queue_handler, listener
+
+
+async def run_mode(mode, users, path, stall, every):
+    file_handler, queue_handler, listener = install(mode, path, stall, every)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(app.create_router())
+    latencies = []
+
+    async def user(user_id):
+        for text in STEPS:
+            started = time.perf_counter()
+            await dp.feed_update(app.bot, make_update(user_id, text))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(200_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await app.sequencer.close()
+
+    if listener is not None:
+        listener.stop()
+    if file_handler is not None:
+        file_handler.close()
+
+    print(f"== {mode}")
+    print(f"   updates/sec: {len(latencies) / elapsed:10.1f}")
+    print(f"   p50 / p99:   {percentile(latencies, 50) * 1000:7.2f} / "
+          f"{percentile(latencies, 99) * 1000:7.2f} ms")
+    print(f"   max:         {max(latencies) * 1000:7.2f} ms")
+    if file_handler is not None:
+        print(f"   lines:       {file_handler.count}")
+    if queue_handler is not None:
+        print(f"   dropped:     {queue_handler.dropped}")
+
+
+async def run(args):
+    app.bot.session = FakeSession()
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("off", "sync", "queue"):
+            await run_mode(mode, args.users, os.path.join(tmp, f"{mode}.log"),
+                           args.stall_ms / 1000, args.stall_every)
+    logging.disable(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--stall-ms", type=float, default=0.0)
+    parser.add_argument("--stall-every", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
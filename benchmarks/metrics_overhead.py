@@ -0,0 +1,99 @@
+# Во что обходятся метрики: сценарий заказа без инструментирования и с ним
+# (HandlerMetricsMiddleware + TimedStorage), затем запрос к /metrics.
+#
+#   python -m benchmarks.metrics_overhead --users 2000
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import ClientSession
+
+import bot as app
+from benchmarks.common import ORDER_FLOW, FakeSession, make_update, percentile
+from metrics import HandlerMetricsMiddleware, TimedStorage, registry, start_metrics_server
+
+# Без подтверждения: журнал заказов в этом бенчмарке не запущен
+STEPS = ORDER_FLOW[:-1]
+
+# Сценарий с возвратами и сколько раз он должен засчитать каждый шаг воронки:
+# «Назад» шаг не засчитывает, повторный выбор после возврата — снова переход вперёд
+BACK_STEPS = ["/start", "💸 Купить", "GTA5RP", "⬅ Назад", "⬅ Назад", "💰 Продать", "GTA5RP",
+              "Alta", "12кк", "⬅ Назад", "12кк", "📱 СБП"]
+BACK_FUNNEL = {"action": 1, "project": 2, "server": 2, "amount": 1, "payment_type": 2, "confirm": 1}
+
+
+# Воронка не должна расти от возвратов кнопкой «Назад»
+async def check_funnel():
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(app.create_router())
+    before = dict(app.FUNNEL.values)
+    for text in BACK_STEPS:
+        await dp.feed_update(app.bot, make_update(399_999, text))
+    await app.sequencer.close()
+    counted = {labels[0]: value - before.get(labels, 0)
+               for labels, value in app.FUNNEL.values.items() if value != before.get(labels, 0)}
+    if counted != BACK_FUNNEL:
+        print(f"ERROR: funnel with back navigation counted {counted}, expected {BACK_FUNNEL}")
+        return False
+    print(f"== funnel with back navigation: {counted}")
+    return True
+
+
+async def run_mode(name, router, storage, users):
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    latencies = []
+
+    async def user(user_id):
+        for text in STEPS:
+            started = time.perf_counter()
+            await dp.feed_update(app.bot, make_update(user_id, text))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(300_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await app.sequencer.close()
+
+    print(f"== {name}")
+    print(f"   updates/sec: {len(latencies) / elapsed:10.1f}")
+    print(f"   p50 / p99:   {percentile(latencies, 50) * 1000:7.3f} / "
+          f"{percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+async def run(users):
+    logging.disable(logging.CRITICAL)
+    app.bot.session = FakeSession()
+    if not await check_funnel():
+        return 1
+    router = app.create_router()
+    manager = router.message.middleware
+    for m in [m for m in manager if isinstance(m, HandlerMetricsMiddleware)]:
+        manager.unregister(m)
+    await run_mode("without metrics", router, MemoryStorage(), users)
+
+    await run_mode("with metrics", app.create_router(), TimedStorage(MemoryStorage()), users)
+
+    runner = await start_metrics_server("127.0.0.1", 0)
+    host, port = runner.addresses[0][:2]
+    async with ClientSession() as client:
+        started = time.perf_counter()
+        async with client.get(f"http://{host}:{port}/metrics") as resp:
+            body = await resp.text()
+        scrape = time.perf_counter() - started
+    await runner.cleanup()
+    print(f"== /metrics: {len(body.splitlines())} lines, {len(body)} bytes, {scrape * 1000:.1f} ms")
+    print(f"   funnel: { {labels[0]: value for labels, value in app.FUNNEL.values.items()} }")
+    print(f"   metrics registered: {len(registry.metrics)}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.users)))
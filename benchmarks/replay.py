@@ -0,0 +1,407 @@
+# Воспроизведение трассы обновлений (update_trace.py) через Dispatcher и router бота без сети:
+# Bot API — заглушка, хранилище FSM и журнал заказов — свои на каждый проход.
+# Отчёт: CPU хендлеров по шагам OrderForm (thread_time), память (tracemalloc: пик и остаток
+# на вызов), вызовы Bot API по шагам, CPU и время на обновление. С --baseline — сравнение
+# с сохранённым отчётом; при регрессии процесс завершается с кодом 1.
+#
+# Защита от флуда и учёт мягкой остановки не подключаются: при прогоне без пауз весь поток
+# пришёл бы «одновременно». Уведомления админу только ставятся в очередь, без доставки.
+# Отложенные сообщения (меню после /start) при прогоне без пауз отменяет следующее сообщение
+# пользователя — сравнивать отчёты можно только с одинаковым --speed.
+#
+# Трасса с бота: UPDATE_TRACE=updates.jsonl.gz в окружении. Синтетическая:
+#   python -m benchmarks.replay --make-trace /tmp/trace.jsonl.gz --users 500
+#   python -m benchmarks.replay /tmp/trace.jsonl.gz --save-baseline /tmp/replay-base.json
+#   python -m benchmarks.replay /tmp/trace.jsonl.gz --baseline /tmp/replay-base.json
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+from benchmarks.common import FakeSession, make_update, percentile
+from update_trace import Anonymizer, UpdateRecorder, open_trace, read_trace
+
+# Шаг OrderForm обновления, которое сейчас обрабатывается; фоновые задачи наследуют его
+current_step = contextvars.ContextVar("replay_step", default="background")
+
+# Сколько ждать отложенные сообщения после последнего обновления
+SEQUENCE_WAIT = 2.0
+
+# Эталонная нагрузка в тех же единицах: скорость виртуальной машины плавает между запусками
+# на 20–30 %, и без поправки на неё одинаковый код сравнивался бы с базой как регрессия
+CALIBRATION = [{"user_id": i, "step": "OrderForm:amount", "data": {"amount_kk": f"{i}кк"}} for i in range(200)]
+
+# Текст сообщения → каким он должен попасть в трассу: телефоны и номера карт закрываются,
+# даже если parse_kk принимает их за число виртов; суммы, которые примет бот, остаются
+ANONYMIZED_TEXTS = {
+    "89161234567": "00000000000",
+    "+7 (916) 123-45-67": "+0 (000) 000-00-00",
+    "мой номер 89161234567": "мой номер 00000000000",
+    "4276123412341234": "0000000000000000",
+    "4276 1234 1234 1234": "0000 0000 0000 0000",
+    "12 345 678 901": "00 000 000 000",
+    "916123456": "000000000",
+    "me@example.com": "xx@xxxxxxx.xxx",
+    "12кк": "12кк",
+    "7.5кк": "7.5кк",
+    "1 500 000": "1 500 000",
+    "100000000": "100000000",
+}
+
+
+# Считает вызовы Bot API по шагу и методу
+class ReplaySession(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.by_step = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        key = (current_step.get(), method.__api_method__)
+        self.by_step[key] = self.by_step.get(key, 0) + 1
+        return await super().make_request(bot, method, timeout)
+
+
+# Inner middleware роутера, ставится последним — ближе всего к хендлеру.
+# Накопленное по «хендлер@шаг»: вызовы, CPU, пик и остаток памяти, ошибки
+class HandlerProfiler(BaseMiddleware):
+    def __init__(self):
+        self.reset()
+
+    def reset(self, alloc=False):
+        self.alloc = alloc
+        self.handlers = {}
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        raw_state = data.get("raw_state")
+        step = raw_state.rsplit(":", 1)[-1] if raw_state else "none"
+        name = f"{handler_object.callback.__name__ if handler_object is not None else 'unknown'}@{step}"
+        stats = self.handlers.setdefault(name, [0, 0.0, 0, 0, 0])
+        token = current_step.set(step)
+        if self.alloc:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started = time.thread_time()
+        try:
+            return await handler(event, data)
+        except Exception:
+            stats[4] += 1
+            raise
+        finally:
+            stats[1] += time.thread_time() - started
+            if self.alloc:
+                current, peak = tracemalloc.get_traced_memory()
+                stats[2] += peak - base
+                stats[3] += current - base
+            stats[0] += 1
+            current_step.reset(token)
+
+
+async def replay_pass(app, updates, profiler, speed=0.0, alloc=False):
+    from metrics import TimedStorage
+    from storage import create_storage
+
+    session = app.bot.session = ReplaySession()
+    if app.UI_MODE == "inline":
+        session.middleware(app.inline_screen)
+    storage = TimedStorage(create_storage())
+    router = app.create_router()
+    router.message.middleware(profiler)
+    router.callback_query.middleware(profiler)
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    profiler.reset(alloc)
+    written = app.ledger.written
+    latencies = []
+    errors = 0
+
+    async def feed(update):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(app.bot, update)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    if alloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    if speed:
+        first = updates[0][0]
+        tasks = []
+        for at, update in updates:
+            delay = (at - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(feed(update)))
+        await asyncio.gather(*tasks)
+    else:
+        for _, update in updates:
+            await feed(update)
+    cpu = time.thread_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    await app.sequencer.join(SEQUENCE_WAIT)
+    if alloc:
+        tracemalloc.stop()
+    await app.sequencer.close()
+    await app.ledger.flush()
+    await storage.close()
+    return {
+        "updates": len(updates),
+        "orders": app.ledger.written - written,
+        "errors": errors,
+        "elapsed": elapsed,
+        "update_cpu_us": cpu / len(updates) * 1e6,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "handlers": {name: list(stats) for name, stats in profiler.handlers.items()},
+        "calls": {f"{step} {method}": count for (step, method), count in sorted(session.by_step.items())},
+    }
+
+
+# Лучшее время эталонной нагрузки, мкс
+def calibrate(rounds=20):
+    best = None
+    for _ in range(rounds):
+        started = time.thread_time()
+        json.loads(json.dumps(CALIBRATION, ensure_ascii=False))
+        sorted(CALIBRATION, key=lambda item: item["data"]["amount_kk"])
+        spent = time.thread_time() - started
+        best = spent if best is None else min(best, spent)
+    return best * 1e6
+
+
+# Несколько проходов для CPU (берётся лучший), один под tracemalloc для памяти
+async def replay(app, updates, args):
+    profiler = HandlerProfiler()
+    await app.ledger.start()
+    await app.notifier.start(deliver=False)
+    passes = []
+    calibration = []
+    for _ in range(args.repeat):
+        calibration.append(calibrate())
+        passes.append(await replay_pass(app, updates, profiler, args.speed))
+    calibration.append(calibrate())
+    traced = await replay_pass(app, updates, profiler, alloc=True) if args.alloc else None
+    await app.notifier.stop()
+    await app.ledger.close()
+
+    best = min(passes, key=lambda result: result["update_cpu_us"])
+    report = {
+        "speed": args.speed,
+        "updates": best["updates"],
+        "errors": best["errors"],
+        "orders": best["orders"],
+        "update_cpu_us": best["update_cpu_us"],
+        "calibration_us": min(calibration),
+        "updates_per_sec": best["updates"] / best["elapsed"],
+        "p50_ms": best["p50_ms"],
+        "p99_ms": best["p99_ms"],
+        "handlers": {},
+        "calls": best["calls"],
+    }
+    for name in sorted(best["handlers"]):
+        calls = best["handlers"][name][0]
+        entry = report["handlers"][name] = {
+            "calls": calls,
+            "cpu_us": min(result["handlers"][name][1] / result["handlers"][name][0]
+                          for result in passes if name in result["handlers"]) * 1e6,
+            "errors": best["handlers"][name][4],
+        }
+        if traced is not None and name in traced["handlers"]:
+            stats = traced["handlers"][name]
+            entry["alloc_peak"] = stats[2] / stats[0]
+            entry["alloc_retained"] = stats[3] / stats[0]
+    return report
+
+
+def change(current, base):
+    if not base:
+        return ""
+    return f"{(current / base - 1) * 100:+6.1f} %"
+
+
+def print_report(report, baseline, args):
+    mode = "as fast as possible" if not args.speed else f"speed x{args.speed:g}"
+    print(f"== {report['updates']} updates, {mode}: {report['updates_per_sec']:.0f} updates/sec, "
+          f"cpu {report['update_cpu_us']:.1f} us/update {change(report['update_cpu_us'], baseline.get('update_cpu_us'))}, "
+          f"p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, errors {report['errors']}")
+    if baseline.get("calibration_us"):
+        print(f"   machine speed against baseline: reference load {change(report['calibration_us'], baseline['calibration_us'])}")
+    print(f"   orders confirmed: {report['orders']} of {report['confirmations']} confirmations in the trace"
+          + (f" (baseline {baseline['orders']})" if baseline and baseline.get("orders") != report["orders"] else ""))
+    print(f"== {'handler@step':<34} {'calls':>6} {'cpu us':>9} {'':>9} {'peak B':>9} {'':>9} {'kept B':>8}")
+    base_handlers = baseline.get("handlers", {})
+    for name, entry in report["handlers"].items():
+        base = base_handlers.get(name, {})
+        line = f"   {name:<34} {entry['calls']:>6} {entry['cpu_us']:>9.1f} {change(entry['cpu_us'], base.get('cpu_us')):>9}"
+        if "alloc_peak" in entry:
+            line += (f" {entry['alloc_peak']:>9.0f} {change(entry['alloc_peak'], base.get('alloc_peak')):>9}"
+                     f" {entry['alloc_retained']:>8.0f}")
+        print(line + (f"  errors {entry['errors']}" if entry["errors"] else ""))
+    print("== Bot API calls by OrderForm step")
+    base_calls = baseline.get("calls", {})
+    for key in sorted(set(report["calls"]) | set(base_calls)):
+        count = report["calls"].get(key, 0)
+        was = f"  (baseline {base_calls.get(key, 0)})" if baseline and base_calls.get(key, 0) != count else ""
+        print(f"   {key:<40} {count:>7}{was}")
+
+
+# Что ухудшилось относительно базы: CPU и память — выше порога, вызовы Bot API — любое отличие
+def regressions(report, baseline, args):
+    found = []
+    if baseline.get("speed") != report["speed"] or baseline.get("updates") != report["updates"]:
+        return [f"baseline was taken on a different trace or --speed ({baseline.get('updates')} updates, "
+                f"speed {baseline.get('speed')})"]
+    # CPU базы пересчитывается на скорость машины в этом прогоне
+    scale = report["calibration_us"] / baseline["calibration_us"] if baseline.get("calibration_us") else 1.0
+    if report["update_cpu_us"] > baseline["update_cpu_us"] * scale * (1 + args.cpu_threshold / 100):
+        found.append(f"cpu per update {change(report['update_cpu_us'], baseline['update_cpu_us'] * scale)}")
+    for name, entry in report["handlers"].items():
+        base = baseline["handlers"].get(name)
+        if base is None:
+            continue
+        # Разница меньше пары микросекунд — шум таймера, а не регрессия
+        if (entry["cpu_us"] - base["cpu_us"] * scale > 2
+                and entry["cpu_us"] > base["cpu_us"] * scale * (1 + args.cpu_threshold / 100)):
+            found.append(f"{name}: cpu {change(entry['cpu_us'], base['cpu_us'] * scale)}")
+        if "alloc_peak" in entry and "alloc_peak" in base and (
+                entry["alloc_peak"] - base["alloc_peak"] > 256
+                and entry["alloc_peak"] > base["alloc_peak"] * (1 + args.alloc_threshold / 100)):
+            found.append(f"{name}: allocations {change(entry['alloc_peak'], base['alloc_peak'])}")
+        if entry["errors"] > base["errors"]:
+            found.append(f"{name}: errors {base['errors']} → {entry['errors']}")
+    if report["orders"] != baseline.get("orders"):
+        found.append(f"orders confirmed: {baseline.get('orders')} → {report['orders']}")
+    if report["calls"] != baseline["calls"]:
+        found.append("Bot API calls by step differ")
+    return found
+
+
+# Синтетическая трасса: заказы целиком, брошенные на полпути, с ошибками ввода и возвратами,
+# справка. Пользователи приходят равномерно за duration секунд и думают 1–4 с между сообщениями
+def scripted_user(rng, app, snapshot):
+    project = rng.choice(list(snapshot.project_options))
+    server = rng.choice(list(snapshot.server_options[snapshot.project_options[project]]))
+    action = rng.choice(list(app.ACTIONS))
+    amount = rng.choice(["12кк", "5", "7.5кк", "100кк", "1 кк", "50", "12000000", "1 500 000"])
+    payment = rng.choice(list(app.PAYMENT_METHODS))
+    order = ["/start", action, project, server, amount, payment]
+    kind = rng.random()
+    if kind < 0.4:
+        return order + [app.CONFIRM_BUTTON]
+    if kind < 0.6:
+        return ["/start", action, "нет такого проекта", project, "⬅ Назад", project, server,
+                "много", amount, payment, "⬅ Назад", payment, app.CONFIRM_BUTTON]
+    if kind < 0.75:
+        return order + [app.CANCEL_BUTTON]
+    if kind < 0.9:
+        return order[:rng.randint(2, 5)]
+    return ["/help", "/start", rng.choice(app.INFO_BUTTONS), "/help"]
+
+
+async def make_trace(app, args):
+    rng = random.Random(args.seed)
+    snapshot = app.catalog.snapshot
+    events = []
+    for i in range(args.users):
+        at = rng.uniform(0, args.duration)
+        for text in scripted_user(rng, app, snapshot):
+            events.append((at, 800_000 + i, text))
+            at += rng.uniform(1, 4)
+    events.sort()
+    open_trace(args.make_trace, "wt").close()
+    recorder = UpdateRecorder(args.make_trace, secret=str(args.seed), queue_size=len(events) + 1)
+    await recorder.start()
+    now = time.time()
+    for update_id, (at, user_id, text) in enumerate(events, 1):
+        recorder.record(make_update(user_id, text, update_id), at=now + at)
+    await recorder.close()
+    print(f"{recorder.written} updates from {args.users} users written to {args.make_trace}")
+    leaked = {text: Anonymizer.text(text) for text, expected in ANONYMIZED_TEXTS.items()
+              if Anonymizer.text(text) != expected}
+    for text, result in leaked.items():
+        print(f"ERROR: {text!r} anonymized as {result!r}, expected {ANONYMIZED_TEXTS[text]!r}")
+    if leaked:
+        return 1
+    # В синтетической трассе нет личных данных: обезличивание не должно поменять ни одного текста
+    recorded = [raw["message"]["text"] for _, raw in read_trace(args.make_trace)]
+    altered = sum(text != original for text, (_, _, original) in zip(recorded, events))
+    if altered:
+        print(f"ERROR: anonymization altered {altered} message texts")
+        return 1
+    return 0
+
+
+async def run(args):
+    logging.disable(logging.CRITICAL)
+    tmp = tempfile.mkdtemp(prefix="replay-")
+    os.environ["LEDGER_PATH"] = os.path.join(tmp, "orders.sqlite3")
+    os.environ.pop("NOTIFY_PATH", None)
+    os.environ.setdefault("FSM_STORAGE", "compact")
+    import bot as app
+
+    if args.make_trace:
+        return await make_trace(app, args)
+    updates = [(at, Update.model_validate(raw, context={"bot": app.bot})) for at, raw in read_trace(*args.trace)]
+    if not updates:
+        print("trace is empty")
+        return 1
+    report = await replay(app, updates, args)
+    report["confirmations"] = sum(
+        update.message is not None and update.message.text == app.CONFIRM_BUTTON for _, update in updates
+    )
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline, args)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"baseline saved to {args.save_baseline}")
+    # Заказ из трассы, дошедший до подтверждения, должен снова дойти до журнала
+    if report["confirmations"] and not report["orders"]:
+        print("ERROR: no recorded order reached confirmation")
+        return 1
+    if not baseline:
+        return 0
+    found = regressions(report, baseline, args)
+    for line in found:
+        print(f"REGRESSION: {line}")
+    if not found:
+        print("no regressions against baseline")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace", nargs="*", help="файлы трассы; трассы воркеров сливаются по времени")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0 — без пауз, по одному обновлению; 1 — с исходными паузами; 10 — в 10 раз быстрее")
+    parser.add_argument("--repeat", type=int, default=3, help="проходов для замера CPU, берётся лучший")
+    parser.add_argument("--no-alloc", dest="alloc", action="store_false", help="без прохода под tracemalloc")
+    parser.add_argument("--baseline", help="отчёт для сравнения")
+    parser.add_argument("--save-baseline", help="куда сохранить отчёт этого прогона")
+    parser.add_argument("--cpu-threshold", type=float, default=20.0, help="допустимый рост CPU, %%")
+    parser.add_argument("--alloc-threshold", type=float, default=10.0, help="допустимый рост пика памяти, %%")
+    parser.add_argument("--make-trace", help="записать синтетическую трассу в этот файл и выйти")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=60.0, help="секунд, за которые приходят пользователи")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not args.trace and not args.make_trace:
+        parser.error("trace file or --make-trace is required")
+    sys.exit(asyncio.run(run(args)))
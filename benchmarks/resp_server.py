@@ -0,0 +1,142 @@
+# Локальная замена Redis для разработки и бенчмарков.
+# Понимает только команды, которые использует RespStorage.
+#
+#   python -m benchmarks.resp_server --port 6390
+import argparse
+import asyncio
+import fnmatch
+import time
+
+
+class RespServer:
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.strings.pop(key, None)
+            self.hashes.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.strings or key in self.hashes
+
+    def _set_px(self, key, ms):
+        self.expires[key] = time.monotonic() + int(ms) / 1000
+
+    def execute(self, args):
+        name = args[0].upper()
+        if name in ("PING", "SELECT", "AUTH"):
+            return "+PONG" if name == "PING" else "+OK"
+        if name == "GET":
+            return self.strings.get(args[1]) if self._alive(args[1]) else None
+        if name == "SET":
+            key = args[1]
+            self.strings[key] = args[2]
+            self.expires.pop(key, None)
+            if len(args) >= 5 and args[3].upper() == "PX":
+                self._set_px(key, args[4])
+            return "+OK"
+        if name == "DEL":
+            removed = 0
+            for key in args[1:]:
+                if self._alive(key):
+                    removed += 1
+                self.strings.pop(key, None)
+                self.hashes.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+        if name == "HSET":
+            self._alive(args[1])
+            target = self.hashes.setdefault(args[1], {})
+            added = 0
+            for i in range(2, len(args), 2):
+                added += args[i] not in target
+                target[args[i]] = args[i + 1]
+            return added
+        if name == "HGETALL":
+            if not self._alive(args[1]):
+                return []
+            return [item for pair in self.hashes.get(args[1], {}).items() for item in pair]
+        if name == "PEXPIRE":
+            if not self._alive(args[1]):
+                return 0
+            self._set_px(args[1], args[2])
+            return 1
+        if name == "SCAN":
+            # Весь ответ за один проход: курсор сразу возвращается в 0
+            pattern = args[args.index("MATCH") + 1] if "MATCH" in args else "*"
+            keys = [key for key in list(self.strings) + list(self.hashes)
+                    if fnmatch.fnmatchcase(key, pattern) and self._alive(key)]
+            return ["0", keys]
+        if name == "DBSIZE":
+            return sum(self._alive(key) for key in list(self.strings) + list(self.hashes))
+        return Exception(f"ERR unknown command '{args[0]}'")
+
+    @classmethod
+    def encode(cls, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-{value}\r\n".encode()
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(cls.encode(item) for item in value)
+        if value.startswith("+"):
+            return value.encode() + b"\r\n"
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def handle(self, reader, writer):
+        queued = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                count = int(line[1:-2])
+                args = []
+                for _ in range(count):
+                    size = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2].decode())
+                name = args[0].upper()
+                if name == "MULTI":
+                    queued = []
+                    reply = "+OK"
+                elif name == "EXEC":
+                    reply = [self.execute(command) for command in queued or []]
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "+QUEUED"
+                else:
+                    reply = self.execute(args)
+                writer.write(self.encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start(host="127.0.0.1", port=0):
+    server = RespServer()
+    tcp = await asyncio.start_server(server.handle, host, port)
+    return server, tcp
+
+
+async def serve(host, port):
+    _, tcp = await start(host, port)
+    print(f"RESP stand-in listening on {host}:{tcp.sockets[0].getsockname()[1]}")
+    async with tcp:
+        await tcp.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
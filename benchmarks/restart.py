@@ -0,0 +1,112 @@
+# Перезапуск под нагрузкой: настоящий bot.py против заглушки Bot API получает SIGTERM
+# посреди потока заказов и сразу запускается снова. FSM в SQLite, поэтому шаги заказа
+# переживают перезапуск; потерянное обновление видно как пользователь, не дождавшийся ответа.
+#
+#   python -m benchmarks.restart --users 300 --restarts 2
+#
+# "graceful" — текущие настройки: дедлайн на доработку и контрольная точка polling'а.
+# "abrupt" — DRAIN_TIMEOUT=0 и без контрольной точки: принятое, но не обработанное теряется.
+# "crash" — SIGKILL с контрольной точкой: обработанное после её записи не должно обработаться
+# второй раз ни из контрольной точки, ни при повторной доставке — дублей заказов быть не должно.
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_api
+from benchmarks.load import BOT_SCRIPT, LoadTest, bot_env, count_orders, wait_ready
+
+
+# Пользователи, у которых в журнале больше одного заказа: каждый в тесте оформляет один
+def count_duplicates(path):
+    if not os.path.exists(path):
+        return 0
+    with sqlite3.connect(path) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM (SELECT user_id FROM orders GROUP BY user_id HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+
+
+async def run_mode(name, extra_env, args, sig=signal.SIGTERM):
+    api = fake_api.from_arguments(args)
+    _, runner = await fake_api.start(api=api)
+    api_port = runner.addresses[0][1]
+    startups, shutdowns = [], []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bot_env(args, api_port, None, tmp)
+        env["POLL_CHECKPOINT"] = os.path.join(tmp, "polling.checkpoint.json")
+        env.update(extra_env)
+
+        async def spawn():
+            calls = api.calls.get("getUpdates", 0)
+            process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=env)
+            started = time.perf_counter()
+            api.calls["getUpdates"] = 0
+            await wait_ready(api, "polling", process)
+            api.calls["getUpdates"] += calls
+            startups.append(time.perf_counter() - started)
+            return process
+
+        async def restarts(state):
+            for _ in range(args.restarts):
+                await asyncio.sleep(args.interval)
+                process = state["process"]
+                started = time.perf_counter()
+                process.send_signal(sig)
+                await process.wait()
+                shutdowns.append(time.perf_counter() - started)
+                state["process"] = await spawn()
+
+        state = {"process": await spawn()}
+        test = LoadTest(api, args.step_timeout)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(
+                restarts(state),
+                *(test.user(610_000 + i, semaphore) for i in range(args.users))
+            )
+        finally:
+            process = state["process"]
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+            await process.wait()
+        elapsed = time.perf_counter() - started
+        orders = count_orders(os.path.join(tmp, "orders.sqlite3"))
+        duplicates = count_duplicates(os.path.join(tmp, "orders.sqlite3"))
+
+    await api.close()
+    await runner.cleanup()
+    timeouts = sum(test.timeouts.values())
+    print(f"== {name}: {args.users} users, {args.restarts} restarts in {elapsed:.1f} s")
+    print("   startup:  " + ", ".join(f"{value:.2f}" for value in startups) + " s")
+    print("   shutdown: " + ", ".join(f"{value:.2f}" for value in shutdowns) + " s")
+    print(f"   finished: {test.completed}, stuck without a reply: {timeouts} "
+          f"{ {text: count for text, count in test.timeouts.items() if count} }")
+    print(f"   orders in ledger: {orders}, users with duplicate orders: {duplicates}")
+
+
+async def run(args):
+    print(f"users: {args.users} (concurrency {args.concurrency}), restart every {args.interval} s, "
+          f"API latency {args.latency_ms} ms")
+    await run_mode("graceful", {}, args)
+    await run_mode("abrupt", {"DRAIN_TIMEOUT": "0", "POLL_CHECKPOINT": ""}, args)
+    await run_mode("crash", {}, args, sig=signal.SIGKILL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--restarts", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=3.0, help="секунд между перезапусками")
+    parser.add_argument("--step-timeout", type=float, default=20.0)
+    parser.set_defaults(mode="polling", workers=1, storage="sqlite", scheduler=False)
+    fake_api.add_arguments(parser)
+    parser.set_defaults(latency_ms=50.0)
+    asyncio.run(run(parser.parse_args()))
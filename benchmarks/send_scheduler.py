@@ -0,0 +1,56 @@
+# Планировщик отправок под нагрузкой: всплеск ответов пользователям и сводок админу.
+# Показывает, что общий темп не выходит за лимит, а ответы пользователям идут первыми.
+#
+#   python -m benchmarks.send_scheduler --chats 60
+import argparse
+import asyncio
+import time
+
+import bot as app
+from benchmarks.common import FakeSession, percentile
+from sender import PRIORITY_ADMIN, SendScheduler, send_priority
+
+
+async def run(chats, messages_per_chat, admin_messages):
+    session = FakeSession()
+    scheduler = SendScheduler()
+    session.middleware(scheduler)
+    app.bot.session = session
+
+    latencies = {"user": [], "admin": []}
+
+    async def send(kind, chat_id, text):
+        started = time.perf_counter()
+        await app.bot.send_message(chat_id=chat_id, text=text)
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def user_chat(chat_id):
+        for i in range(messages_per_chat):
+            await send("user", chat_id, f"reply {i}")
+
+    async def admin(i):
+        with send_priority(PRIORITY_ADMIN):
+            await send("admin", -100500, f"digest {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(admin(i) for i in range(admin_messages)),
+        *(user_chat(1000 + c) for c in range(chats)),
+    )
+    elapsed = time.perf_counter() - started
+    total = chats * messages_per_chat + admin_messages
+
+    print(f"sent {total} messages in {elapsed:.2f} s -> {total / elapsed:.1f} msg/s "
+          f"(limit {scheduler.global_rate:.0f} msg/s after a burst of {scheduler.global_burst})")
+    for kind, values in latencies.items():
+        print(f"{kind:<6} p50 {percentile(values, 50):6.2f} s   p99 {percentile(values, 99):6.2f} s")
+    print("stats:", scheduler.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=60)
+    parser.add_argument("--messages-per-chat", type=int, default=3)
+    parser.add_argument("--admin-messages", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.messages_per_chat, args.admin_messages))
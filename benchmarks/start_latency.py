@@ -0,0 +1,209 @@
+# Задержка /start при 1000 одновременных пользователях:
+#   legacy   — прежний хендлер: приветствие, asyncio.sleep(1), меню
+#   sequence — текущий хендлер с отложенной цепочкой сообщений
+#
+# Диспетчер собран как в bot.main(): Lifecycle — outer middleware обновлений.
+# Обновления идут двумя путями: задачей на обновление, как в UpdatePoller, и через
+# очередь чата ChatSerializer, как в воркере. «В работе» — сколько обновление занимает
+# место в polling'е или очередь чата. Во втором прогоне каждый пользователь через 0.2 с
+# после /start пишет ещё раз: ответ не должен ждать меню, а цепочка должна отмениться.
+#
+#   python -m benchmarks.start_latency --users 1000
+import argparse
+import asyncio
+import sys
+import time
+
+from aiogram import Dispatcher, Router, types
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks.common import FakeSession, make_update, percentile
+from lifecycle import collect_followups
+from workers import ChatSerializer
+
+FOLLOW_UP_DELAY = 0.2
+FOLLOW_UP_TEXT = "💸 Купить"
+# Обновление с /start не должно занимать место дольше этого, даже пока меню ещё не ушло
+MAX_INFLIGHT_P99 = 0.5
+
+
+async def legacy_start(message: types.Message, state: FSMContext):
+    await state.clear()
+    await app.bot.send_message(chat_id=message.chat.id, text="👋")
+    await asyncio.sleep(1)
+    await state.set_state(app.OrderForm.action)
+    await app.bot.send_message(
+        chat_id=message.chat.id,
+        text="🎮 Выбери, что хочешь сделать:",
+        reply_markup=app.catalog.snapshot.keyboards.action
+    )
+
+
+# Роутер подключается только к одному диспетчеру, поэтому на каждый прогон — новый
+def create_legacy_router():
+    router = Router()
+    router.message.register(legacy_start, Command("start"))
+    return router
+
+
+# Отмечает, когда каждый чат получил меню
+class MenuTracker(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.menu_at = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        if method.__api_method__ == "sendMessage" and method.reply_markup is not None:
+            self.menu_at[int(method.chat_id)] = time.perf_counter()
+        return await super().make_request(bot, method, timeout)
+
+
+def build_dispatcher(router):
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(router)
+    dp.update.outer_middleware(app.lifecycle)
+    return dp
+
+
+# Обновления в работе: сколько их сейчас и сколько было самое большее
+class Inflight:
+    def __init__(self):
+        self.now = 0
+        self.peak = 0
+        self.seconds = {}
+        # Сколько обновление ждало своей очереди в чате до начала обработки
+        self.queued = {}
+
+    async def track(self, key, process):
+        self.now += 1
+        self.peak = max(self.peak, self.now)
+        started = time.perf_counter()
+        try:
+            await process()
+        finally:
+            self.seconds[key] = time.perf_counter() - started
+            self.now -= 1
+
+
+# Как обрабатывают обновление UpdatePoller и воркер: фоновые задачи хендлера собираются, но не ждутся
+async def feed(dp, update):
+    with collect_followups():
+        await dp.feed_update(app.bot, update)
+
+
+# Путь UpdatePoller: задача на обновление
+def polling_path(dp, inflight):
+    tasks = []
+
+    def submit(key, update):
+        tasks.append(asyncio.create_task(inflight.track(key, lambda: feed(dp, update))))
+
+    async def join():
+        await asyncio.gather(*tasks)
+
+    return submit, join
+
+
+# Путь воркера: обновления одного чата идут по очереди
+def worker_path(dp, inflight):
+    serializer = ChatSerializer()
+
+    def submit(key, update):
+        started = time.perf_counter()
+
+        async def process():
+            # Время в очереди чата тоже считается: ответ ждёт предыдущее обновление
+            inflight.queued[key] = time.perf_counter() - started
+            await inflight.track(key, lambda: feed(dp, update))
+
+        serializer.submit(update.message.chat.id, process)
+
+    return submit, serializer.join
+
+
+def ms(values, p):
+    return percentile(values, p) * 1000
+
+
+async def run_start(name, create_router, path, users):
+    session = MenuTracker()
+    app.bot.session = session
+    inflight = Inflight()
+    submit, join = path(build_dispatcher(create_router()), inflight)
+
+    starts = {}
+    for i in range(users):
+        user_id = 100_000 + i
+        starts[user_id] = time.perf_counter()
+        submit((user_id, "start"), make_update(user_id, "/start"))
+    await join()
+    while len(session.menu_at) < users:
+        await asyncio.sleep(0.05)
+    held = list(inflight.seconds.values())
+    menu_latency = [session.menu_at[user_id] - started for user_id, started in starts.items()]
+
+    print(f"== {name}, {path.__name__}: /start")
+    print(f"   in flight p50/p99: {ms(held, 50):8.1f} / {ms(held, 99):8.1f} ms")
+    print(f"   menu shown p50/p99:{ms(menu_latency, 50):8.1f} / {ms(menu_latency, 99):8.1f} ms")
+    print(f"   peak updates in flight: {inflight.peak}")
+    return percentile(held, 99)
+
+
+async def run_follow_up(name, create_router, path, users):
+    app.bot.session = FakeSession()
+    inflight = Inflight()
+    submit, join = path(build_dispatcher(create_router()), inflight)
+    cancelled = app.sequencer.cancelled
+
+    for i in range(users):
+        user_id = 200_000 + i
+        submit((user_id, "start"), make_update(user_id, "/start"))
+    await asyncio.sleep(FOLLOW_UP_DELAY)
+    for i in range(users):
+        user_id = 200_000 + i
+        submit((user_id, "reply"), make_update(user_id, FOLLOW_UP_TEXT))
+    await join()
+    # Ответ на второе сообщение: ожидание в очереди чата плюс обработка
+    reply = [
+        inflight.seconds[(user_id, "reply")] + inflight.queued.get((user_id, "reply"), 0.0)
+        for user_id in range(200_000, 200_000 + users)
+    ]
+    cancelled = app.sequencer.cancelled - cancelled
+
+    print(f"== {name}, {path.__name__}: second message {FOLLOW_UP_DELAY:.1f} s after /start")
+    print(f"   reply p50/p99:     {ms(reply, 50):8.1f} / {ms(reply, 99):8.1f} ms")
+    print(f"   sequences cancelled: {cancelled}")
+    # Отменённые цепочки досылать незачем; неотменённые прежним хендлером просто доработают
+    await app.sequencer.join(5)
+    return percentile(reply, 99), cancelled
+
+
+async def run(users):
+    errors = []
+    for path in (polling_path, worker_path):
+        await run_start("legacy", create_legacy_router, path, users)
+    await run_follow_up("legacy", create_legacy_router, worker_path, users)
+
+    for path in (polling_path, worker_path):
+        held = await run_start("sequence", app.create_router, path, users)
+        if held > MAX_INFLIGHT_P99:
+            errors.append(f"{path.__name__}: /start held in flight for {held * 1000:.0f} ms at p99")
+    reply, cancelled = await run_follow_up("sequence", app.create_router, worker_path, users)
+    if reply > MAX_INFLIGHT_P99:
+        errors.append(f"second message waited {reply * 1000:.0f} ms at p99 behind /start")
+    if cancelled != users:
+        errors.append(f"{cancelled} of {users} sequences cancelled by the second message")
+    for error in errors:
+        print(f"ERROR: {error}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users))
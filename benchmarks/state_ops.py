@@ -0,0 +1,84 @@
+# Сколько обращений к хранилищу FSM стоит один заказ от /start до подтверждения:
+# с прямыми вызовами state и с StateTransactionMiddleware.
+# Каждое обращение к удалённому хранилищу — отдельный round trip.
+#
+#   python -m benchmarks.state_ops --backend redis
+import argparse
+import asyncio
+import os
+import tempfile
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot as app
+from benchmarks import resp_server
+from benchmarks.common import ORDER_FLOW, CountingStorage, FakeSession, make_update
+from fsm_transaction import StateTransactionMiddleware
+from storage import RespClient, RespStorage, SQLiteStorage
+
+
+async def run_flow(router, storage, user_id):
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    storage.reset()
+    per_step = []
+    for text in ORDER_FLOW:
+        before = storage.total
+        await dp.feed_update(app.bot, make_update(user_id, text))
+        per_step.append((text, storage.total - before))
+    return per_step, dict(storage.ops)
+
+
+async def compare(inner):
+    router = app.create_router()
+    manager = router.message.middleware
+    for m in [m for m in manager if isinstance(m, StateTransactionMiddleware)]:
+        manager.unregister(m)
+    direct, direct_ops = await run_flow(router, CountingStorage(inner), 1)
+
+    batched, batched_ops = await run_flow(app.create_router(), CountingStorage(inner), 2)
+
+    print(f"{'step':<16}{'direct':>8}{'batched':>9}")
+    for (text, a), (_, b) in zip(direct, batched):
+        print(f"{text:<16}{a:>8}{b:>9}")
+    print(f"{'total':<16}{sum(a for _, a in direct):>8}{sum(b for _, b in batched):>9}")
+    print("direct: ", direct_ops)
+    print("batched:", batched_ops)
+
+
+async def main(backend):
+    app.bot.session = FakeSession()
+    # Подтверждение пишет в журнал заказов и ставит уведомление админу в очередь — всё это
+    # поднимается как в main() бота; уведомления только копятся, доставки нет
+    await app.ledger.start()
+    await app.notifier.start(deliver=False)
+    try:
+        await run_backend(backend)
+    finally:
+        await app.sequencer.close()
+        await app.notifier.stop()
+        await app.ledger.close()
+
+
+async def run_backend(backend):
+    if backend == "memory":
+        await compare(MemoryStorage())
+    elif backend == "redis":
+        _, tcp = await resp_server.start()
+        storage = RespStorage(RespClient("127.0.0.1", tcp.sockets[0].getsockname()[1]))
+        await compare(storage)
+        await storage.close()
+        tcp.close()
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(os.path.join(tmp, "fsm.sqlite3"))
+            await compare(storage)
+            await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["memory", "redis", "sqlite"], default="redis")
+    args = parser.parse_args()
+    asyncio.run(main(args.backend))
@@ -0,0 +1,92 @@
+# Проверка и замер хранилищ FSM: память (MemoryStorage и компактная), RESP (локальная замена Redis) и SQLite
+#
+#   python -m benchmarks.storage_check --users 2000
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks import resp_server
+from storage import CompactStorage, RespClient, RespStorage, SQLiteStorage
+
+BOT_ID = 42
+
+
+def make_key(user_id):
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+async def check(storage, ttl_storage):
+    key = make_key(1)
+    await storage.set_state(key, "OrderForm:project")
+    assert await storage.get_state(key) == "OrderForm:project"
+    merged = await storage.update_data(key, {"action": "Купить"})
+    assert merged == {"action": "Купить"}, merged
+    merged = await storage.update_data(key, {"project": "GTA5RP", "amount_kk": 12})
+    assert merged == {"action": "Купить", "project": "GTA5RP", "amount_kk": 12}, merged
+    await storage.set_data(key, {"server": "Alta"})
+    assert await storage.get_data(key) == {"server": "Alta"}
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+    assert await storage.get_state(key) is None
+    assert await storage.get_data(key) == {}
+
+    if ttl_storage is not None:
+        await ttl_storage.set_state(key, "OrderForm:amount")
+        await ttl_storage.update_data(key, {"project": "Majestic"})
+        await asyncio.sleep(1.2)
+        assert await ttl_storage.get_state(key) is None, "state did not expire"
+        assert await ttl_storage.get_data(key) == {}, "data did not expire"
+
+
+async def flow(storage, user_id):
+    # Типичный заказ: шесть шагов, на каждом смена состояния и запись данных
+    key = make_key(user_id)
+    await storage.set_state(key, "OrderForm:action")
+    for field, value in (("action", "Купить"), ("project", "GTA5RP"), ("server", "Alta"),
+                         ("amount_kk", 12), ("payment_type", "СБП")):
+        await storage.update_data(key, {field: value})
+        await storage.set_state(key, f"OrderForm:{field}")
+    await storage.get_data(key)
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+
+async def bench(name, storage, ttl_storage, users):
+    await check(storage, ttl_storage)
+    started = time.perf_counter()
+    await asyncio.gather(*(flow(storage, 1000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<8} ok  {users} flows in {elapsed:.3f} s  ({users / elapsed:.0f} flows/sec)")
+
+
+async def run(users):
+    await bench("memory", MemoryStorage(), None, users)
+    await bench("compact", CompactStorage(), CompactStorage(ttl=1), users)
+
+    _, tcp = await resp_server.start()
+    port = tcp.sockets[0].getsockname()[1]
+    resp = RespStorage(RespClient("127.0.0.1", port))
+    resp_ttl = RespStorage(RespClient("127.0.0.1", port), ttl=1)
+    await bench("redis", resp, resp_ttl, users)
+    await resp.close()
+    await resp_ttl.close()
+    tcp.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteStorage(os.path.join(tmp, "fsm.sqlite3"))
+        sqlite_ttl = SQLiteStorage(os.path.join(tmp, "fsm-ttl.sqlite3"), ttl=1)
+        await bench("sqlite", sqlite, sqlite_ttl, users)
+        await sqlite.close()
+        await sqlite_ttl.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users))
@@ -0,0 +1,176 @@
+# Сводка заказа и уведомление админу: прежние f-строки с parse_mode="Markdown"
+# против скомпилированных шаблонов в форматах html / markdownv2 / entities.
+# Значения (ники, серверы) берутся со спецсимволами разметки; проверяется,
+# что Telegram получит корректную разметку и увидит ровно исходный текст.
+#
+#   python -m benchmarks.templates --orders 20000
+import argparse
+import json
+import random
+import time
+from html.parser import HTMLParser
+
+import bot as app
+from templates import FORMATS, Template, template
+
+SUMMARY = (
+    "📋 Проверь заказ:\n\n"
+    "Действие: *{action}*\n"
+    "Проект: *{project}*\n"
+    "Сервер: *{server}*\n"
+    "Сумма: *{amount_kk}кк*\n"
+    "Цена: *{price_rub} RUB*\n"
+    "Оплата: *{payment_type}*"
+)
+NAME_CHARS = "abcxyz019_*[]()`.-!<>&"
+
+
+def random_order(rng, snapshot):
+    project = rng.choice(list(snapshot.project_options.values()))
+    server = rng.choice(list(snapshot.server_options[project].values()))
+    return {
+        "order_id": rng.randrange(1, 10 ** 9),
+        "order_time": "2026-10-18 12:00:00",
+        "username": "".join(rng.choice(NAME_CHARS) for _ in range(rng.randint(5, 16))),
+        "user_id": rng.randrange(10 ** 9),
+        "action": rng.choice(list(app.ACTIONS.values())),
+        "project": project,
+        "server": server,
+        "amount_kk": str(rng.randint(1, 100)),
+        "price_rub": rng.randint(100, 100_000),
+        "payment_type": rng.choice(list(app.PAYMENT_METHODS.values())),
+        "payment_status": "Ожидает оплаты (Payop тест)",
+    }
+
+
+def legacy_admin(order):
+    return (
+        f"🔔 *Новый заказ #{order['order_id']}*\n\n"
+        f"📅 *Дата и время*: {order['order_time']}\n"
+        f"👤 *Пользователь*: @{order['username']} (ID: {order['user_id']})\n"
+        f"🎯 *Действие*: {order['action']}\n"
+        f"🎮 *Проект*: {order['project']}\n"
+        f"🌍 *Сервер*: {order['server']}\n"
+        f"💰 *Сумма*: {order['amount_kk']}кк\n"
+        f"💸 *Цена*: {order['price_rub']} RUB\n"
+        f"💳 *Тип оплаты*: {order['payment_type']}\n"
+        f"📊 *Статус*: {order['payment_status']}\n\n"
+        f"🔗 *Ссылка на оплату*: [Payop Test]({app.PAYOP_TEST_LINK})"
+    )
+
+
+# Грубая проверка старого Markdown: незакрытые _, *, ` и [ Telegram отвергает
+def legacy_markdown_ok(text):
+    return all(text.count(char) % 2 == 0 for char in "_*`") and text.count("[") == text.count("]")
+
+
+class _TextCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def html_text(text):
+    collector = _TextCollector()
+    collector.feed(text)
+    collector.close()
+    return "".join(collector.parts)
+
+
+# Видимый текст MarkdownV2: любой спецсимвол вне разметки обязан быть экранирован
+def markdown_v2_text(text):
+    out = []
+    i = 0
+    link = False
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            out.append(text[i + 1])
+            i += 2
+            continue
+        if char == "*":
+            pass
+        elif char == "[":
+            link = True
+        elif char == "]" and link and text[i + 1] == "(":
+            i = text.index(")", i) + 1
+            link = False
+            continue
+        elif char in "_[]()~`>#+-=|{}.!":
+            raise ValueError(f"unescaped {char!r} at {i}")
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def plain(order, source):
+    return Template(source, "entities").render(order)[0]
+
+
+def visible(fmt, rendered):
+    text, _, _ = rendered
+    if fmt == "html":
+        return html_text(text)
+    if fmt == "markdownv2":
+        return markdown_v2_text(text)
+    return text
+
+
+def payload_size(rendered):
+    text, parse_mode, entities = rendered
+    size = len(text.encode())
+    if parse_mode:
+        size += len(parse_mode)
+    if entities:
+        size += len(json.dumps([entity.model_dump(exclude_none=True) for entity in entities]))
+    return size
+
+
+def timed(func, orders):
+    started = time.perf_counter()
+    for order in orders:
+        func(order)
+    return (time.perf_counter() - started) / len(orders) * 1e6
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    snapshot = app.catalog.snapshot
+    orders = [random_order(rng, snapshot) for _ in range(args.orders)]
+    admin_source = app.ADMIN_ORDER_TEMPLATE.source
+
+    broken = sum(not legacy_markdown_ok(legacy_admin(order)) for order in orders)
+    legacy_us = timed(lambda order: (SUMMARY.format_map(order), legacy_admin(order)), orders)
+    print(f"== legacy f-strings, parse_mode=Markdown: {legacy_us:6.2f} us per order")
+    print(f"   admin messages Telegram would reject: {broken} of {len(orders)} "
+          f"({broken / len(orders) * 100:.1f} %)")
+
+    for fmt in FORMATS:
+        summary, admin = template(SUMMARY, fmt), Template(admin_source, fmt)
+        us = timed(lambda order: (summary.render(order), admin.render(order)), orders)
+        mismatches = 0
+        size = 0
+        for order in orders[:args.check]:
+            for source, compiled in ((SUMMARY, summary), (admin_source, admin)):
+                rendered = compiled.render(order)
+                size += payload_size(rendered)
+                try:
+                    ok = visible(fmt, rendered) == plain(order, source)
+                except (ValueError, IndexError):
+                    ok = False
+                mismatches += not ok
+        checked = min(args.check, len(orders))
+        print(f"== {fmt:<10}: {us:6.2f} us per order, {size / checked:6.0f} bytes of text+markup per order, "
+              f"broken or altered: {mismatches} of {checked * 2}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--check", type=int, default=2000, help="сколько заказов проверить на корректность")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
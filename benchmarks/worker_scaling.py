@@ -0,0 +1,110 @@
+# Пропускная способность в режиме нескольких процессов: 1, 2, … N воркеров.
+# Bot API заменён локальной заглушкой в отдельном процессе, обновления раздаёт
+# настоящий Supervisor; каждый виртуальный пользователь проходит заказ целиком.
+# Планировщик отправок выключен (SEND_SCHEDULER=off), иначе всё упрётся в лимиты Telegram.
+#
+#   python -m benchmarks.worker_scaling --users 1000 --workers 4
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession
+
+from benchmarks.common import ORDER_FLOW, make_update
+from workers import Supervisor
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+
+
+async def start_fake_api(port):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.fake_api", "--port", str(port),
+        stdout=asyncio.subprocess.PIPE
+    )
+    await process.stdout.readline()
+    return process
+
+
+async def run_once(count, users, port, tmp):
+    api = await start_fake_api(port)
+    os.environ["LEDGER_PATH"] = os.path.join(tmp, f"orders-{count}.sqlite3")
+    supervisor = Supervisor(None, count, [sys.executable, BOT_SCRIPT])
+    spawn_started = time.perf_counter()
+    await supervisor.start()
+    spawn_time = time.perf_counter() - spawn_started
+
+    # Шаги перемешаны между пользователями, порядок внутри чата обеспечивает супервизор
+    updates = [
+        make_update(400_000 + user, text).model_dump(mode="json", exclude_none=True)
+        for text in ORDER_FLOW for user in range(users)
+    ]
+    started = time.perf_counter()
+    for update in updates:
+        supervisor.dispatch(update)
+    await supervisor.wait_idle()
+    elapsed = time.perf_counter() - started
+
+    drain_started = time.perf_counter()
+    await supervisor.stop()
+    drain_time = time.perf_counter() - drain_started
+
+    async with ClientSession() as http:
+        async with http.get(f"http://127.0.0.1:{port}/_stats") as resp:
+            stats = await resp.json()
+    api.terminate()
+    await api.wait()
+
+    ending, chats = max(stats["last_text"].items(), key=lambda item: item[1])
+    stats = supervisor.stats()
+    return {
+        "workers": count,
+        "updates/s": len(updates) / elapsed,
+        "elapsed": elapsed,
+        "failed": stats["failed"],
+        "spawn": spawn_time,
+        "drain": drain_time,
+        "completed": chats,
+        "ending": ending,
+    }
+
+
+async def run(args):
+    os.environ.update({
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}",
+        "SEND_SCHEDULER": "off",
+        "FSM_STORAGE": "memory",
+        "METRICS_PORT": "0",
+        "LOG_FILE": "",
+        "LOG_LEVEL": "WARNING",
+    })
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.workers:
+        counts.append(args.workers)
+
+    print(f"cores: {os.cpu_count()}, users: {args.users}, updates per run: {args.users * len(ORDER_FLOW)}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            result = await run_once(count, args.users, args.api_port, tmp)
+            baseline = baseline or result["updates/s"]
+            print(f"== {count} worker(s)")
+            print(f"   updates/sec: {result['updates/s']:10.1f}  (x{result['updates/s'] / baseline:.2f})")
+            print(f"   elapsed:     {result['elapsed']:10.2f} s, failed: {result['failed']}")
+            print(f"   spawn/drain: {result['spawn']:.2f} s / {result['drain']:.2f} s")
+            print(f"   chats finished on {json.dumps(result['ending'], ensure_ascii=False)}: "
+                  f"{result['completed']} of {args.users}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--api-port", type=int, default=8181)
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -1,28 +1,41 @@
+# Первым: засекает время импортов (STARTUP_PROFILE=1 — по пакетам) и фаз запуска
+from startup import profile as startup_profile
 import asyncio
-import re
 import logging
 import os
+import sys
 from datetime import datetime
 from aiogram import Bot, Router, types
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.event.bases import UNHANDLED
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.exceptions import TelegramNetworkError
 from dotenv import load_dotenv
 
+from amount import MAX_ORDER_KK, MIN_ORDER_KK, format_kk, parse_kk, price_rub
+from catalog import Catalog
+from flow import FlowEngine, Reply, Step
+from fsm_transaction import StateTransactionMiddleware
+from http_session import PooledSession
+from keyboards import BACK_TEXT, KeyboardRegistry
+from ledger import OrderLedger
+from lifecycle import Backoff, Lifecycle, OffsetCheckpoint, UpdatePoller
+from logging_setup import setup_logging
+from notify import AdminNotifier
+from sender import SendScheduler
+from sequence import MessageSequencer
+from storage import CompactStorage, active_sessions, create_storage
+from templates import Template
+
+startup_profile.mark("imports")
+
 # Загружаем переменные из .env
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Настройка логирования: запись на диск в отдельном потоке, ротация по размеру
+setup_logging()  # LOG_FORMAT=text|json, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT
 logger = logging.getLogger("telegram_bot")
 
 # Константы
@@ -32,10 +45,111 @@ SUPPORT_USERNAME = "@yasikvirtss"
 REVIEWS_CHANNEL = "https://t.me/yasikvirtsotzivi"
 PAYOP_TEST_LINK = "https://payop.com/test"
 
+# Режим приёма обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Остановка по SIGTERM/SIGINT: DRAIN_TIMEOUT секунд на обработку принятых обновлений.
+# Необработанное к дедлайну и offset polling'а сохраняются в POLL_CHECKPOINT ("" — не сохранять)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+POLL_CHECKPOINT = os.getenv("POLL_CHECKPOINT", "polling.checkpoint.json")
+lifecycle = Lifecycle(drain_timeout=DRAIN_TIMEOUT, profile=startup_profile)
+
+# Несколько процессов: BOT_WORKERS>1 запускает супервизор, BOT_WORKER_INDEX он задаёт воркерам сам
+WORKER_COUNT = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_INDEX = int(os.environ["BOT_WORKER_INDEX"]) if "BOT_WORKER_INDEX" in os.environ else None
+# Номер заказа содержит WORKER_ID процесса (0–1023); воркеры получают WORKER_ID + свой номер.
+# Без явного значения у процессов разных запусков или контейнеров номера совпали бы
+if WORKER_COUNT > 1 and "WORKER_ID" not in os.environ:
+    sys.exit(f"BOT_WORKERS={WORKER_COUNT} requires WORKER_ID: workers use WORKER_ID..WORKER_ID+{WORKER_COUNT - 1}, "
+             f"unique across every process writing to {os.getenv('LEDGER_PATH', 'orders.sqlite3')}")
+
+# Интерфейс: "reply" — reply-клавиатуры и новое сообщение на каждый шаг,
+# "inline" — inline-кнопки и правка одного сообщения-карточки. Inline не включён по умолчанию:
+# на заказ он делает больше запросов к Bot API и передаёт больше байт (python -m benchmarks.inline_ui)
+UI_MODE = os.getenv("UI_MODE", "reply")
+ALLOWED_UPDATES = ["message", "callback_query"] if UI_MODE == "inline" else ["message"]
+# Разметка сообщений: "html", "markdownv2" или "entities" (без parse_mode, готовые entities).
+# Очередь уведомлений админу хранит только текст, поэтому для неё "entities" означает HTML
+MESSAGE_FORMAT = os.getenv("MESSAGE_FORMAT", "html").lower()
+ADMIN_FORMAT = MESSAGE_FORMAT if MESSAGE_FORMAT != "entities" else "html"
+
+# Защита от флуда: FLOOD_RATE обновлений в секунду на пользователя, всплеск до FLOOD_BURST;
+# повторы update_id отбрасываются в окне из UPDATE_DEDUPE_WINDOW последних обновлений.
+# FLOOD_RATE=0 — защита выключена целиком, вместе с отсевом повторов
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "2"))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "10"))
+UPDATE_DEDUPE_WINDOW = int(os.getenv("UPDATE_DEDUPE_WINDOW", "10000"))
+
+# Запись входящих обновлений (обезличенных) для воспроизведения в benchmarks/replay.py:
+# UPDATE_TRACE — путь к JSONL-трассе ("" — не писать, .gz — сжатая), воркеры добавляют к имени свой номер.
+# UPDATE_TRACE_SECRET — соль псевдонимов id; без неё псевдонимы меняются при каждом запуске
+UPDATE_TRACE = os.getenv("UPDATE_TRACE", "")
+UPDATE_TRACE_SECRET = os.getenv("UPDATE_TRACE_SECRET")
+
+# Адрес Bot API; для локального сервера или заглушки в бенчмарках
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Локальный эндпоинт /metrics для Prometheus; METRICS_PORT=0 — выключить вместе со сбором метрик
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9091"))
+
+# Пулы соединений к Bot API: getUpdates ходит через свой пул и не занимает соединения отправки
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "0"))  # 0 — без отдельного лимита на хост
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))  # секунды простоя до закрытия соединения
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "3600"))
+HTTP_POLL_POOL_SIZE = int(os.getenv("HTTP_POLL_POOL_SIZE", "1"))
+
 # Инициализация бота и маршрутизатора
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
-router = Router()
+session_options = dict(
+    pool_size=HTTP_POOL_SIZE,
+    per_host=HTTP_POOL_PER_HOST,
+    keepalive=HTTP_KEEPALIVE,
+    dns_ttl=HTTP_DNS_TTL,
+    poll_pool_size=HTTP_POLL_POOL_SIZE
+)
+if TELEGRAM_API_URL:
+    session_options["api"] = TelegramAPIServer.from_base(TELEGRAM_API_URL)
+bot = Bot(token=API_TOKEN, session=PooledSession(**session_options))
+# Стоит первым, чтобы планировщик и метрики видели уже editMessageText
+inline_screen = None
+if UI_MODE == "inline":
+    from inline_ui import InlineScreen
+
+    inline_screen = InlineScreen(lambda: catalog.snapshot.keyboards)
+    bot.session.middleware(inline_screen)
+# Все отправки идут через общий планировщик с лимитами Telegram на бот и на чат.
+# Лимит на весь бот делится между воркерами; лимиты чата целиком у того воркера, которому чат достался
+send_scheduler = SendScheduler(global_rate=30.0 / WORKER_COUNT, global_burst=max(1, 30 // WORKER_COUNT))
+# SEND_SCHEDULER=off — только для нагрузочных тестов против локальной заглушки Bot API
+if os.getenv("SEND_SCHEDULER", "on") != "off":
+    bot.session.middleware(send_scheduler)
+storage = create_storage()  # FSM_STORAGE=compact|memory|redis|sqlite, FSM_MAX_SESSIONS
+if METRICS_PORT:
+    from metrics import FUNNEL, ApiMetricsMiddleware, HandlerMetricsMiddleware, TimedStorage, registry as metrics
+
+    # Время и ошибки запросов к Bot API без учёта ожидания в планировщике
+    bot.session.middleware(ApiMetricsMiddleware())
+    storage = TimedStorage(storage)
+# Спам и повторные доставки отсекаются до FSM; подключается к диспетчеру в main()
+flood_guard = None
+if FLOOD_RATE > 0:
+    from flood import FloodGuard
+
+    flood_guard = FloodGuard(
+        rate=FLOOD_RATE,
+        burst=FLOOD_BURST,
+        dedupe_window=UPDATE_DEDUPE_WINDOW,
+        notice="⏳ Слишком много сообщений подряд, подожди пару секунд"
+    )
+# Отложенные сообщения; новое сообщение пользователя отменяет неотправленный хвост,
+# а при остановке паузы пропускаются
+sequencer = MessageSequencer(sleep=lifecycle.sleep)
 
 # Определение состояний для FSM (Finite State Machine)
 class OrderForm(StatesGroup):
@@ -46,453 +160,243 @@ class OrderForm(StatesGroup):
     payment_type = State()
     confirm = State()
 
-# Данные о проектах и серверах
-PROJECT_SERVERS = {
-    "GTA5RP": [
-        "Downtown", "Burton", "Strawberry", "Rockford", "Vinewood", "Alta", "Blackberry",
-        "Del Perro", "Insquad", "Davis", "Sunrise", "Harmony", "Rainbow", "Redwood",
-        "Richman", "Hawick", "Eclipse", "Grapeseed", "La Mesa", "Murrieta", "Vespucci"
-    ],
-    "Majestic": [
-        "New York", "San Diego", "Detroit", "Los Angeles", "Miami", "Washington", "Dallas",
-        "Las Vegas", "Chicago", "Atlanta", "San Francisco", "Houston", "Seattle", "Boston"
-    ]
-}
-PROJECTS = list(PROJECT_SERVERS.keys())
-
-# Кнопка "Назад"
-BACK_BUTTON = types.KeyboardButton(text="⬅ Назад")
+# Кнопки меню: текст кнопки → значение в заказе
+ACTIONS = {"💸 Купить": "Купить", "💰 Продать": "Продать"}
+INFO_BUTTONS = ["📝 Отзывы", "📞 Поддержка"]
+PAYMENT_METHODS = {"💳 Карта": "Карта", "📱 СБП": "СБП", "💲 USDT": "USDT", "₿ BTC": "BTC"}
+CONFIRM_BUTTON = "✅ Подтвердить"
+CANCEL_BUTTON = "❌ Отмена"
+# Готовые суммы на inline-клавиатуре шага суммы
+AMOUNT_PRESETS = ["1кк", "5кк", "10кк", "25кк", "50кк", "100кк"]
+
+# Журнал заказов
+LEDGER_PATH = os.getenv("LEDGER_PATH", "orders.sqlite3")
+ledger = OrderLedger(LEDGER_PATH)
+
+# Очередь уведомлений админу хранится рядом с журналом заказов и переживает перезапуск
+NOTIFY_PATH = os.getenv("NOTIFY_PATH", LEDGER_PATH)
+# С несколькими воркерами очередь пополняют все, а отправляет только первый, опрашивая базу
+notifier = AdminNotifier(bot, NOTIFY_PATH, poll_interval=2.0 if WORKER_COUNT > 1 else None)
+
+# Каталог проектов, серверов и цен; при изменении файла подменяется без перезапуска
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "5"))
+
+def build_keyboards(project_servers):
+    return KeyboardRegistry(
+        project_servers,
+        action_labels=[*ACTIONS, *INFO_BUTTONS],
+        payment_labels=PAYMENT_METHODS,
+        confirm_labels=[CONFIRM_BUTTON, CANCEL_BUTTON],
+        amount_presets=AMOUNT_PRESETS
+    )
+
+# Сессия кэширует JSON клавиатур текущего снимка каталога. Каталог без цены
+# для какого-то действия меню не загружается: заказ упал бы на шаге суммы
+catalog = Catalog(
+    CATALOG_PATH,
+    build_keyboards,
+    on_swap=lambda snapshot: bot.session.use_registry(snapshot.keyboards),
+    actions=ACTIONS.values()
+)
+
+def pool_gauge(key):
+    return lambda: {(pool,): stats[key] for pool, stats in bot.session.pool_stats().items()}
+
+# Показатели, которые снимаются в момент запроса /metrics
+def register_gauges():
+    metrics.gauge("bot_fsm_active_sessions", "Пользователи с незавершённым сценарием",
+                  lambda: active_sessions(storage.inner))
+    if isinstance(storage.inner, CompactStorage):
+        metrics.gauge("bot_fsm_evicted_sessions", "Сессии, вытесненные из памяти до завершения",
+                      lambda: {("capacity",): storage.inner.evicted, ("ttl",): storage.inner.expired}, ("reason",))
+    metrics.gauge("bot_send_queue_depth", "Запросы, ждущие слота в планировщике отправок",
+                  lambda: send_scheduler.queue_depth)
+    metrics.gauge("bot_ledger_queue_depth", "Заказы, ещё не записанные в журнал", lambda: ledger.queued)
+    metrics.gauge("bot_ledger_orders_rejected", "Заказы, которые не удалось записать в журнал",
+                  lambda: ledger.rejected)
+    metrics.gauge("bot_admin_notifications_pending", "Неотправленные уведомления админу", notifier.pending)
+    metrics.gauge("bot_message_sequences_active", "Отложенные цепочки сообщений", lambda: sequencer.active)
+    metrics.gauge("bot_updates_inflight", "Обновления в обработке", lambda: lifecycle.inflight)
+    metrics.gauge("bot_lifecycle_seconds", "Длительность запуска и последней остановки",
+                  lambda: {(phase,): value for phase, value in (
+                      ("startup", lifecycle.startup_seconds),
+                      ("first_update", lifecycle.first_update_seconds),
+                      ("drain", lifecycle.drain_seconds),
+                      ("shutdown", lifecycle.shutdown_seconds),
+                  ) if value is not None}, ("phase",))
+    metrics.gauge("bot_startup_phase_seconds", "Длительность фаз запуска от старта процесса",
+                  lambda: {(phase,): value for phase, value in startup_profile.durations().items()}, ("phase",))
+    if flood_guard is not None:
+        metrics.gauge("bot_updates_dropped", "Обновления, отброшенные защитой от флуда",
+                      lambda: {("duplicate",): flood_guard.duplicates, ("flood",): flood_guard.throttled}, ("reason",))
+
+    metrics.gauge("bot_http_pool_in_use", "Запросы к Bot API в работе", pool_gauge("in_use"), ("pool",))
+    metrics.gauge("bot_http_pool_reuse_ratio", "Доля запросов на уже открытых соединениях",
+                  pool_gauge("reuse_rate"), ("pool",))
+    metrics.gauge("bot_http_pool_connections_created", "Открытые соединения за всё время",
+                  pool_gauge("connections_created"), ("pool",))
+    metrics.gauge("bot_http_pool_connect_ms", "Среднее время установки соединения",
+                  pool_gauge("avg_connect_ms"), ("pool",))
+    metrics.gauge("bot_http_pool_queued", "Запросы, ждавшие свободного соединения",
+                  pool_gauge("queued"), ("pool",))
+
+if METRICS_PORT:
+    register_gauges()
 
 # Команда /start
-@router.message(Command("start"))
 async def start_command(message: types.Message, state: FSMContext):
-    logger.info(f"User {message.from_user.id} started the bot")
+    logger.info("User %s started the bot", message.from_user.id)
     await state.clear()
 
     welcome_message = (
         "👋 Привет, ты попал в лучший магазин виртов! 👑😎\n\n"
         "Я помогу тебе купить или продать вирты для GTA 5 RP и Majestic RP."
     )
-    await bot.send_message(
-        chat_id=message.chat.id,
-        text=welcome_message
-    )
-
-    await asyncio.sleep(1)
-
+    chat_id = message.chat.id
     await state.set_state(OrderForm.action)
-    await bot.send_message(
-        chat_id=message.chat.id,
-        text="🎮 Выбери, что хочешь сделать:",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="💸 Купить"), types.KeyboardButton(text="💰 Продать")],
-                [types.KeyboardButton(text="📝 Отзывы"), types.KeyboardButton(text="📞 Поддержка")],
-                [BACK_BUTTON]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
-    )
-
-# Обработка выбора действия
-@router.message(OrderForm.action)
-async def process_action(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    text = message.text
-
-    if text == "⬅ Назад":
-        await state.clear()
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="🔄 Чтобы начать заново, отправь /start",
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        return
-
-    if text == "📝 Отзывы":
-        logger.info(f"User {user_id} requested reviews")
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text=f"📝 Ознакомьтесь с отзывами: {REVIEWS_CHANNEL}\n\n"
-                 "🔄 Чтобы начать заново, отправь /start",
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        await state.clear()
-        return
-
-    if text == "📞 Поддержка":
-        logger.info(f"User {user_id} requested support")
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text=f"📞 Свяжитесь с поддержкой: {SUPPORT_USERNAME}\n\n"
-                 "🔄 Чтобы начать заново, отправь /start",
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        await state.clear()
-        return
 
-    valid_actions = ["💸 Купить", "💰 Продать"]
-    if text not in valid_actions:
+    # Inline-режим: одна карточка с приветствием и меню, дальше она только редактируется
+    if UI_MODE == "inline":
         await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, выбери действие из меню.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="💸 Купить"), types.KeyboardButton(text="💰 Продать")],
-                    [types.KeyboardButton(text="📝 Отзывы"), types.KeyboardButton(text="📞 Поддержка")],
-                    [BACK_BUTTON]
-                ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-            )
+            chat_id=chat_id,
+            text=f"{welcome_message}\n\n🎮 Выбери, что хочешь сделать:",
+            reply_markup=catalog.snapshot.keyboards.action
         )
         return
 
-    action = text.replace("💸 ", "").replace("💰 ", "")
-    logger.info(f"User {user_id} selected action: {action}")
-    await state.update_data(action=action)
-    await state.set_state(OrderForm.project)
-
-    project_buttons = [[types.KeyboardButton(text=project) for project in PROJECTS]]
-    project_buttons.append([BACK_BUTTON])
+    # Приветствие и меню уходят в фоне с паузой в секунду; хендлер не ждёт, но обновление
+    # остаётся в работе, пока меню не отправлено, — остановка и контрольная точка его не потеряют
+    lifecycle.follow(sequencer.start(chat_id, [
+        (0, lambda: bot.send_message(
+            chat_id=chat_id,
+            text=welcome_message
+        )),
+        (1, lambda: bot.send_message(
+            chat_id=chat_id,
+            text="🎮 Выбери, что хочешь сделать:",
+            reply_markup=catalog.snapshot.keyboards.action
+        )),
+    ]))
 
+# «Назад» из главного меню — выход из сценария
+async def exit_menu(message: types.Message, state: FSMContext):
+    await state.clear()
     await bot.send_message(
         chat_id=message.chat.id,
-        text=f"✅ Ты выбрал действие: *{action}*.\n"
-             "🌐 Выбери нужный проект:",
-        parse_mode="Markdown",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=project_buttons,
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        text="🔄 Чтобы начать заново, отправь /start",
+        reply_markup=catalog.snapshot.keyboards.remove
     )
 
-# Обработка выбора проекта
-@router.message(OrderForm.project)
-async def process_project(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    text = message.text
-
-    if text == "⬅ Назад":
-        await state.set_state(OrderForm.action)
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="🎮 Выбери, что хочешь сделать:",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="💸 Купить"), types.KeyboardButton(text="💰 Продать")],
-                    [types.KeyboardButton(text="📝 Отзывы"), types.KeyboardButton(text="📞 Поддержка")],
-                    [BACK_BUTTON]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    if text not in PROJECTS:
-        project_buttons = [[types.KeyboardButton(text=project) for project in PROJECTS]]
-        project_buttons.append([BACK_BUTTON])
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, выбери проект из меню.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=project_buttons,
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    project = text
-    logger.info(f"User {user_id} selected project: {project}")
-    await state.update_data(project=project)
-    await state.set_state(OrderForm.server)
-
-    servers = PROJECT_SERVERS[project]
-    server_buttons = []
-    for i in range(0, len(servers), 2):
-        row = [types.KeyboardButton(text=server) for server in servers[i:i+2]]
-        server_buttons.append(row)
-    server_buttons.append([BACK_BUTTON])
-
+async def show_reviews(message: types.Message, state: FSMContext):
+    logger.info("User %s requested reviews", message.from_user.id)
     await bot.send_message(
         chat_id=message.chat.id,
-        text=f"✅ Ты выбрал проект: *{project}*.\n"
-             "🌍 Теперь выбери сервер:",
-        parse_mode="Markdown",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=server_buttons,
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        text=f"📝 Ознакомьтесь с отзывами: {REVIEWS_CHANNEL}\n\n"
+             "🔄 Чтобы начать заново, отправь /start",
+        reply_markup=catalog.snapshot.keyboards.remove
     )
+    await state.clear()
 
-# Обработка выбора сервера
-@router.message(OrderForm.server)
-async def process_server(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    text = message.text
-
-    if text == "⬅ Назад":
-        await state.set_state(OrderForm.project)
-        project_buttons = [[types.KeyboardButton(text=project) for project in PROJECTS]]
-        project_buttons.append([BACK_BUTTON])
-
-        data = await state.get_data()
-        action = data.get("action", "не выбрано")
-
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text=f"✅ Ты выбрал действие: *{action}*.\n"
-                 "🌐 Выбери нужный проект:",
-            parse_mode="Markdown",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=project_buttons,
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    data = await state.get_data()
-    project = data.get("project")
-    valid_servers = PROJECT_SERVERS.get(project, [])
-    if text not in valid_servers:
-        servers = PROJECT_SERVERS[project]
-        server_buttons = []
-        for i in range(0, len(servers), 2):
-            row = [types.KeyboardButton(text=server) for server in servers[i:i+2]]
-            server_buttons.append(row)
-        server_buttons.append([BACK_BUTTON])
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, выбери сервер из меню.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=server_buttons,
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    server = text
-    logger.info(f"User {user_id} selected server: {server}")
-    await state.update_data(server=server)
-    await state.set_state(OrderForm.amount)
-
+async def show_support(message: types.Message, state: FSMContext):
+    logger.info("User %s requested support", message.from_user.id)
     await bot.send_message(
         chat_id=message.chat.id,
-        text=f"✅ Ты выбрал сервер: *{server}*.\n"
-             "💵 Теперь введи сумму (от 1кк до 100кк, например, 12кк):",
-        parse_mode="Markdown",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[[BACK_BUTTON]],
-            resize_keyboard=True
-        )
+        text=f"📞 Свяжитесь с поддержкой: {SUPPORT_USERNAME}\n\n"
+             "🔄 Чтобы начать заново, отправь /start",
+        reply_markup=catalog.snapshot.keyboards.remove
     )
+    await state.clear()
 
-# Обработка ввода суммы
-@router.message(OrderForm.amount)
-async def process_amount(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    text = message.text
-
-    if text == "⬅ Назад":
-        await state.set_state(OrderForm.server)
-        data = await state.get_data()
-        project = data.get("project")
-        servers = PROJECT_SERVERS[project]
-        server_buttons = []
-        for i in range(0, len(servers), 2):
-            row = [types.KeyboardButton(text=server) for server in servers[i:i+2]]
-            server_buttons.append(row)
-        server_buttons.append([BACK_BUTTON])
-
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text=f"🌍 Выбери сервер для проекта *{project}*:",
-            parse_mode="Markdown",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=server_buttons,
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    match = re.match(r'^(\d{1,3})кк$', text)
-    if not match:
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, введи сумму от 1кк до 100кк (например, 12кк).",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[[BACK_BUTTON]],
-                resize_keyboard=True
-            )
-        )
-        return
-
-    amount_kk = int(match.group(1))
-    if not 1 <= amount_kk <= 100:
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Сумма должна быть от 1кк до 100кк.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[[BACK_BUTTON]],
-                resize_keyboard=True
-            )
-        )
-        return
-
-    logger.info(f"User {user_id} entered amount: {amount_kk}кк")
-    await state.update_data(amount_kk=amount_kk)
-    data = await state.get_data()
-    if data['action'] == "Купить":
-        price_rub = amount_kk * 1600
-    else:
-        price_rub = amount_kk * 900
-    await state.update_data(price_rub=price_rub)
-
-    await state.set_state(OrderForm.payment_type)
-
+# Разбор суммы: возвращает (сумма в кк строкой, None) или (None, текст ошибки).
+# Понимает «12кк», «12.5 кк», «12kk», «500к», «12000000»; сумма хранится строкой — Decimal не ложится в JSON
+def parse_amount(text):
+    amount_kk = parse_kk(text)
+    if amount_kk is None:
+        return None, "❌ Пожалуйста, введи сумму от 1кк до 100кк (например, 12кк или 12.5кк)."
+    if not MIN_ORDER_KK <= amount_kk <= MAX_ORDER_KK:
+        return None, "❌ Сумма должна быть от 1кк до 100кк."
+    return format_kk(amount_kk), None
+
+def amount_price(snapshot, amount_kk, data, message):
+    return {"price_rub": price_rub(amount_kk, snapshot.prices[data["action"]])}
+
+# Номер заказа выдаётся вместе со сводкой. Если подтверждение обработают второй раз (после
+# падения процесса Telegram доставит его снова), заказ с этим номером уже будет в журнале
+def order_customer(snapshot, payment_type, data, message):
+    return {
+        "user_id": message.from_user.id,
+        "username": message.from_user.username or "No username",
+        "order_id": ledger.ids.next_id()
+    }
+
+# Отмена заказа
+async def cancel_order(message: types.Message, state: FSMContext):
+    logger.info("User %s cancelled the order", message.from_user.id)
+    if METRICS_PORT:
+        FUNNEL.inc("cancelled")
     await bot.send_message(
         chat_id=message.chat.id,
-        text=f"✅ Ты ввёл сумму: *{amount_kk}кк*.\n"
-             f"💳 Теперь выбери тип оплаты:",
-        parse_mode="Markdown",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="💳 Карта"), types.KeyboardButton(text="📱 СБП")],
-                [types.KeyboardButton(text="💲 USDT"), types.KeyboardButton(text="₿ BTC")],
-                [BACK_BUTTON]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        text="❌ Заказ отменён.",
+        reply_markup=catalog.snapshot.keyboards.remove
     )
+    await state.clear()
 
-# Обработка выбора типа оплаты
-@router.message(OrderForm.payment_type)
-async def process_payment_type(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    text = message.text
+# Уведомление админу о заказе; значения экранируются, так что «_» в нике не ломает разметку
+ADMIN_ORDER_TEMPLATE = Template(
+    "🔔 *Новый заказ #{order_id}*\n\n"
+    "📅 *Дата и время*: {order_time}\n"
+    "👤 *Пользователь*: @{username} (ID: {user_id})\n"
+    "🎯 *Действие*: {action}\n"
+    "🎮 *Проект*: {project}\n"
+    "🌍 *Сервер*: {server}\n"
+    "💰 *Сумма*: {amount_kk}кк\n"
+    "💸 *Цена*: {price_rub} RUB\n"
+    "💳 *Тип оплаты*: {payment_type}\n"
+    "📊 *Статус*: {payment_status}\n\n"
+    f"🔗 *Ссылка на оплату*: [Payop Test]({PAYOP_TEST_LINK})",
+    ADMIN_FORMAT
+)
 
-    if text == "⬅ Назад":
-        await state.set_state(OrderForm.amount)
-        data = await state.get_data()
-        amount_kk = data.get("amount_kk", "не указано")
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text=f"💵 Введи сумму (от 1кк до 100кк, например, 12кк). Текущая сумма: *{amount_kk}кк*.",
-            parse_mode="Markdown",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[[BACK_BUTTON]],
-                resize_keyboard=True
-            )
-        )
-        return
+# Номера заказов, подтверждение которых обрабатывается сейчас. Двойное нажатие «Подтвердить»
+# приходит двумя обновлениями, и они идут параллельно: второе не должно записать заказ ещё раз
+confirming = set()
 
-    valid_payments = ["💳 Карта", "📱 СБП", "💲 USDT", "₿ BTC"]
-    if text not in valid_payments:
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, выбери тип оплаты из меню.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="💳 Карта"), types.KeyboardButton(text="📱 СБП")],
-                    [types.KeyboardButton(text="💲 USDT"), types.KeyboardButton(text="₿ BTC")],
-                    [BACK_BUTTON]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
+# Подтверждение заказа
+async def confirm_order(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    # Сессии, начатые до появления номера в сводке, его не имеют
+    order_id = data.get('order_id')
+    if order_id is None:
+        await record_order(message, state, data, None)
+        return
+    if order_id in confirming:
+        logger.warning("Order %s of user %s is being confirmed already, skipping repeated confirmation",
+                       order_id, message.from_user.id)
         return
 
-    payment_type = text.replace("💳 ", "").replace("📱 ", "").replace("💲 ", "").replace("₿ ", "")
-    logger.info(f"User {user_id} selected payment type: {payment_type}")
-    await state.update_data(payment_type=payment_type)
-    await state.update_data(user_id=user_id)
-    await state.update_data(username=message.from_user.username or "No username")
-
-    data = await state.get_data()
-    order_text = (
-        f"📋 Проверь заказ:\n\n"
-        f"Действие: *{data['action']}*\n"
-        f"Проект: *{data['project']}*\n"
-        f"Сервер: *{data['server']}*\n"
-        f"Сумма: *{data['amount_kk']}кк*\n"
-        f"Цена: *{data['price_rub']} RUB*\n"
-        f"Оплата: *{data['payment_type']}*"
-    )
+    confirming.add(order_id)
+    try:
+        # Повторная обработка того же подтверждения (после падения процесса Telegram доставит
+        # его снова): заказ уже в журнале или в очереди на запись, админа второй раз не уведомляем
+        if await ledger.get(order_id) is None:
+            await record_order(message, state, data, order_id)
+            return
+    finally:
+        confirming.discard(order_id)
+    logger.warning("Order %s of user %s is already recorded, skipping repeated confirmation",
+                   order_id, message.from_user.id)
     await bot.send_message(
         chat_id=message.chat.id,
-        text=order_text,
-        parse_mode="Markdown",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="✅ Подтвердить"), types.KeyboardButton(text="❌ Отмена")],
-                [BACK_BUTTON]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        text="✅ Заказ принят! Оплата в тестовом режиме.",
+        reply_markup=catalog.snapshot.keyboards.restart
     )
-    await state.set_state(OrderForm.confirm)
+    await state.clear()
 
-# Обработка подтверждения заказа
-@router.message(OrderForm.confirm)
-async def process_confirm(message: types.Message, state: FSMContext):
+async def record_order(message: types.Message, state: FSMContext, data, order_id):
     user_id = message.from_user.id
-    text = message.text
-
-    if text == "⬅ Назад":
-        await state.set_state(OrderForm.payment_type)
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="💳 Выбери тип оплаты:",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="💳 Карта"), types.KeyboardButton(text="📱 СБП")],
-                    [types.KeyboardButton(text="💲 USDT"), types.KeyboardButton(text="₿ BTC")],
-                    [BACK_BUTTON]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
-
-    if text == "❌ Отмена":
-        logger.info(f"User {user_id} cancelled the order")
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Заказ отменён.",
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        await state.clear()
-        return
-
-    if text != "✅ Подтвердить":
-        await bot.send_message(
-            chat_id=message.chat.id,
-            text="❌ Пожалуйста, выбери 'Подтвердить' или 'Отмена'.",
-            reply_markup=types.ReplyKeyboardMarkup(
-                keyboard=[
-                    [types.KeyboardButton(text="✅ Подтвердить"), types.KeyboardButton(text="❌ Отмена")],
-                    [BACK_BUTTON]
-                ],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-        )
-        return
 
     # Собираем данные заказа
-    data = await state.get_data()
     action = data['action']
     project = data['project']
     server = data['server']
@@ -500,50 +404,61 @@ async def process_confirm(message: types.Message, state: FSMContext):
     price_rub = data['price_rub']
     payment_type = data['payment_type']
     username = data['username']
-    order_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    created_at = datetime.now()
+    order_time = created_at.strftime('%Y-%m-%d %H:%M:%S')
+
+    # Записываем заказ в журнал; запись на диск идёт в фоне, хендлер её не ждёт
+    order_id = await ledger.add({
+        "id": order_id if order_id is not None else ledger.ids.next_id(),
+        "created_at": created_at.timestamp(),
+        "user_id": user_id,
+        "username": username,
+        "action": action,
+        "project": project,
+        "server": server,
+        "amount_kk": amount_kk,
+        "price_rub": price_rub,
+        "payment_type": payment_type
+    })
+    logger.info("Order %s recorded for user %s", order_id, user_id)
+    if METRICS_PORT:
+        FUNNEL.inc("confirmed")
 
     # Отправляем пользователю ссылку на оплату
     payment_status = "Ожидает оплаты (Payop тест)"
     await bot.send_message(
         chat_id=message.chat.id,
         text=f"🔗 Перейди для оплаты (тест): {PAYOP_TEST_LINK}",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=catalog.snapshot.keyboards.remove
     )
 
     # Формируем сообщение для админа
-    admin_message = (
-        f"🔔 *Новый заказ #ID{user_id}*\n\n"
-        f"📅 *Дата и время*: {order_time}\n"
-        f"👤 *Пользователь*: @{username} (ID: {user_id})\n"
-        f"🎯 *Действие*: {action}\n"
-        f"🎮 *Проект*: {project}\n"
-        f"🌍 *Сервер*: {server}\n"
-        f"💰 *Сумма*: {amount_kk}кк\n"
-        f"💸 *Цена*: {price_rub} RUB\n"
-        f"💳 *Тип оплаты*: {payment_type}\n"
-        f"📊 *Статус*: {payment_status}\n\n"
-        f"🔗 *Ссылка на оплату*: [Payop Test]({PAYOP_TEST_LINK})"
-    )
-
-    # Отправляем сообщение админу
+    admin_message, parse_mode, _ = ADMIN_ORDER_TEMPLATE.render({
+        "order_id": order_id,
+        "order_time": order_time,
+        "username": username,
+        "user_id": user_id,
+        "action": action,
+        "project": project,
+        "server": server,
+        "amount_kk": amount_kk,
+        "price_rub": price_rub,
+        "payment_type": payment_type,
+        "payment_status": payment_status
+    })
+
+    # Ставим уведомление админу в очередь; воркер отправит его с повторами и сводками
     try:
-        logger.info(f"Sending order notification to admin (chat_id: {ADMIN_CHAT_ID})")
-        await bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=admin_message,
-            parse_mode="Markdown",
-            disable_web_page_preview=True
-        )
-        logger.info(f"Order notification sent to admin successfully")
+        await notifier.enqueue(ADMIN_CHAT_ID, admin_message, parse_mode=parse_mode)
     except Exception as e:
-        logger.error(f"Failed to send notification to admin: {e}")
+        logger.error("Failed to queue admin notification for order %s: %s", order_id, e)
         await bot.send_message(
             chat_id=message.chat.id,
             text="⚠️ Заказ принят, но возникла проблема с уведомлением админа. Мы разберёмся!"
         )
 
     # Подтверждаем пользователю
-    logger.info(f"User {user_id} confirmed the order")
+    logger.info("User %s confirmed the order", user_id)
     await bot.send_message(
         chat_id=message.chat.id,
         text="✅ Заказ принят! Оплата в тестовом режиме."
@@ -553,19 +468,108 @@ async def process_confirm(message: types.Message, state: FSMContext):
     await bot.send_message(
         chat_id=message.chat.id,
         text="🔄 Хочешь сделать новый заказ?",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[[types.KeyboardButton(text="/start")]],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        reply_markup=catalog.snapshot.keyboards.restart
     )
     await state.clear()
 
+# Сценарий заказа: каждый шаг — строка таблицы
+ORDER_STEPS = [
+    Step(
+        OrderForm.action, field="action",
+        keyboard=lambda snapshot, data: snapshot.keyboards.action,
+        prompt=Reply("🎮 Выбери, что хочешь сделать:"),
+        invalid="❌ Пожалуйста, выбери действие из меню.",
+        options=ACTIONS,
+        chosen=Reply("✅ Ты выбрал действие: *{action}*.\n🌐 Выбери нужный проект:", markdown=True),
+        next=OrderForm.project,
+        on_back=exit_menu,
+        commands={"📝 Отзывы": show_reviews, "📞 Поддержка": show_support}
+    ),
+    Step(
+        OrderForm.project, field="project",
+        keyboard=lambda snapshot, data: snapshot.keyboards.projects,
+        prompt=Reply("✅ Ты выбрал действие: *{action}*.\n🌐 Выбери нужный проект:", markdown=True),
+        invalid="❌ Пожалуйста, выбери проект из меню.",
+        options=lambda snapshot, data: snapshot.project_options,
+        chosen=Reply("✅ Ты выбрал проект: *{project}*.\n🌍 Теперь выбери сервер:", markdown=True),
+        next=OrderForm.server,
+        back=OrderForm.action
+    ),
+    Step(
+        OrderForm.server, field="server",
+        keyboard=lambda snapshot, data: snapshot.keyboards.servers.get(
+            data["project"], snapshot.keyboards.projects
+        ),
+        prompt=Reply("🌍 Выбери сервер для проекта *{project}*:", markdown=True),
+        invalid="❌ Пожалуйста, выбери сервер из меню.",
+        options=lambda snapshot, data: snapshot.server_options.get(data["project"], {}),
+        chosen=Reply(
+            "✅ Ты выбрал сервер: *{server}*.\n"
+            "💵 Теперь введи сумму (от 1кк до 100кк, например, 12кк):",
+            markdown=True
+        ),
+        next=OrderForm.amount,
+        back=OrderForm.project,
+        # Проект убрали из каталога, пока пользователь выбирал сервер
+        requires=lambda snapshot, data: data["project"] in snapshot.server_options,
+        unavailable=Reply("⚠️ Проект *{project}* больше недоступен.\n🌐 Выбери другой проект:", markdown=True)
+    ),
+    Step(
+        OrderForm.amount, field="amount_kk",
+        keyboard=lambda snapshot, data: snapshot.keyboards.amount,
+        prompt=Reply(
+            "💵 Введи сумму (от 1кк до 100кк, например, 12кк). Текущая сумма: *{amount_kk}кк*.",
+            markdown=True
+        ),
+        invalid=None,
+        parse=parse_amount,
+        extra=amount_price,
+        chosen=Reply("✅ Ты ввёл сумму: *{amount_kk}кк*.\n💳 Теперь выбери тип оплаты:", markdown=True),
+        next=OrderForm.payment_type,
+        back=OrderForm.server
+    ),
+    Step(
+        OrderForm.payment_type, field="payment_type",
+        keyboard=lambda snapshot, data: snapshot.keyboards.payment,
+        prompt=Reply("💳 Выбери тип оплаты:"),
+        invalid="❌ Пожалуйста, выбери тип оплаты из меню.",
+        options=PAYMENT_METHODS,
+        extra=order_customer,
+        chosen=Reply(
+            "📋 Проверь заказ:\n\n"
+            "Действие: *{action}*\n"
+            "Проект: *{project}*\n"
+            "Сервер: *{server}*\n"
+            "Сумма: *{amount_kk}кк*\n"
+            "Цена: *{price_rub} RUB*\n"
+            "Оплата: *{payment_type}*",
+            markdown=True
+        ),
+        next=OrderForm.confirm,
+        back=OrderForm.amount
+    ),
+    Step(
+        OrderForm.confirm, field="confirm",
+        keyboard=lambda snapshot, data: snapshot.keyboards.confirm,
+        prompt=Reply("📋 Подтверди заказ:"),
+        invalid="❌ Пожалуйста, выбери 'Подтвердить' или 'Отмена'.",
+        options={},
+        back=OrderForm.payment_type,
+        commands={CONFIRM_BUTTON: confirm_order, CANCEL_BUTTON: cancel_order}
+    ),
+]
+order_flow = FlowEngine(
+    bot, ORDER_STEPS, back_text=BACK_TEXT, context=lambda: catalog.snapshot, format=MESSAGE_FORMAT
+)
+
+# Один хендлер на все шаги сценария
+async def process_order_step(message: types.Message, state: FSMContext, raw_state: str):
+    await order_flow.handle(message, state, raw_state)
+
 # Команда /help
-@router.message(Command("help"))
 async def help_command(message: types.Message):
     user_id = message.from_user.id
-    logger.info(f"User {user_id} requested help")
+    logger.info("User %s requested help", user_id)
     await bot.send_message(
         chat_id=message.chat.id,
         text="ℹ️ Бот для покупки и продажи виртов GTA 5 RP и Majestic RP.\n"
@@ -576,40 +580,230 @@ async def help_command(message: types.Message):
              "💳 Оплата через Payop (тестовый режим)."
     )
 
-# Функция для попытки удаления вебхука с повторными попытками
-async def delete_webhook_with_retries(max_retries=3, delay=5):
+# Нажатие inline-кнопки (только UI_MODE=inline): её текст проходит тот же путь, что и сообщение
+# с этим текстом, а ответы бота собираются в одну правку карточки, на которой нажали
+async def inline_button(callback: types.CallbackQuery, **data):
+    text = catalog.snapshot.keyboards.decode(callback.data)
+    if text is None or not isinstance(callback.message, types.Message):
+        await callback.answer("Кнопка устарела, отправь /start")
+        return
+    message = callback.message.model_copy(
+        update={"text": text, "from_user": callback.from_user, "entities": None, "reply_markup": None}
+    )
+    try:
+        async with inline_screen.editing(callback.message):
+            result = await data["event_router"].propagate_event("message", message, **data)
+    except Exception:
+        await callback.answer()
+        raise
+    await callback.answer("Отправь /start, чтобы начать заново" if result is UNHANDLED else None)
+
+# Роутер со всеми хендлерами и middleware. Каждый вызов собирает новый: роутер подключается
+# только к одному диспетчеру, а бенчмарки собирают свой диспетчер на каждый прогон
+def create_router():
+    router = Router()
+    # Новое сообщение пользователя отменяет неотправленный хвост отложенных сообщений
+    router.message.outer_middleware(sequencer)
+    # Одно чтение и одна запись FSM на обновление вместо отдельного запроса на каждый вызов state
+    router.message.middleware(StateTransactionMiddleware())
+    # Время хендлеров по шагам заказа и воронка; стоит внутри транзакции FSM
+    if METRICS_PORT:
+        router.message.middleware(HandlerMetricsMiddleware(order=order_flow.states))
+    # Порядок важен: /start сбрасывает сценарий из любого шага, /help внутри сценария — его шаг
+    router.message.register(start_command, Command("start"))
+    router.message.register(process_order_step, StateFilter(*order_flow.states))
+    router.message.register(help_command, Command("help"))
+    if UI_MODE == "inline":
+        router.callback_query.register(inline_button)
+    return router
+
+# Функция для попытки удаления вебхука с повторными попытками.
+# Накопившиеся обновления не сбрасываются: их заберёт polling
+async def delete_webhook_with_retries(max_retries=3):
+    backoff = Backoff(initial=2.0)
     for attempt in range(max_retries):
         try:
-            await bot.delete_webhook(drop_pending_updates=True)
+            await bot.delete_webhook()
             logger.info("Webhook deleted successfully")
             return True
         except TelegramNetworkError as e:
-            logger.error(f"Failed to delete webhook (attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(delay)
+            logger.error("Failed to delete webhook (attempt %s/%s): %s", attempt + 1, max_retries, e)
+            if attempt < max_retries - 1 and await lifecycle.sleep(backoff.next()):
+                break
     return False
 
-# Основная функция для polling
-async def main():
-    from aiogram import Dispatcher
-    dp = Dispatcher(bot=bot, storage=storage)
-    dp.include_router(router)
-
-    # Пытаемся удалить вебхук с повторными попытками
+# Удаление вебхука идёт параллельно с первым getUpdates: пока вебхук не снят,
+# getUpdates отвечает 409, и poller повторяет запрос сразу после удаления
+async def delete_webhook():
     if not await delete_webhook_with_retries():
         logger.error("Failed to delete webhook after all retries. Continuing anyway...")
 
-    # Запускаем polling с обработкой ошибок
+# Сборка aiohttp-приложения для приёма вебхуков
+def build_webhook_app(dp):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    # handle_in_background: Telegram сразу получает 200, а хендлер работает в отдельной задаче
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def register_webhook():
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set, incoming requests are not authenticated")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        logger.info("Webhook set to %s%s", WEBHOOK_URL.rstrip('/'), WEBHOOK_PATH)
+    else:
+        logger.info("WEBHOOK_URL is not set, expecting the webhook to be registered externally")
+
+# Режим вебхука: несколько процессов можно поставить за балансировщик
+async def run_webhook(dp):
+    from aiohttp import web
+
+    runner = web.AppRunner(build_webhook_app(dp))
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    # Порт открывается до setWebhook, чтобы первые доставки Telegram не уходили в пустоту
+    await site.start()
+    logger.info("Listening for webhook updates on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    lifecycle.ready()
+    try:
+        await register_webhook()
+        await lifecycle.wait_stop()
+        # Новые запросы больше не принимаем, а принятые в фоне дорабатываем до дедлайна.
+        # Необработанные вебхуки Telegram не повторит: они уже получили 200
+        await site.stop()
+        await lifecycle.drain()
+    finally:
+        await runner.cleanup()
+
+# Режим polling. Сетевые ошибки и 5xx переживаются внутри с паузой и джиттером;
+# по сигналу принятые обновления дорабатываются, а остаток уходит в контрольную точку
+async def run_polling(dp):
+    poller = UpdatePoller(
+        dp,
+        bot,
+        lifecycle,
+        checkpoint=OffsetCheckpoint(POLL_CHECKPOINT) if POLL_CHECKPOINT else None,
+        allowed_updates=ALLOWED_UPDATES,
+        cleanup=delete_webhook
+    )
+    await poller.run()
+
+# Супервизор: принимает обновления и раздаёт их воркерам, сам хендлеры не запускает.
+# SIGHUP перезапускает воркеры по одному, SIGTERM/SIGINT — мягкая остановка всех
+async def run_supervisor():
+    from workers import Supervisor
+
+    backend = os.getenv("FSM_STORAGE", "compact")
+    if backend in ("compact", "memory"):
+        logger.warning("FSM_STORAGE=%s: users of a restarted worker lose their order progress", backend)
+    supervisor = Supervisor(bot, WORKER_COUNT, [sys.executable, os.path.abspath(__file__)])
+    await supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            await register_webhook()
+            await supervisor.serve_webhook(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        else:
+            await supervisor.poll(
+                allowed_updates=ALLOWED_UPDATES,
+                cleanup=delete_webhook,
+                checkpoint=OffsetCheckpoint(POLL_CHECKPOINT) if POLL_CHECKPOINT else None
+            )
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
+
+# /metrics поднимается, когда бот уже принимает обновления. Порт может быть ещё занят
+# прежним воркером, который дорабатывает принятое, поэтому занятый порт пробуем снова
+async def serve_metrics():
+    from metrics import start_metrics_server
+
+    await lifecycle.wait_ready()
+    backoff = Backoff(initial=0.5, maximum=5.0)
     while True:
         try:
-            await dp.start_polling(allowed_updates=["message"])
-        except TelegramNetworkError as e:
-            logger.error(f"Network error during polling: {e}")
-            await asyncio.sleep(15)  # Увеличенная пауза перед перезапуском
-        except Exception as e:
-            logger.error(f"Unexpected error during polling: {e}")
-            logger.info("Bot stopped, restarting...")
-            await asyncio.sleep(10)  # Пауза перед перезапуском
+            runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+            break
+        except OSError as e:
+            delay = backoff.next()
+            logger.warning("Metrics port %s is unavailable, retrying in %.1f s: %s", METRICS_PORT, delay, e)
+            await asyncio.sleep(delay)
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
+
+# Основная функция
+async def main():
+    startup_profile.mark("init")
+    if WORKER_COUNT > 1 and WORKER_INDEX is None:
+        await run_supervisor()
+        return
+
+    from aiogram import Dispatcher
+    dp = Dispatcher(storage=storage)
+    dp.include_router(create_router())
+    # Трасса видит обновления такими, какими их прислал Telegram, — до всех проверок
+    recorder = None
+    if UPDATE_TRACE:
+        from update_trace import UpdateRecorder, worker_path
+
+        recorder = UpdateRecorder(worker_path(UPDATE_TRACE, WORKER_INDEX), UPDATE_TRACE_SECRET)
+        dp.update.outer_middleware(recorder)
+        await recorder.start()
+    # Учёт обновлений в работе для мягкой остановки; стоит до защиты от флуда и FSM
+    dp.update.outer_middleware(lifecycle)
+    if flood_guard is not None:
+        flood_guard.install(dp)
+    startup_profile.mark("dispatcher")
+
+    # Следим за файлом каталога: новые цены и серверы подхватываются без перезапуска
+    catalog_watcher = asyncio.create_task(catalog.watch(CATALOG_RELOAD_INTERVAL))
+    await ledger.start()
+    await notifier.start(deliver=not WORKER_INDEX)
+    startup_profile.mark("storage")
+    metrics_server = asyncio.create_task(serve_metrics()) if METRICS_PORT else None
+    # Воркеры останавливает супервизор, закрывая их stdin
+    if WORKER_INDEX is None:
+        lifecycle.install_signals()
+    try:
+        if WORKER_INDEX is not None:
+            from workers import run_worker
+
+            lifecycle.ready()
+            await run_worker(dp, bot)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp)
+        else:
+            await run_polling(dp)
+    finally:
+        catalog_watcher.cancel()
+        if metrics_server is not None:
+            metrics_server.cancel()
+            await asyncio.gather(metrics_server, return_exceptions=True)
+        # Меню после приветствия и другие отложенные ответы успевают уйти до дедлайна
+        await sequencer.join(lifecycle.remaining())
+        await sequencer.close()
+        if recorder is not None:
+            await recorder.close()
+        await notifier.stop()
+        await ledger.close()
+        await storage.close()
+        await bot.session.close()
+        lifecycle.stopped()
 
 if __name__ == "__main__":
     asyncio.run(main())
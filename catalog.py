@@ -0,0 +1,118 @@
+# Каталог проектов, серверов и цен из файла с подменой на лету
+import asyncio
+import json
+import logging
+import os
+import tomllib
+from types import MappingProxyType
+
+logger = logging.getLogger("telegram_bot.catalog")
+
+
+class CatalogError(Exception):
+    pass
+
+
+# Неизменяемый снимок каталога со всеми индексами и клавиатурами
+class CatalogSnapshot:
+    __slots__ = ("version", "project_servers", "prices", "project_options",
+                 "server_options", "server_project", "keyboards")
+
+    # actions — значения действий из меню бота: у каждого должна быть цена
+    def __init__(self, raw, build_keyboards, version=0, actions=()):
+        if not isinstance(raw, dict):
+            raise CatalogError("catalog must be a table")
+        projects = raw.get("projects")
+        prices = raw.get("prices")
+        if not isinstance(projects, dict) or not projects:
+            raise CatalogError("catalog must define a non-empty 'projects' table")
+        if not isinstance(prices, dict) or not prices:
+            raise CatalogError("catalog must define a non-empty 'prices' table")
+        for project, servers in projects.items():
+            if not isinstance(servers, list) or not servers:
+                raise CatalogError(f"project {project!r} has no servers")
+            for server in servers:
+                if not isinstance(server, str) or not server:
+                    raise CatalogError(f"server {server!r} of project {project!r} must be a non-empty string")
+        for action, price in prices.items():
+            # bool — подкласс int: "price": true не должен стать ценой 1
+            if isinstance(price, bool) or not isinstance(price, int) or price <= 0:
+                raise CatalogError(f"price for {action!r} must be a positive integer")
+        missing = [action for action in actions if action not in prices]
+        if missing:
+            raise CatalogError(f"no price for actions {', '.join(map(repr, missing))}")
+
+        self.version = version
+        self.project_servers = MappingProxyType({p: tuple(s) for p, s in projects.items()})
+        self.prices = MappingProxyType(dict(prices))
+        # Индексы «текст кнопки → значение» для проверки ввода за один поиск в словаре
+        self.project_options = MappingProxyType({project: project for project in projects})
+        self.server_options = MappingProxyType({
+            project: MappingProxyType({server: server for server in servers})
+            for project, servers in projects.items()
+        })
+        self.server_project = MappingProxyType({
+            server: project for project, servers in projects.items() for server in servers
+        })
+        self.keyboards = build_keyboards(self.project_servers)
+
+
+def read_catalog_file(path):
+    with open(path, "rb") as f:
+        if path.endswith(".toml"):
+            return tomllib.load(f)
+        return json.load(f)
+
+
+# Держит актуальный снимок; читатели берут self.snapshot без блокировок
+class Catalog:
+    def __init__(self, path, build_keyboards, on_swap=None, actions=()):
+        self.path = path
+        self.build_keyboards = build_keyboards
+        self.actions = tuple(actions)
+        self.on_swap = on_swap
+        self._mtime = None
+        self.snapshot = None
+        if not self.reload():
+            raise CatalogError(f"failed to load catalog from {path}")
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            version = self.snapshot.version + 1 if self.snapshot else 1
+            snapshot = CatalogSnapshot(read_catalog_file(self.path), self.build_keyboards, version, self.actions)
+        except (OSError, ValueError, CatalogError) as e:
+            logger.error("Failed to load catalog %s: %s", self.path, e)
+            return False
+        self._mtime = mtime
+        # Одно присваивание — атомарная подмена снимка
+        self.snapshot = snapshot
+        if self.on_swap is not None:
+            self.on_swap(snapshot)
+        logger.info(
+            "Catalog v%s loaded: %s projects, %s servers",
+            version, len(snapshot.project_servers), len(snapshot.server_project)
+        )
+        return True
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error("Catalog file is not accessible: %s", e)
+            return False
+        if mtime == self._mtime:
+            return False
+        # Запоминаем mtime сразу, чтобы битый файл не перечитывался и не логировался каждый раз
+        self._mtime = mtime
+        return self.reload()
+
+    # Проверка mtime раз в interval секунд; при ошибке разбора остаётся прежний снимок.
+    # Непредвиденная ошибка (например, в on_swap) не останавливает слежение
+    async def watch(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.exception("Catalog reload failed: %s", e)
@@ -0,0 +1,103 @@
+# Защита от флуда на уровне обновлений: повторно доставленные update_id и всплески
+# от одного пользователя отбрасываются до чтения FSM и перебора хендлеров,
+# чтобы один спамер не занимал хранилище, планировщик отправок и очередь соседей.
+import logging
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+
+from sender import TokenBucket
+
+logger = logging.getLogger("telegram_bot.flood")
+
+
+# Последние size идентификаторов: множество для поиска, очередь — порядок вытеснения
+class RecentIds:
+    __slots__ = ("size", "_ids", "_order")
+
+    def __init__(self, size):
+        self.size = size
+        self._ids = set()
+        self._order = deque()
+
+    # True, если id уже встречался среди последних size
+    def seen(self, item):
+        if item in self._ids:
+            return True
+        self._ids.add(item)
+        self._order.append(item)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+        return False
+
+    def __len__(self):
+        return len(self._ids)
+
+
+# Outer middleware dp.update. Ставится через install(): после UserContextMiddleware
+# (нужен event_from_user), но до FSMContextMiddleware, которое читает состояние из хранилища
+class FloodGuard(BaseMiddleware):
+    def __init__(self, rate=2.0, burst=10, dedupe_window=10000, notice=None):
+        self.rate = rate
+        self.burst = burst
+        # Текст одного предупреждения на всплеск; None — отбрасывать молча
+        self.notice = notice
+        self._recent = RecentIds(dedupe_window)
+        self._users = {}
+        self._warned = set()
+        self._last_cleanup = time.monotonic()
+        self.duplicates = 0
+        self.throttled = 0
+
+    def install(self, dp):
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+
+    def stats(self):
+        return {
+            "duplicates": self.duplicates,
+            "throttled": self.throttled,
+            "tracked_users": len(self._users),
+            "dedupe_window": len(self._recent),
+        }
+
+    # Ведра пользователей, которые давно молчат, снова полные — их можно забыть
+    def _cleanup(self, now):
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for user_id in [u for u, bucket in self._users.items() if bucket.idle(now)]:
+            del self._users[user_id]
+            self._warned.discard(user_id)
+
+    def _allow(self, user_id):
+        now = time.monotonic()
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.rate, self.burst)
+            self._cleanup(now)
+        if bucket.take(now):
+            self._warned.discard(user_id)
+            return True
+        return False
+
+    async def __call__(self, handler, event, data):
+        if self._recent.seen(event.update_id):
+            self.duplicates += 1
+            logger.debug("Duplicate update %s dropped", event.update_id)
+            return UNHANDLED
+
+        user = data.get("event_from_user")
+        if user is None or self._allow(user.id):
+            return await handler(event, data)
+
+        self.throttled += 1
+        logger.debug("Update %s from user %s dropped by flood control", event.update_id, user.id)
+        chat = data.get("event_chat")
+        if self.notice and chat is not None and user.id not in self._warned:
+            self._warned.add(user.id)
+            await data["bot"].send_message(chat.id, self.notice)
+        return UNHANDLED
@@ -0,0 +1,146 @@
+# Табличный движок сценария заказа: шаги описываются данными, а не хендлерами
+import logging
+
+from templates import HTML, template
+
+logger = logging.getLogger("telegram_bot.flow")
+
+
+# Значение по умолчанию для полей, которых ещё нет в данных заказа
+def _not_selected(name):
+    return "не выбрано"
+
+
+# Текст ответа с полями заказа {field}; markdown=True — в тексте есть *жирный* и [ссылки].
+# Шаблон собирается при первом использовании в нужном формате и дальше берётся из кэша
+class Reply:
+    __slots__ = ("text", "markdown")
+
+    def __init__(self, text, markdown=False):
+        self.text = text
+        self.markdown = markdown
+
+    # (text, parse_mode, entities) для send_message
+    def render(self, data, format=HTML):
+        return template(self.text, format, self.markdown).render(data, _not_selected)
+
+
+# Один шаг сценария. ctx — объект, который движок получает от context() один раз на обновление
+# (например, снимок каталога), поэтому весь шаг видит согласованные данные.
+#   keyboard(ctx, data) — клавиатура шага
+#   prompt          — вопрос шага (при возврате на него кнопкой «Назад»)
+#   options         — словарь «текст кнопки → значение» или функция (ctx, data) → словарь
+#   parse(text)     — разбор свободного ввода, возвращает (значение, текст ошибки)
+#   extra(ctx, value, data, message) — дополнительные поля, записываемые вместе со значением
+#   chosen          — ответ на верный ввод; клавиатура берётся у следующего шага
+#   back            — состояние, куда ведёт «Назад»; on_back — своя обработка «Назад»
+#   commands        — кнопки шага со своими обработчиками
+#   requires(ctx, data) — выбранное раньше ещё есть в ctx (каталог могли перезагрузить);
+#                     если нет, пользователь возвращается на шаг back с ответом unavailable
+class Step:
+    def __init__(self, state, field, keyboard, prompt, invalid, options=None, parse=None,
+                 extra=None, chosen=None, next=None, back=None, on_back=None, commands=None,
+                 requires=None, unavailable=None):
+        self.state = state.state
+        self.field = field
+        self.keyboard = keyboard
+        self.prompt = prompt
+        self.invalid = invalid
+        self.options = options
+        self.parse = parse
+        self.extra = extra
+        self.chosen = chosen
+        self.next = next.state if next is not None else None
+        self.back = back.state if back is not None else None
+        self.on_back = on_back
+        self.commands = commands or {}
+        self.requires = requires
+        self.unavailable = unavailable
+
+    def resolve_options(self, ctx, data):
+        if callable(self.options):
+            return self.options(ctx, data)
+        return self.options
+
+
+class FlowEngine:
+    # format — формат разметки ответов, см. templates.FORMATS
+    def __init__(self, bot, steps, back_text, context=None, format=HTML):
+        self.bot = bot
+        self.back_text = back_text
+        self.context = context
+        self.format = format
+        self.steps = {step.state: step for step in steps}
+
+    @property
+    def states(self):
+        return list(self.steps)
+
+    async def send(self, chat_id, reply, data, keyboard):
+        text, parse_mode, entities = reply.render(data, self.format)
+        await self.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode=parse_mode,
+            entities=entities,
+            reply_markup=keyboard
+        )
+
+    # Единый хендлер для всех шагов: одна проверка по словарю вместо цепочки сравнений
+    async def handle(self, message, state, raw_state=None):
+        step = self.steps[raw_state or await state.get_state()]
+        ctx = self.context() if self.context is not None else None
+        text = message.text
+
+        if text == self.back_text:
+            await self.go_back(step, ctx, message, state)
+            return
+
+        command = step.commands.get(text)
+        if command is not None:
+            await command(message, state)
+            return
+
+        if step.requires is not None:
+            data = await state.get_data()
+            if not step.requires(ctx, data):
+                await self.go_back(step, ctx, message, state, reply=step.unavailable)
+                return
+
+        await self.select(step, ctx, message, state)
+
+    # reply — свой текст вместо вопроса предыдущего шага
+    async def go_back(self, step, ctx, message, state, reply=None):
+        if step.on_back is not None:
+            await step.on_back(message, state)
+            return
+        previous = self.steps[step.back]
+        await state.set_state(previous.state)
+        data = await state.get_data()
+        await self.send(message.chat.id, reply or previous.prompt, data, previous.keyboard(ctx, data))
+
+    async def select(self, step, ctx, message, state):
+        text = message.text
+        chat_id = message.chat.id
+        data = await state.get_data()
+        if step.parse is not None:
+            value, error = step.parse(text)
+        else:
+            value = step.resolve_options(ctx, data).get(text)
+            error = step.invalid if value is None else None
+        if error is not None:
+            await self.send(chat_id, Reply(error), data, step.keyboard(ctx, data))
+            return
+
+        logger.info(
+            "User %s selected %s: %s", message.from_user.id, step.field, value,
+            extra={"user_id": message.from_user.id, "step": step.field, "value": value}
+        )
+        changes = {step.field: value}
+        if step.extra is not None:
+            changes.update(step.extra(ctx, value, data, message))
+        data = await state.update_data(changes)
+
+        following = self.steps.get(step.next)
+        await state.set_state(step.next)
+        await self.send(chat_id, step.chosen, data, following.keyboard(ctx, data) if following else None)
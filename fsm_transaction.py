@@ -0,0 +1,80 @@
+# Единица работы для FSM: одно чтение и одна запись состояния на обновление
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+
+
+# Контекст с локальной копией данных; в хранилище ничего не пишется до commit()
+class StateTransaction(FSMContext):
+    def __init__(self, storage, key, raw_state=None):
+        super().__init__(storage=storage, key=key)
+        self._state = raw_state
+        self._data = None
+        self._state_changed = False
+        self._data_changed = False
+
+    async def _load(self):
+        if self._data is None:
+            self._data = dict(await self.storage.get_data(key=self.key))
+        return self._data
+
+    async def set_state(self, state=None):
+        self._state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def get_state(self):
+        return self._state
+
+    async def set_data(self, data):
+        self._data = dict(data)
+        self._data_changed = True
+
+    async def get_data(self):
+        return dict(await self._load())
+
+    async def get_value(self, key, default=None):
+        return (await self._load()).get(key, default)
+
+    async def update_data(self, data=None, **kwargs):
+        if data:
+            kwargs.update(data)
+        current = await self._load()
+        current.update(kwargs)
+        self._data_changed = True
+        return dict(current)
+
+    async def clear(self):
+        await self.set_state(None)
+        await self.set_data({})
+
+    # Записываем состояние и данные вместе; хранилища с set_state_and_data делают это за один запрос
+    async def commit(self):
+        if not (self._state_changed or self._data_changed):
+            return
+        combined = getattr(self.storage, "set_state_and_data", None)
+        if combined is not None and self._state_changed and self._data_changed:
+            await combined(key=self.key, state=self._state, data=self._data)
+        else:
+            if self._state_changed:
+                await self.storage.set_state(key=self.key, state=self._state)
+            if self._data_changed:
+                await self.storage.set_data(key=self.key, data=self._data)
+        self._state_changed = self._data_changed = False
+
+
+# Подменяет FSMContext хендлера на StateTransaction и сбрасывает изменения после него
+class StateTransactionMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        context = data.get("state")
+        if context is None:
+            return await handler(event, data)
+
+        transaction = StateTransaction(context.storage, context.key, raw_state=data.get("raw_state"))
+        data["state"] = transaction
+        try:
+            result = await handler(event, data)
+        finally:
+            data["state"] = context
+        # Если хендлер упал, изменения отбрасываются — как при откате транзакции
+        await transaction.commit()
+        return result
@@ -0,0 +1,140 @@
+# HTTP-сессия бота: отдельные пулы соединений для long polling и для отправки,
+# keep-alive, кэш DNS и статистика пулов через трассировку aiohttp
+import contextvars
+import time
+
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram.__meta__ import __version__
+
+from keyboards import CachedMarkupSession
+
+POOL_SEND = "send"
+POOL_POLL = "poll"
+
+# Пул текущего запроса; выбирается в make_request, читается в create_session той же задачи
+_pool = contextvars.ContextVar("http_pool", default=POOL_SEND)
+
+
+class PoolStats:
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.connect_seconds = 0.0
+        self.queued = 0
+        self.queue_seconds = 0.0
+
+    def trace_config(self):
+        config = TraceConfig()
+        config.on_request_start.append(self._request_start)
+        config.on_request_end.append(self._request_end)
+        config.on_request_exception.append(self._request_end)
+        config.on_connection_create_start.append(self._started)
+        config.on_connection_create_end.append(self._connected)
+        config.on_connection_reuseconn.append(self._reused)
+        config.on_connection_queued_start.append(self._started)
+        config.on_connection_queued_end.append(self._dequeued)
+        return config
+
+    async def _request_start(self, session, ctx, params):
+        self.requests += 1
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+
+    async def _request_end(self, session, ctx, params):
+        self.in_use -= 1
+
+    async def _started(self, session, ctx, params):
+        ctx.started = time.perf_counter()
+
+    async def _connected(self, session, ctx, params):
+        self.created += 1
+        self.connect_seconds += time.perf_counter() - ctx.started
+
+    async def _reused(self, session, ctx, params):
+        self.reused += 1
+
+    async def _dequeued(self, session, ctx, params):
+        # Все соединения пула были заняты, запрос ждал свободного
+        self.queued += 1
+        self.queue_seconds += time.perf_counter() - ctx.started
+
+    def snapshot(self):
+        connections = self.created + self.reused
+        return {
+            "requests": self.requests,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "connections_created": self.created,
+            "connections_reused": self.reused,
+            "reuse_rate": round(self.reused / connections, 4) if connections else 0.0,
+            "avg_connect_ms": round(self.connect_seconds / self.created * 1000, 3) if self.created else 0.0,
+            "queued": self.queued,
+            "avg_queue_ms": round(self.queue_seconds / self.queued * 1000, 3) if self.queued else 0.0,
+        }
+
+
+# getUpdates держит соединение до timeout секунд; в своём пуле он не занимает место ответов.
+# Конвейерной отправки (HTTP/1.1 pipelining) aiohttp не умеет, а для POST она и небезопасна:
+# параллельность даёт пул соединений с keep-alive.
+class PooledSession(CachedMarkupSession):
+    def __init__(self, pool_size=100, per_host=0, keepalive=60.0, dns_ttl=3600, poll_pool_size=1, **kwargs):
+        super().__init__(limit=pool_size, **kwargs)
+        self._connector_init.update(
+            limit_per_host=per_host,
+            keepalive_timeout=keepalive,
+            ttl_dns_cache=dns_ttl,
+            enable_cleanup_closed=True,
+        )
+        self.poll_pool_size = poll_pool_size
+        self._poll_session = None
+        self.pools = {POOL_SEND: PoolStats(POOL_SEND), POOL_POLL: PoolStats(POOL_POLL)}
+
+    def _new_session(self, pool, limit):
+        return ClientSession(
+            connector=self._connector_type(**{**self._connector_init, "limit": limit}),
+            headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+            trace_configs=[self.pools[pool].trace_config()],
+        )
+
+    async def create_session(self):
+        if _pool.get() == POOL_POLL:
+            if self._poll_session is None or self._poll_session.closed:
+                self._poll_session = self._new_session(POOL_POLL, self.poll_pool_size)
+            return self._poll_session
+
+        # Сброс коннектора закрывает только пул отправки: идущий getUpdates не обрываем
+        if self._should_reset_connector:
+            await super().close()
+        if self._session is None or self._session.closed:
+            self._session = self._new_session(POOL_SEND, self._connector_init["limit"])
+            self._should_reset_connector = False
+        return self._session
+
+    async def make_request(self, bot, method, timeout=None):
+        token = _pool.set(POOL_POLL if method.__api_method__ == "getUpdates" else POOL_SEND)
+        try:
+            return await super().make_request(bot, method, timeout)
+        finally:
+            _pool.reset(token)
+
+    # После сетевой ошибки getUpdates соединение polling'а может быть оборвано, а в пуле остаться:
+    # закрываем только этот пул, следующий getUpdates откроет новое. Отправка ответов не прерывается
+    async def reset_poll_pool(self):
+        if self._poll_session is not None and not self._poll_session.closed:
+            await self._poll_session.close()
+        self._poll_session = None
+
+    # Закрываем оба пула при остановке бота
+    async def close(self):
+        if self._poll_session is not None and not self._poll_session.closed:
+            await self._poll_session.close()
+        await super().close()
+
+    def pool_stats(self):
+        return {name: stats.snapshot() for name, stats in self.pools.items()}
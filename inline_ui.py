@@ -0,0 +1,170 @@
+# Режим UI_MODE=inline: сценарий ведётся inline-кнопками в одном сообщении-карточке.
+# Хендлеры не меняются — они по-прежнему вызывают send_message с reply-клавиатурами,
+# а middleware сессии собирает ответы на нажатие кнопки в одну правку карточки
+# (editMessageText) и подменяет reply-клавиатуры их inline-двойниками.
+import contextvars
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from templates import utf16_len
+
+logger = logging.getLogger("telegram_bot.inline")
+
+# Сколько последних карточек помнить, чтобы не править карточку тем же содержимым
+SHOWN_CARDS = 10000
+
+
+class _Card:
+    __slots__ = ("chat", "chat_id", "message_id", "pending", "bot", "closed")
+
+    def __init__(self, chat, message_id):
+        self.chat = chat
+        self.chat_id = chat.id
+        self.message_id = message_id
+        # (SendMessage, inline-разметка): клавиатура переводится сразу, пока снимок каталога тот же
+        self.pending = []
+        self.bot = None
+        self.closed = False
+
+
+# Карточка, на которой нажали кнопку в текущем обновлении
+_card = contextvars.ContextVar("inline_card", default=None)
+
+
+def _parse_mode(method):
+    mode = method.parse_mode
+    return mode.name if isinstance(mode, Default) else mode
+
+
+# chat_id бывает числом, строкой с числом или "@username" — последний карточке не принадлежит
+def _same_chat(card, chat_id):
+    return str(chat_id) == str(card.chat_id)
+
+
+# Правка карточки принимает только inline-клавиатуру или никакой
+def _editable(markup):
+    return markup is None or isinstance(markup, InlineKeyboardMarkup)
+
+
+# Склеенный текст группы; entities сдвигаются на длину предыдущих текстов в UTF-16
+def _join(group, separator="\n\n"):
+    text = separator.join(method.text for method in group)
+    if not any(method.entities for method in group):
+        return text, None
+    entities = []
+    offset = 0
+    for method in group:
+        for entity in method.entities or ():
+            entities.append(entity.model_copy(update={"offset": entity.offset + offset}))
+        offset += utf16_len(method.text) + utf16_len(separator)
+    return text, entities
+
+
+class InlineScreen(BaseRequestMiddleware):
+    # keyboards() возвращает текущий KeyboardRegistry
+    def __init__(self, keyboards, shown_cards=SHOWN_CARDS):
+        self.keyboards = keyboards
+        self.shown_cards = shown_cards
+        # (chat_id, message_id) → (text, parse_mode, entities, разметка) последней правки
+        self._shown = OrderedDict()
+        self.edited = 0
+        self.unchanged = 0
+        self.sent = 0
+        self.merged = 0
+
+    # Сообщения в чат карточки внутри блока копятся и после него уходят одной правкой карточки.
+    # Отправки из фоновых задач, переживших блок, идут обычными сообщениями
+    @asynccontextmanager
+    async def editing(self, message):
+        card = _Card(message.chat, message.message_id)
+        token = _card.set(card)
+        try:
+            yield
+        finally:
+            _card.reset(token)
+            card.closed = True
+            if card.pending:
+                await self._flush(card)
+
+    # Подряд идущие тексты с одинаковой разметкой склеиваются; клавиатура — от последнего.
+    # Первая группа заменяет карточку, остальные (другой parse_mode) — новые сообщения.
+    # Reply-клавиатуру правкой не показать: такая первая группа тоже уходит новым сообщением
+    async def _flush(self, card):
+        groups = []
+        for method, markup in card.pending:
+            if groups and _parse_mode(groups[-1][-1][0]) == _parse_mode(method):
+                groups[-1].append((method, markup))
+            else:
+                groups.append([(method, markup)])
+        self.merged += len(card.pending) - len(groups)
+
+        if _editable(groups[0][-1][1]):
+            await self._edit(card, groups.pop(0))
+        for group in groups:
+            methods = [method for method, _ in group]
+            text, entities = _join(methods)
+            await card.bot(methods[-1].model_copy(
+                update={"text": text, "entities": entities, "reply_markup": group[-1][1]}
+            ))
+
+    async def _edit(self, card, group):
+        last, markup = group[-1]
+        text, entities = _join([method for method, _ in group])
+        # Повторное нажатие той же кнопки: карточка уже такая, как нужно, запрос не нужен
+        key = (card.chat_id, card.message_id)
+        content = (text, _parse_mode(last), entities, markup)
+        if self._shown.get(key) == content:
+            self._shown.move_to_end(key)
+            self.unchanged += 1
+            return
+        edit = EditMessageText(
+            chat_id=last.chat_id,
+            message_id=card.message_id,
+            text=text,
+            parse_mode=last.parse_mode,
+            entities=entities,
+            reply_markup=markup
+        )
+        self.edited += 1
+        try:
+            await card.bot(edit)
+        except TelegramBadRequest as e:
+            # Карточку с тем же содержимым эта правка не застала в памяти (перезапуск, другой воркер)
+            if "message is not modified" not in e.message:
+                raise
+            logger.debug("Card %s in chat %s is up to date", card.message_id, card.chat_id)
+        self._shown[key] = content
+        self._shown.move_to_end(key)
+        if len(self._shown) > self.shown_cards:
+            self._shown.popitem(last=False)
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, SendMessage):
+            return await make_request(bot, method)
+
+        markup = self.keyboards().inline_for(method.reply_markup)
+        card = _card.get()
+        if card is not None and not card.closed and _same_chat(card, method.chat_id):
+            card.pending.append((method, markup))
+            card.bot = bot
+            # Сообщение ещё не отправлено; вызывающему — карточка, которую оно заменит
+            return Message(
+                message_id=card.message_id,
+                date=datetime.now(),
+                chat=card.chat,
+                text=method.text,
+                reply_markup=markup if isinstance(markup, InlineKeyboardMarkup) else None,
+            ).as_(bot)
+
+        self.sent += 1
+        if markup is not method.reply_markup:
+            method = method.model_copy(update={"reply_markup": markup})
+        return await make_request(bot, method)
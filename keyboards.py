@@ -0,0 +1,150 @@
+# Реестр клавиатур: каждая разметка собирается один раз при старте
+import zlib
+
+from aiogram import types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import FormData
+
+BACK_TEXT = "⬅ Назад"
+
+# Подписи inline-кнопок, которые отличаются от текста, уходящего в сценарий
+INLINE_TITLES = {"/start": "🔄 Новый заказ"}
+
+
+def _reply_markup(rows, back=True, one_time=True):
+    keyboard = [[types.KeyboardButton(text=text) for text in row] for row in rows]
+    if back:
+        keyboard.append([types.KeyboardButton(text=BACK_TEXT)])
+    return types.ReplyKeyboardMarkup(
+        keyboard=keyboard,
+        resize_keyboard=True,
+        one_time_keyboard=one_time or None
+    )
+
+
+TAG_LENGTH = 3
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(number):
+    digits = ""
+    while True:
+        number, digit = divmod(number, 36)
+        digits = _BASE36[digit] + digits
+        if not number:
+            return digits
+
+
+# Сетка кнопок по два в ряд
+def _grid(items, width=2):
+    return [items[i:i + width] for i in range(0, len(items), width)]
+
+
+# У каждой reply-клавиатуры есть inline-двойник для режима UI_MODE=inline.
+# callback_data — метка из трёх символов и номер текста кнопки в base36: "c4b1e" вместо текста.
+# Метка — хэш всех подписей, одинаковый во всех воркерах; после смены каталога
+# кнопки старых сообщений перестают распознаваться, а не ведут на другой сервер.
+class KeyboardRegistry:
+    def __init__(self, project_servers, action_labels, payment_labels, confirm_labels, amount_presets=()):
+        self.action = _reply_markup(_grid(list(action_labels)))
+        self.projects = _reply_markup([list(project_servers)])
+        self.servers = {
+            project: _reply_markup(_grid(servers))
+            for project, servers in project_servers.items()
+        }
+        self.amount = _reply_markup([], one_time=False)
+        self.payment = _reply_markup(_grid(list(payment_labels)))
+        self.confirm = _reply_markup([list(confirm_labels)])
+        self.restart = _reply_markup([["/start"]], back=False)
+        self.remove = types.ReplyKeyboardRemove()
+
+        reply = [self.action, self.projects, self.amount, self.payment,
+                 self.confirm, self.restart, *self.servers.values()]
+        # В inline-режиме сумму можно не вводить, а выбрать
+        inline_rows = {id(self.amount): _grid(list(amount_presets), width=3)}
+        self._texts = list(dict.fromkeys(
+            button.text for markup in reply for row in markup.keyboard for button in row
+        ))
+        self._texts.extend(text for text in amount_presets if text not in self._texts)
+        self._index = {text: i for i, text in enumerate(self._texts)}
+        self.tag = format(zlib.crc32("\n".join(self._texts).encode()) & 0xFFF, "03x")
+        self._inline = {
+            id(markup): self._inline_markup(inline_rows.get(id(markup), []) + [
+                [button.text for button in row] for row in markup.keyboard
+            ])
+            for markup in reply
+        }
+
+        prebuilt = [*reply, self.remove, *self._inline.values()]
+        self._prebuilt = {id(markup): markup for markup in prebuilt}
+
+    def _inline_markup(self, rows):
+        return types.InlineKeyboardMarkup(inline_keyboard=[
+            [
+                types.InlineKeyboardButton(
+                    text=INLINE_TITLES.get(text, text),
+                    callback_data=self.tag + _base36(self._index[text])
+                )
+                for text in row
+            ]
+            for row in rows
+        ])
+
+    def is_prebuilt(self, markup):
+        return self._prebuilt.get(id(markup)) is markup
+
+    # Inline-двойник готовой клавиатуры; ReplyKeyboardRemove в inline-режиме — просто без клавиатуры
+    def inline_for(self, markup):
+        if markup is None or isinstance(markup, types.ReplyKeyboardRemove):
+            return None
+        if self.is_prebuilt(markup):
+            return self._inline.get(id(markup), markup)
+        return markup
+
+    # Текст кнопки по callback_data или None для чужих и устаревших кнопок
+    def decode(self, data):
+        if not data or not data.startswith(self.tag):
+            return None
+        digits = data[TAG_LENGTH:]
+        if not digits or not digits.isascii() or not digits.isalnum():
+            return None
+        index = int(digits, 36)
+        return self._texts[index] if index < len(self._texts) else None
+
+
+# Сессия, которая сериализует каждую готовую клавиатуру в JSON только один раз
+class CachedMarkupSession(AiohttpSession):
+    def __init__(self, registry=None, **kwargs):
+        super().__init__(**kwargs)
+        self.registry = registry
+        self._markup_json = {}
+
+    # Смена реестра (например, после перезагрузки каталога) сбрасывает кэш:
+    # id старых разметок может достаться новым объектам
+    def use_registry(self, registry):
+        self.registry = registry
+        self._markup_json = {}
+
+    def serialized_markup(self, bot, markup):
+        cached = self._markup_json.get(id(markup))
+        if cached is None:
+            cached = self.prepare_value(markup, bot=bot, files={})
+            self._markup_json[id(markup)] = cached
+        return cached
+
+    def build_form_data(self, bot, method):
+        markup = getattr(method, "reply_markup", None)
+        if markup is None or self.registry is None or not self.registry.is_prebuilt(markup):
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", self.serialized_markup(bot, markup))
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -0,0 +1,256 @@
+# Журнал заказов в SQLite (WAL) с фоновой групповой записью
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("telegram_bot.ledger")
+
+ORDER_FIELDS = (
+    "id", "created_at", "user_id", "username", "action", "project", "server",
+    "amount_kk", "price_rub", "payment_type", "status"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    action TEXT NOT NULL,
+    project TEXT NOT NULL,
+    server TEXT NOT NULL,
+    amount_kk INTEGER NOT NULL,  -- дробные суммы (12.5) SQLite сохранит как REAL
+    price_rub INTEGER NOT NULL,
+    payment_type TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, created_at);
+CREATE INDEX IF NOT EXISTS orders_project_server ON orders (project, server, created_at);
+CREATE INDEX IF NOT EXISTS orders_created ON orders (created_at);
+"""
+
+
+# Уникальные и возрастающие номера заказов без обращения к базе:
+# миллисекунды с эпохи, сдвинутые на 10 бит, плюс номер воркера (0–1023).
+# Номер должен быть свой у каждого процесса, пишущего в журнал: pid для этого не годится,
+# в контейнерах он у всех 1
+class OrderIdGenerator:
+    def __init__(self, worker_id=None):
+        if worker_id is None:
+            worker_id = int(os.getenv("WORKER_ID", "0"))
+        if not 0 <= worker_id <= 0x3FF:
+            raise ValueError(f"worker_id must be in 0..1023, got {worker_id}")
+        self.worker_id = worker_id
+        self._last_ms = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            ms = max(int(time.time() * 1000), self._last_ms + 1)
+            self._last_ms = ms
+        return (ms << 10) | self.worker_id
+
+
+class OrderLedger:
+    def __init__(self, path="orders.sqlite3", batch_size=500, queue_size=10000, worker_id=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.ids = OrderIdGenerator(worker_id)
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger-writer")
+        self._reader_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger-reader")
+        self._write_conn = None
+        self._read_conn = None
+        self._writer = None
+        # Заказы в очереди и в текущей пачке по номеру: get() видит их до записи в базу
+        self._pending = {}
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.duplicates = 0
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self):
+        self._write_conn = self._open()
+        self._write_conn.executescript(SCHEMA)
+
+    async def start(self):
+        if self._writer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer_executor, self._init_schema)
+        self._writer = asyncio.create_task(self._write_loop())
+        logger.info("Order ledger opened at %s", self.path)
+
+    # Постановка заказа в очередь; ждать приходится только при переполнении очереди.
+    # Заказ с номером, который ещё ждёт записи, второй раз в очередь не ставится
+    async def add(self, order):
+        order = dict(order)
+        order.setdefault("id", self.ids.next_id())
+        order.setdefault("created_at", time.time())
+        order.setdefault("status", "pending_payment")
+        if order["id"] in self._pending:
+            self.duplicates += 1
+            logger.warning("Order %s is already queued for the ledger, skipping the duplicate", order["id"])
+            return order["id"]
+        self._pending[order["id"]] = order
+        try:
+            await self._queue.put(order)
+        except BaseException:
+            self._pending.pop(order["id"], None)
+            raise
+        return order["id"]
+
+    def _insert(self, rows):
+        self._write_conn.executemany(
+            f"INSERT INTO orders ({', '.join(ORDER_FIELDS)}) VALUES ({', '.join('?' for _ in ORDER_FIELDS)})",
+            rows
+        )
+
+    # Возвращает заказы, которые база не приняла из-за занятого номера: (повторы, чужие номера).
+    # Повтор — номер уже записан за тем же пользователем: подтверждение обработали второй раз
+    def _insert_batch(self, batch):
+        rows = [tuple(order.get(field) for field in ORDER_FIELDS) for order in batch]
+        conn = self._write_conn
+        conn.execute("BEGIN")
+        try:
+            self._insert(rows)
+            conn.execute("COMMIT")
+            return [], []
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Пачка откатилась целиком: пишем по одному, чтобы не потерять остальные заказы
+        duplicates = []
+        rejected = []
+        conn.execute("BEGIN")
+        try:
+            for order, row in zip(batch, rows):
+                try:
+                    self._insert([row])
+                except sqlite3.IntegrityError:
+                    owner = conn.execute("SELECT user_id FROM orders WHERE id = ?", (order["id"],)).fetchone()
+                    if owner is not None and owner[0] == order.get("user_id"):
+                        duplicates.append(order)
+                    else:
+                        rejected.append(order)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return duplicates, rejected
+
+    # Пока идёт одна запись, следующие заказы копятся и уходят одной транзакцией
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                duplicates, rejected = await loop.run_in_executor(self._writer_executor, self._insert_batch, batch)
+                self.written += len(batch) - len(duplicates) - len(rejected)
+                self.batches += 1
+                if duplicates:
+                    self.duplicates += len(duplicates)
+                    logger.warning(
+                        "Ledger skipped %s orders that are already recorded: %s",
+                        len(duplicates), [order["id"] for order in duplicates]
+                    )
+                if rejected:
+                    # Номер занят заказом другого пользователя — два процесса с одним WORKER_ID; заказ целиком в лог
+                    self.rejected += len(rejected)
+                    logger.error(
+                        "Ledger rejected %s orders whose ids belong to other orders, check WORKER_ID of the workers; "
+                        "orders: %s", len(rejected), rejected
+                    )
+            except Exception as e:
+                # Заказы не теряются молча: полностью попадают в лог
+                self.rejected += len(batch)
+                logger.error(
+                    "Failed to write %s orders to ledger: %s; orders: %s", len(batch), e, batch
+                )
+            finally:
+                for order in batch:
+                    self._pending.pop(order["id"], None)
+                    self._queue.task_done()
+
+    async def flush(self):
+        await self._queue.join()
+
+    async def close(self):
+        if self._writer is not None:
+            await self.flush()
+            self._writer.cancel()
+            self._writer = None
+        loop = asyncio.get_running_loop()
+        for executor, attr in ((self._writer_executor, "_write_conn"), (self._reader_executor, "_read_conn")):
+            conn = getattr(self, attr)
+            if conn is not None:
+                await loop.run_in_executor(executor, conn.close)
+                setattr(self, attr, None)
+
+    # Отчётные запросы идут через отдельное соединение и не мешают записи
+    async def _query(self, sql, params):
+        def run():
+            if self._read_conn is None:
+                self._read_conn = self._open()
+            return [dict(row) for row in self._read_conn.execute(sql, params)]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_executor, run)
+
+    # Заказ из очереди возвращается, ещё не дойдя до базы
+    async def get(self, order_id):
+        order = self._pending.get(order_id)
+        if order is not None:
+            return dict(order)
+        rows = await self._query("SELECT * FROM orders WHERE id = ?", (order_id,))
+        return rows[0] if rows else None
+
+    async def orders_by_user(self, user_id, limit=50):
+        return await self._query(
+            "SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, limit)
+        )
+
+    async def orders_by_server(self, project, server=None, since=0.0, until=None):
+        sql = "SELECT * FROM orders WHERE project = ?"
+        params = [project]
+        if server is not None:
+            sql += " AND server = ?"
+            params.append(server)
+        sql += " AND created_at >= ? AND created_at < ? ORDER BY created_at"
+        params += [since, until if until is not None else float("inf")]
+        return await self._query(sql, params)
+
+    async def orders_between(self, since, until):
+        return await self._query(
+            "SELECT * FROM orders WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+            (since, until)
+        )
+
+    # Сводка по проектам и серверам за период
+    async def totals_by_server(self, since, until):
+        return await self._query(
+            "SELECT project, server, action, COUNT(*) AS orders,"
+            " SUM(amount_kk) AS amount_kk, SUM(price_rub) AS price_rub"
+            " FROM orders WHERE created_at >= ? AND created_at < ?"
+            " GROUP BY project, server, action ORDER BY project, server, action",
+            (since, until)
+        )
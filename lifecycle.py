@@ -0,0 +1,448 @@
+# Жизненный цикл процесса: мягкая остановка по SIGTERM/SIGINT с дедлайном,
+# long polling с контрольной точкой offset и время запуска и остановки для метрик.
+#
+# getUpdates подтверждает всё, что меньше offset, ещё до того, как хендлеры отработали.
+# Поэтому обновления, которые не успели обработать, сохраняются в файл контрольной точки
+# и при следующем запуске обрабатываются первыми, а offset из файла продолжает с того же места.
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import signal
+import time
+
+from aiogram.exceptions import TelegramConflictError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import GetUpdates
+
+from startup import StartupProfile
+
+logger = logging.getLogger("telegram_bot.lifecycle")
+
+# Список, в который Lifecycle.follow складывает фоновые задачи текущего обновления
+_followups = contextvars.ContextVar("followups", default=None)
+
+
+# Собирает фоновые задачи, которые хендлеры начали внутри блока. Обработка обновления
+# их не ждёт: тот, кто его принял, решает, когда считать обновление готовым
+@contextlib.contextmanager
+def collect_followups():
+    followups = []
+    token = _followups.set(followups)
+    try:
+        yield followups
+    finally:
+        _followups.reset(token)
+
+
+# Экспоненциальная пауза со случайной половиной: после общего сбоя процессы
+# не возвращаются к API в одну и ту же секунду
+class Backoff:
+    def __init__(self, initial=1.0, maximum=30.0, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+        self._delay = initial
+
+    def next(self):
+        delay = self._delay / 2 + random.uniform(0, self._delay / 2)
+        self._delay = min(self._delay * self.factor, self.maximum)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self._delay = self.initial
+        self.attempts = 0
+
+
+# Файл контрольной точки: offset, с которого продолжать, и необработанные обновления.
+# Пишется целиком во временный файл и подменяется атомарно
+class OffsetCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self.saved = 0
+
+    def load(self, bot_id):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None, []
+        except (OSError, ValueError) as e:
+            logger.error("Checkpoint %s is unreadable, starting from Telegram's offset: %s", self.path, e)
+            return None, []
+        # Файл от другого бота: его offset к этому боту не относится
+        if data.get("bot_id") != bot_id:
+            logger.warning("Checkpoint %s belongs to bot %s, ignoring it", self.path, data.get("bot_id"))
+            return None, []
+        return data.get("offset"), data.get("pending", [])
+
+    def save(self, bot_id, offset, pending):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write('{"bot_id":%d,"offset":%s,"pending":[%s]}' % (
+                bot_id, "null" if offset is None else offset, ",".join(pending)
+            ))
+        os.replace(tmp, self.path)
+        self.saved += 1
+
+
+# Outer middleware dp.update: помнит задачи, в которых сейчас обрабатываются обновления,
+# чтобы при остановке дождаться их. Регистрируется первым после встроенных middleware.
+# Время запуска считается от старта процесса по профилю запуска
+class Lifecycle:
+    def __init__(self, drain_timeout=25.0, profile=None):
+        self.drain_timeout = drain_timeout
+        self.profile = profile if profile is not None else StartupProfile()
+        self.startup_seconds = None
+        self.first_update_seconds = None
+        self.drain_seconds = None
+        self.shutdown_seconds = None
+        self.abandoned = 0
+        self._stop = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._stop_requested_at = None
+        self._tasks = set()
+        self._follow = set()
+
+    @property
+    def stopping(self):
+        return self._stop.is_set()
+
+    @property
+    def inflight(self):
+        return len(self._tasks)
+
+    def install_signals(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.request_stop, sig)
+
+    def request_stop(self, sig=None):
+        if self._stop.is_set():
+            return
+        if sig is not None:
+            logger.warning("Received %s, draining in-flight updates (deadline %.0f s)",
+                           sig.name, self.drain_timeout)
+        self._stop_requested_at = time.monotonic()
+        self._stop.set()
+
+    async def wait_stop(self):
+        await self._stop.wait()
+
+    # Пауза, которую прерывает остановка; True — остановку запросили
+    async def sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._stop.wait(), delay)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # Процесс готов принимать обновления: первый getUpdates ушёл или вебхук слушает порт
+    def ready(self):
+        if self._ready.is_set():
+            return
+        self.profile.mark("ready")
+        self.startup_seconds = self.profile.elapsed()
+        self._ready.set()
+        logger.info("Started in %.2f s", self.startup_seconds)
+        self.profile.report()
+
+    # Для того, что не должно задерживать приём первого обновления
+    async def wait_ready(self):
+        await self._ready.wait()
+
+    async def __call__(self, handler, event, data):
+        if self.first_update_seconds is None:
+            self.first_update_seconds = self.profile.elapsed()
+            logger.info("First update %s after %.2f s", event.update_id, self.first_update_seconds)
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.discard(task)
+
+    # Фоновая задача, начатая хендлером (меню после приветствия /start). Хендлер её не ждёт,
+    # но остановка ждёт, а polling держит обновление в контрольной точке, пока она не закончится
+    def follow(self, task):
+        self._follow.add(task)
+        task.add_done_callback(self._follow.discard)
+        followups = _followups.get()
+        if followups is not None:
+            followups.append(task)
+        return task
+
+    # Сколько осталось до дедлайна остановки
+    def remaining(self):
+        if self._stop_requested_at is None:
+            return self.drain_timeout
+        return max(0.0, self._stop_requested_at + self.drain_timeout - time.monotonic())
+
+    # Ждёт отслеживаемые задачи и tasks до дедлайна; оставшиеся отменяются. Возвращает их
+    async def drain(self, tasks=()):
+        started = time.monotonic()
+        pending = self._tasks | self._follow | set(tasks)
+        if pending:
+            logger.info("Waiting for %s in-flight updates", len(pending))
+        # Обновления, которые ещё обрабатываются, могут начать новые фоновые задачи
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=self.remaining())
+            if pending:
+                break
+            pending = {task for task in self._follow if not task.done()}
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+            self.abandoned += len(pending)
+            logger.warning("%s updates did not finish before the deadline", len(pending))
+        self.drain_seconds = time.monotonic() - started
+        logger.info("Drained in %.2f s", self.drain_seconds)
+        return pending
+
+    def stopped(self):
+        started = self._stop_requested_at or time.monotonic()
+        self.shutdown_seconds = time.monotonic() - started
+        logger.info("Stopped in %.2f s", self.shutdown_seconds)
+
+    def stats(self):
+        return {
+            "startup_seconds": self.startup_seconds,
+            "first_update_seconds": self.first_update_seconds,
+            "drain_seconds": self.drain_seconds,
+            "shutdown_seconds": self.shutdown_seconds,
+            "inflight": self.inflight,
+            "abandoned": self.abandoned,
+        }
+
+
+# Long polling вместо dp.start_polling: обновления обрабатываются задачами, как в aiogram,
+# но остановка ждёт их, а необработанное переживает перезапуск через контрольную точку
+class UpdatePoller:
+    # cleanup — корутинная функция (удаление вебхука), которая идёт параллельно с первым getUpdates
+    def __init__(self, dp, bot, lifecycle, checkpoint=None, allowed_updates=None,
+                 timeout=30, limit=100, max_inflight=1000, cleanup=None):
+        self.dp = dp
+        self.bot = bot
+        self.lifecycle = lifecycle
+        self.checkpoint = checkpoint
+        self.cleanup = cleanup
+        self.allowed_updates = allowed_updates
+        self.timeout = timeout
+        self.limit = limit
+        self.max_inflight = max_inflight
+        self.backoff = Backoff()
+        # update_id → (задача, Update или сырой dict из контрольной точки)
+        self._pending = {}
+        # update_id → (фоновые задачи, Update): хендлер закончил, но начатое им ещё идёт.
+        # Место под новые обновления они не занимают, а из контрольной точки не выпадают
+        self._following = {}
+        self._room = asyncio.Event()
+        self._room.set()
+        self._offset = None
+        self._saved_offset = None
+        self._cleanup = None
+        self._background = []
+        self.received = 0
+        self.replayed = 0
+
+    def _submit(self, update_id, feed, update):
+        task = asyncio.create_task(self._process(update_id, feed))
+        self._pending[update_id] = (task, update)
+        task.add_done_callback(lambda task: self._finished(update_id, task))
+        if len(self._pending) >= self.max_inflight:
+            self._room.clear()
+
+    def _finished(self, update_id, task):
+        _, update = self._pending.pop(update_id, (None, None))
+        followups = [] if task.cancelled() else [f for f in task.result() if not f.done()]
+        if followups and update is not None:
+            self._following[update_id] = (followups, update)
+            waiter = asyncio.ensure_future(asyncio.wait(followups))
+            waiter.add_done_callback(lambda _: self._followed(update_id))
+        if len(self._pending) < self.max_inflight:
+            self._room.set()
+
+    # При остановке запись остаётся до конца drain: по ней видно, что отменено по дедлайну
+    def _followed(self, update_id):
+        if not self.lifecycle.stopping:
+            self._following.pop(update_id, None)
+
+    async def _process(self, update_id, feed):
+        with collect_followups() as followups:
+            try:
+                await feed
+            except Exception as e:
+                logger.exception("Failed to process update %s: %s", update_id, e)
+        return followups
+
+    def _feed(self, update):
+        self._submit(update.update_id, self.dp.feed_update(self.bot, update, **self._data), update)
+
+    # JSON считается только для того, что ещё не обработано к моменту записи
+    @staticmethod
+    def _raw(update):
+        if isinstance(update, dict):
+            return json.dumps(update, ensure_ascii=False, separators=(",", ":"))
+        return update.model_dump_json(by_alias=True, exclude_unset=True)
+
+    async def _save(self, pending):
+        if self.checkpoint is None:
+            return
+        raws = [self._raw(update) for _, update in pending]
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.checkpoint.save, self.bot.id, self._offset, raws)
+        except OSError as e:
+            logger.error("Failed to write checkpoint %s: %s", self.checkpoint.path, e)
+            return
+        self._saved_offset = self._offset
+
+    # Необработанное прошлым процессом уходит первым, по порядку
+    async def _replay(self):
+        offset, pending = self.checkpoint.load(self.bot.id)
+        self._offset = self._saved_offset = offset
+        for update in pending:
+            self._submit(update["update_id"], self.dp.feed_raw_update(self.bot, update, **self._data), update)
+        self.replayed += len(pending)
+        if pending:
+            logger.info("Replaying %s updates from checkpoint %s", len(pending), self.checkpoint.path)
+
+    async def _fetch(self):
+        method = GetUpdates(offset=self._offset, timeout=self.timeout, limit=self.limit,
+                            allowed_updates=self.allowed_updates)
+        fetch = asyncio.ensure_future(self.bot(method, request_timeout=self.timeout + 10))
+        self.lifecycle.ready()
+        await self._until_stop(fetch)
+        if not fetch.done():
+            # Ответ, который мог уже уйти от Telegram, не подтверждён: придёт при следующем запуске
+            fetch.cancel()
+            return None
+        return fetch.result()
+
+    # Ждёт future или остановку, что наступит раньше
+    async def _until_stop(self, future):
+        stop = asyncio.ensure_future(self.lifecycle.wait_stop())
+        await asyncio.wait((future, stop), return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+
+    async def _fetch_failed(self, e):
+        delay = self.backoff.next()
+        logger.error("Failed to fetch updates (attempt %s), retrying in %.1f s: %s",
+                     self.backoff.attempts, delay, e)
+        if isinstance(e, TelegramNetworkError):
+            await self._reset_connection()
+        await self.lifecycle.sleep(delay)
+
+    # Повтор getUpdates после сетевой ошибки идёт по новому соединению. У PooledSession
+    # сбрасывается только пул polling'а, у обычной сессии aiogram — вся сессия
+    async def _reset_connection(self):
+        session = self.bot.session
+        reset = getattr(session, "reset_poll_pool", None) or session.close
+        try:
+            await reset()
+        except Exception as e:
+            logger.warning("Failed to reset polling connection: %s", e)
+
+    # getMe нужен только для лога: id бота уже есть в токене, поэтому приём обновлений его не ждёт
+    async def _identify(self):
+        backoff = Backoff()
+        while True:
+            try:
+                user = await self.bot.me()
+            except Exception as e:
+                delay = backoff.next()
+                logger.error("getMe failed (attempt %s), retrying in %.1f s: %s", backoff.attempts, delay, e)
+                if await self.lifecycle.sleep(delay):
+                    return
+                continue
+            logger.info("Run polling for bot @%s id=%s", user.username, self.bot.id)
+            return
+
+    async def run(self):
+        self._data = {"dispatcher": self.dp, "bots": (self.bot,), **self.dp.workflow_data}
+        profile = self.lifecycle.profile
+        await self.dp.emit_startup(bot=self.bot, **self._data)
+        profile.mark("startup handlers")
+        if self.checkpoint is not None:
+            await self._replay()
+            profile.mark("checkpoint")
+        self._background.append(asyncio.create_task(self._identify()))
+        if self.cleanup is not None:
+            self._cleanup = asyncio.create_task(self.cleanup())
+            self._background.append(self._cleanup)
+        try:
+            while not self.lifecycle.stopping:
+                # Хендлеры не успевают — не забираем новые обновления, пусть копятся у Telegram
+                if not self._room.is_set():
+                    room = asyncio.ensure_future(self._room.wait())
+                    await self._until_stop(room)
+                    room.cancel()
+                    continue
+                # Offset подтверждает всё полученное раньше; сначала запоминаем, что из этого не готово
+                if self._offset != self._saved_offset:
+                    await self._save([*self._following.values(), *self._pending.values()])
+                try:
+                    updates = await self._fetch()
+                except TelegramRetryAfter as e:
+                    logger.warning("getUpdates flood control, retrying in %s s", e.retry_after)
+                    await self.lifecycle.sleep(e.retry_after)
+                    continue
+                except TelegramConflictError as e:
+                    # Вебхук ещё не удалён: повторяем сразу, как только удаление закончится
+                    if self._cleanup is not None and not self._cleanup.done():
+                        logger.info("Webhook is still set, waiting for it to be deleted")
+                        await self._until_stop(self._cleanup)
+                        continue
+                    await self._fetch_failed(e)
+                    continue
+                except Exception as e:
+                    await self._fetch_failed(e)
+                    continue
+                if updates is None:
+                    break
+                if self.backoff.attempts:
+                    logger.info("Connection restored after %s attempts", self.backoff.attempts)
+                    self.backoff.reset()
+                for update in updates:
+                    self._feed(update)
+                    self._offset = update.update_id + 1
+                self.received += len(updates)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        self.lifecycle.request_stop()
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        # Отменённые задачи убирают себя из _pending, поэтому список снимается до ожидания
+        entries = list(self._pending.values())
+        unfinished = await self.lifecycle.drain([task for task, _ in entries])
+        left = [entry for entry in self._following.values() if not unfinished.isdisjoint(entry[0])]
+        left += [entry for entry in entries if entry[0] in unfinished]
+        await self._save(left)
+        if left and self.checkpoint is None:
+            logger.error("%s unfinished updates are lost: POLL_CHECKPOINT is not set", len(left))
+        # Полученное подтверждается и у Telegram, чтобы без файла не получить его повторно
+        if self._offset is not None:
+            try:
+                await self.bot(GetUpdates(offset=self._offset, timeout=0, limit=1))
+            except Exception as e:
+                logger.error("Failed to confirm offset %s: %s", self._offset, e)
+        await self.dp.emit_shutdown(bot=self.bot, **self._data)
+        logger.info("Polling stopped: %s updates received, %s replayed, %s left for the next start",
+                    self.received, self.replayed, len(left))
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "replayed": self.replayed,
+            "pending": len(self._pending),
+            "offset": self._offset,
+            "checkpoints": self.checkpoint.saved if self.checkpoint is not None else 0,
+        }
@@ -0,0 +1,92 @@
+# Логирование без записи на диск из потока event loop: записи уходят в очередь,
+# форматирует и пишет их отдельный поток QueueListener
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Атрибуты, которые есть у любой LogRecord; всё остальное пришло через extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+# Одна запись — одна JSON-строка: ts, level, logger, msg и поля из extra=
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Кладёт запись в очередь как есть: подстановка аргументов и форматирование
+# выполняются уже в потоке слушателя. Поэтому аргументы логгера не должны
+# меняться после вызова — передаём значения, а не объекты, которые потом правятся
+class LazyQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._last_warning = 0.0
+
+    def prepare(self, record):
+        return record
+
+    # Очередь ограничена: если диск не успевает, теряем записи, а не память и не задержку
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            now = time.monotonic()
+            if now - self._last_warning > 10:
+                self._last_warning = now
+                sys.stderr.write(f"Log queue is full, {self.dropped} records dropped so far\n")
+
+
+# LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_FORMAT=text|json, LOG_LEVEL, LOG_QUEUE_SIZE
+def setup_logging():
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    path = os.getenv("LOG_FILE", "bot.log")
+    max_bytes = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    if os.getenv("LOG_FORMAT", "text") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = LazyQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем всё, что осталось в очереди
+    atexit.register(listener.stop)
+    return listener
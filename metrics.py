@@ -0,0 +1,266 @@
+# Метрики в текстовом формате Prometheus и HTTP-эндпоинт /metrics.
+# Всё обновляется из одного потока event loop, поэтому блокировки не нужны:
+# счётчик — это ключ в словаре, гистограмма — список корзин.
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from functools import partial
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage
+
+logger = logging.getLogger("telegram_bot.metrics")
+
+# Границы корзин в секундах: от долей миллисекунды до сетевых таймаутов
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [счётчики корзин..., +Inf], сумма
+        self.values = {}
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, *labels):
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labels, labels, f'le="{_number(bound)}"'), cumulative
+            yield self.name + "_sum", _labels(self.labels, labels), total
+            yield self.name + "_count", _labels(self.labels, labels), cumulative
+
+
+# Значение снимается только при запросе /metrics; функция может быть корутиной
+class Gauge:
+    kind = "gauge"
+
+    # С метками collect возвращает словарь {(значения меток): значение}
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = tuple(labels)
+        self.value = None
+
+    async def refresh(self):
+        value = self.collect()
+        if inspect.isawaitable(value):
+            value = await value
+        self.value = value
+
+    def samples(self):
+        if self.value is None:
+            return
+        if not self.labels:
+            yield self.name, "", self.value
+            return
+        for labels, value in self.value.items():
+            yield self.name, _labels(self.labels, labels), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self._add(Gauge(name, help, collect, labels))
+
+    async def render(self):
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                try:
+                    await metric.refresh()
+                except Exception as e:
+                    logger.warning("Failed to collect %s: %s", metric.name, e)
+                    metric.value = None
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HANDLER_LATENCY = registry.histogram(
+    "bot_handler_seconds", "Время работы хендлера сообщений", ("handler", "state")
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах сообщений", ("handler", "error")
+)
+API_LATENCY = registry.histogram(
+    "bot_api_request_seconds", "Время запроса к Bot API", ("method",)
+)
+API_ERRORS = registry.counter(
+    "bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error")
+)
+STORAGE_LATENCY = registry.histogram(
+    "bot_fsm_storage_seconds", "Время операции с хранилищем FSM", ("op",)
+)
+FUNNEL = registry.counter(
+    "bot_order_funnel_total",
+    "Переходы по шагам заказа (action → … → confirm) и исходы confirmed/cancelled",
+    ("stage",)
+)
+
+
+# Внутренний middleware роутера: время хендлера по состоянию FSM, ошибки и воронка заказа.
+# Ставится после StateTransactionMiddleware, тогда новое состояние читается без обращения к хранилищу.
+# order — состояния сценария по порядку: шаг воронки считается только при переходе вперёд,
+# возврат кнопкой «Назад» на пройденный шаг его второй раз не засчитывает
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, order=()):
+        self.order = {state: index for index, state in enumerate(order)}
+
+    async def __call__(self, handler, event, data):
+        state_before = data.get("raw_state")
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        label = state_before.rsplit(":", 1)[-1] if state_before else "none"
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name, label)
+
+        context = data.get("state")
+        if context is not None:
+            state_after = await context.get_state()
+            if state_after is not None and self.order.get(state_after, -1) > self.order.get(state_before, -1):
+                FUNNEL.inc(state_after.rsplit(":", 1)[-1])
+        return result
+
+
+# Middleware сессии: время и ошибки каждого метода Bot API
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, name)
+
+
+# Обёртка хранилища FSM, замеряющая каждую операцию
+class TimedStorage(BaseStorage):
+    def __init__(self, inner):
+        self.inner = inner
+        if hasattr(inner, "set_state_and_data"):
+            self.set_state_and_data = partial(self._timed, "set_state_and_data", inner.set_state_and_data)
+
+    @staticmethod
+    async def _timed(op, func, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(**kwargs)
+        finally:
+            STORAGE_LATENCY.observe(time.perf_counter() - started, op)
+
+    async def set_state(self, key, state=None):
+        return await self._timed("set_state", self.inner.set_state, key=key, state=state)
+
+    async def get_state(self, key):
+        return await self._timed("get_state", self.inner.get_state, key=key)
+
+    async def set_data(self, key, data):
+        return await self._timed("set_data", self.inner.set_data, key=key, data=data)
+
+    async def get_data(self, key):
+        return await self._timed("get_data", self.inner.get_data, key=key)
+
+    async def update_data(self, key, data):
+        return await self._timed("update_data", self.inner.update_data, key=key, data=data)
+
+    async def close(self):
+        await self.inner.close()
+
+
+# Отдельный локальный HTTP-сервер, чтобы /metrics не торчал наружу вместе с вебхуком
+async def start_metrics_server(host, port, metrics=registry):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=await metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,310 @@
+# Очередь уведомлений админу: хранится в SQLite, отправляется фоновым воркером
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+
+from sender import PRIORITY_ADMIN, send_priority
+from templates import utf16_len
+
+logger = logging.getLogger("telegram_bot.notify")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+# Лимит Telegram в единицах UTF-16: эмодзи вне BMP считается за два
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+# Неделимые куски строки, которая сама длиннее лимита: тег и сущность HTML,
+# экранированный символ MarkdownV2
+_HTML_ATOM = re.compile(r"<[^<>]*>|&#?\w+;|.", re.DOTALL)
+_MARKDOWN_ATOM = re.compile(r"\\.|.", re.DOTALL)
+_HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*>")
+
+
+# Текст уведомления частями не длиннее limit. Режем по строкам, а строку длиннее лимита —
+# между тегами, сущностями и экранированными символами. Теги HTML, открытые на границе,
+# закрываются в конце части и открываются заново в начале следующей. Длина с разметкой
+# не меньше видимой, поэтому часть проходит и повторной отправкой без parse_mode
+def split_message(text, parse_mode, limit=MAX_MESSAGE_LENGTH):
+    if utf16_len(text) <= limit:
+        return [text]
+    html = (parse_mode or "").lower() == "html"
+    atom = _HTML_ATOM if html else _MARKDOWN_ATOM
+    pieces = []
+    # Открытые теги HTML: (имя, тег целиком)
+    opened = ()
+    piece, size, reopened = [], 0, 0
+
+    def add(chunk):
+        nonlocal opened, size
+        after = _open_tags(opened, chunk) if html else opened
+        length = utf16_len(chunk)
+        if size + length + _closing_len(after) > limit:
+            return False
+        piece.append(chunk)
+        size += length
+        opened = after
+        return True
+
+    def flush():
+        nonlocal piece, size, reopened
+        piece.extend(f"</{name}>" for name, _ in reversed(opened))
+        pieces.append("".join(piece))
+        piece = [tag for _, tag in opened]
+        size = reopened = sum(utf16_len(tag) for tag in piece)
+
+    for line in text.splitlines(keepends=True):
+        if add(line):
+            continue
+        if size > reopened:
+            flush()
+            if add(line):
+                continue
+        for match in atom.finditer(line):
+            chunk = match.group()
+            if add(chunk):
+                continue
+            if size > reopened:
+                flush()
+            # Кусок не влезает и в пустую часть (тег длиннее лимита) — идёт как есть
+            if not add(chunk):
+                piece.append(chunk)
+                size += utf16_len(chunk)
+    if size > reopened:
+        piece.extend(f"</{name}>" for name, _ in reversed(opened))
+        pieces.append("".join(piece))
+    return pieces
+
+
+# Открытые теги после куска chunk; закрывающий тег снимает последний открытый с тем же именем
+def _open_tags(opened, chunk):
+    if "<" not in chunk:
+        return opened
+    opened = list(opened)
+    for match in _HTML_TAG.finditer(chunk):
+        slash, name = match.groups()
+        name = name.lower()
+        if not slash:
+            opened.append((name, match.group()))
+        elif opened and opened[-1][0] == name:
+            opened.pop()
+    return tuple(opened)
+
+
+def _closing_len(opened):
+    return sum(len(name) + 3 for name, _ in opened)
+
+
+class AdminNotifier:
+    # Telegram: около 1 сообщения в секунду в личный чат и 20 в минуту в группу
+    PRIVATE_INTERVAL = 1.0
+    GROUP_INTERVAL = 3.0
+
+    def __init__(self, bot, path="orders.sqlite3", digest_window=1.0,
+                 initial_backoff=1.0, max_backoff=60.0, batch_limit=50, poll_interval=None):
+        self.bot = bot
+        self.path = path
+        self.digest_window = digest_window
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.batch_limit = batch_limit
+        # Если в очередь пишут другие процессы, их записи замечаются только опросом базы
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify-db")
+        self._conn = None
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._last_sent = {}
+        self.sent_messages = 0
+        self.sent_notifications = 0
+        self.dropped = 0
+
+    async def _db(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        return self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    # deliver=False — только ставить в очередь; отправляет один процесс, иначе уведомления задвоятся
+    async def start(self, deliver=True):
+        if self._worker is not None or self._conn is not None:
+            return
+        pending = await self._db(self._open)
+        if not deliver:
+            return
+        if pending:
+            logger.info("Resuming %s pending admin notifications", pending)
+            self._wakeup.set()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Неотправленное остаётся в базе и уйдёт после перезапуска
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._conn is not None:
+            await self._db(self._conn.close)
+            self._conn = None
+
+    def _insert(self, chat_id, text, parse_mode):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO notifications (chat_id, text, parse_mode, created_at) VALUES (?, ?, ?, ?)",
+                (str(chat_id), text, parse_mode, time.time())
+            )
+
+    async def enqueue(self, chat_id, text, parse_mode="Markdown"):
+        await self._db(self._insert, chat_id, text, parse_mode)
+        self._wakeup.set()
+
+    def _fetch(self):
+        return self._conn.execute(
+            "SELECT id, chat_id, text, parse_mode FROM notifications ORDER BY id LIMIT ?",
+            (self.batch_limit,)
+        ).fetchall()
+
+    def _delete(self, ids):
+        with self._conn:
+            self._conn.executemany("DELETE FROM notifications WHERE id = ?", [(i,) for i in ids])
+
+    async def pending(self):
+        return await self._db(lambda: self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0])
+
+    async def _run(self):
+        backoff = self.initial_backoff
+        while True:
+            if self.poll_interval:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._wakeup.wait()
+            # Даём всплеску заказов накопиться, чтобы отправить его одной сводкой
+            await asyncio.sleep(self.digest_window)
+            self._wakeup.clear()
+            try:
+                drained = await self._drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Admin notification worker failed: %s", e)
+                drained = False
+            if drained:
+                backoff = self.initial_backoff
+                continue
+            # Неотправленное осталось в базе: повторяем с растущей паузой
+            self._wakeup.set()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    # False — очередь остановилась на временной ошибке, уведомления ждут повтора
+    async def _drain(self):
+        while True:
+            rows = await self._db(self._fetch)
+            if not rows:
+                return True
+            chat_id, parse_mode = rows[0][1], rows[0][3]
+            group = [row for row in rows if row[1] == chat_id and row[3] == parse_mode]
+            for ids, text in self._digests(group):
+                delivered = await self._send(chat_id, text, parse_mode)
+                if delivered is None:
+                    return False
+                await self._db(self._delete, ids)
+                if delivered:
+                    self.sent_messages += 1
+                    self.sent_notifications += len(ids)
+                else:
+                    self.dropped += len(ids)
+
+    # Склеиваем уведомления в сообщения не длиннее лимита Telegram. Длинное уведомление
+    # уходит несколькими сообщениями; из базы оно удаляется вместе с последним из них
+    @staticmethod
+    def _digests(rows):
+        chunks = []
+        ids, parts, size = [], [], 0
+        separator = utf16_len(DIGEST_SEPARATOR)
+        for row_id, _, text, parse_mode in rows:
+            pieces = split_message(text, parse_mode)
+            for i, part in enumerate(pieces):
+                extra = utf16_len(part) + (separator if parts else 0)
+                if parts and size + extra > MAX_MESSAGE_LENGTH:
+                    chunks.append((ids, DIGEST_SEPARATOR.join(parts)))
+                    ids, parts, size = [], [], 0
+                    extra = utf16_len(part)
+                if i == len(pieces) - 1:
+                    ids.append(row_id)
+                parts.append(part)
+                size += extra
+        if parts:
+            chunks.append((ids, DIGEST_SEPARATOR.join(parts)))
+        return chunks
+
+    async def _pace(self, chat_id):
+        interval = self.GROUP_INTERVAL if chat_id.startswith("-") else self.PRIVATE_INTERVAL
+        wait = self._last_sent.get(chat_id, 0.0) + interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # True — отправлено; False — отправить невозможно в принципе, уведомление удаляется;
+    # None — временная ошибка, уведомление остаётся в очереди до следующей попытки
+    async def _send(self, chat_id, text, parse_mode):
+        while True:
+            await self._pace(chat_id)
+            try:
+                # Сводки админу пропускают ответы пользователям вперёд
+                with send_priority(PRIORITY_ADMIN):
+                    await self.bot.send_message(
+                        chat_id=chat_id,
+                        text=text,
+                        parse_mode=parse_mode,
+                        disable_web_page_preview=True
+                    )
+                self._last_sent[chat_id] = time.monotonic()
+                return True
+            except TelegramBadRequest as e:
+                if parse_mode is None:
+                    logger.error("Dropping admin notification: %s; text: %s", e, text)
+                    return False
+                # Сломанная разметка не должна терять уведомление — шлём обычным текстом
+                logger.warning("Admin notification rejected (%s), resending without parse_mode", e)
+                parse_mode = None
+            except (TelegramForbiddenError, TelegramNotFound) as e:
+                # Бот удалён из чата админа или чата нет: повтор не поможет
+                logger.error("Dropping admin notification: %s; text: %s", e, text)
+                return False
+            except TelegramRetryAfter as e:
+                # Паузы флуд-контроля выдерживает SendScheduler; сюда ошибка доходит, когда его
+                # попытки кончились, и второй раз ту же паузу не ждём
+                logger.warning("Admin notifications throttled, will retry later: %s", e)
+                return None
+            except Exception as e:
+                logger.warning("Failed to send admin notification, will retry later: %s", e)
+                return None
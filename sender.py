@@ -0,0 +1,178 @@
+# Общий планировщик исходящих запросов: лимиты Telegram на весь бот и на каждый чат
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger("telegram_bot.sender")
+
+# Приоритеты: меньше — важнее
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 10
+
+_priority = contextvars.ContextVar("send_priority", default=PRIORITY_USER)
+
+
+# Приоритет всех отправок внутри блока: with send_priority(PRIORITY_ADMIN): ...
+@contextmanager
+def send_priority(priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# Ведро токенов: rate токенов в секунду, не больше capacity подряд
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Забирает токен и возвращает, сколько секунд надо подождать до его появления
+    def reserve(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    # Забирает токен, только если он уже есть; без ожидания и без долга
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate=30.0, global_burst=30, private_rate=1.0, private_burst=4,
+                 group_rate=20 / 60, group_burst=3, max_retries=3):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._gate = None
+        self._paused_until = 0.0
+        self._last_cleanup = time.monotonic()
+
+        # Счётчики для мониторинга
+        self.sent = 0
+        self.retry_after = 0
+        self.wait_seconds = 0.0
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "wait_seconds_total": round(self.wait_seconds, 3),
+            "avg_wait_ms": round(self.wait_seconds / self.sent * 1000, 3) if self.sent else 0.0,
+            "tracked_chats": len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    # Ведра чатов, которые давно молчат, снова полные — их можно забыть
+    def _cleanup(self, now):
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    # Глобальный шлюз: выпускает ожидающих по приоритету с общей скоростью
+    async def _run_gate(self):
+        while self._waiters:
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            wait = self._global.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+        self._gate = None
+
+    async def _global_slot(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        if self._gate is None:
+            self._gate = asyncio.create_task(self._run_gate())
+        await future
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, getMe, setWebhook и т.п. лимитами на отправку не ограничены
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            self._cleanup(started)
+            chat_wait = self._chat_bucket(chat_id).reserve(started)
+            if chat_wait:
+                await asyncio.sleep(chat_wait)
+            await self._global_slot(priority)
+            self.wait_seconds += time.monotonic() - started
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                attempt += 1
+                # Флуд-контроль касается всего бота: притормаживаем все отправки
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    "Flood control on %s in chat %s, retrying in %s s",
+                    method.__api_method__, chat_id, e.retry_after
+                )
+                continue
+            self.sent += 1
+            return response
@@ -0,0 +1,69 @@
+# Отложенные цепочки сообщений: хендлер возвращается сразу, продолжение уходит по таймеру
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("telegram_bot.sequence")
+
+
+# Хранит не больше одной цепочки на чат. Как middleware отменяет цепочку,
+# когда пользователь присылает новое сообщение, — продолжение уже неактуально.
+# sleep — корутинная функция паузы; Lifecycle.sleep прерывает паузы при остановке,
+# и хвост цепочки уходит сразу, а не после дедлайна
+class MessageSequencer(BaseMiddleware):
+    def __init__(self, sleep=asyncio.sleep):
+        self.sleep = sleep
+        self._pending = {}
+        self.started = 0
+        self.cancelled = 0
+
+    @property
+    def active(self):
+        return len(self._pending)
+
+    # steps — список пар (задержка в секундах, функция без аргументов, возвращающая корутину)
+    def start(self, chat_id, steps):
+        self.cancel(chat_id)
+        task = asyncio.create_task(self._run(chat_id, steps))
+        self._pending[chat_id] = task
+        self.started += 1
+        return task
+
+    def cancel(self, chat_id):
+        task = self._pending.pop(chat_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    async def _run(self, chat_id, steps):
+        try:
+            for delay, send in steps:
+                if delay:
+                    await self.sleep(delay)
+                await send()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Message sequence for chat %s failed: %s", chat_id, e)
+        finally:
+            if self._pending.get(chat_id) is asyncio.current_task():
+                del self._pending[chat_id]
+
+    # Даёт начатым цепочкам дойти до конца, но не дольше timeout секунд
+    async def join(self, timeout):
+        tasks = list(self._pending.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def close(self):
+        tasks = list(self._pending.values())
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __call__(self, handler, event, data):
+        if self._pending and event.chat is not None:
+            self.cancel(event.chat.id)
+        return await handler(event, data)
@@ -0,0 +1,102 @@
+# Профиль запуска: сколько времени от старта процесса ушло на импорты, инициализацию
+# и каждую фазу до приёма первого обновления.
+#
+# Импортируется в bot.py первым: с STARTUP_PROFILE=1 сразу начинает считать время импорта
+# по пакетам верхнего уровня (своё время модуля без вложенных импортов), и к отчёту
+# о запуске добавляется строка с самыми дорогими пакетами. Переменная берётся
+# из окружения процесса: .env читается уже после импортов.
+import builtins
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("telegram_bot.startup")
+
+PROFILE_IMPORTS = os.getenv("STARTUP_PROFILE", "") not in ("", "0")
+
+
+# Момент запуска процесса по часам time.monotonic(); время до импорта этого модуля
+# (старт интерпретатора, site) тоже считается. Без /proc — момент импорта модуля
+def process_started_at():
+    now = time.monotonic()
+    try:
+        with open("/proc/self/stat") as f:
+            # Имя процесса в скобках может содержать пробелы; starttime — 22-е поле
+            fields = f.read().rpartition(")")[2].split()
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return now
+    return now - max(0.0, age)
+
+
+class StartupProfile:
+    def __init__(self, profile_imports=False):
+        self.started_at = process_started_at()
+        # (фаза, секунды от старта процесса до её конца)
+        self.phases = []
+        self.mark("interpreter")
+        self.imports = {}
+        self._import = None
+        self._stack = []
+        self._thread = threading.get_ident()
+        if profile_imports:
+            self.trace_imports()
+
+    def trace_imports(self):
+        if self._import is not None:
+            return
+        self._import = builtins.__import__
+        builtins.__import__ = self._traced_import
+
+    def stop_imports(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _traced_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if threading.get_ident() != self._thread:
+            return self._import(name, globals, locals, fromlist, level)
+        package = ((globals or {}).get("__package__") or "") if level else name
+        started = time.perf_counter()
+        # Время вложенных импортов вычитается из времени того, кто их вызвал
+        self._stack.append(0.0)
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self._stack.pop()
+            top = package.partition(".")[0] or "?"
+            self.imports[top] = self.imports.get(top, 0.0) + elapsed - nested
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    # Конец фазы name; её длительность — от конца предыдущей
+    def mark(self, name):
+        self.phases.append((name, time.monotonic() - self.started_at))
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def durations(self):
+        result = {}
+        previous = 0.0
+        for name, at in self.phases:
+            result[name] = result.get(name, 0.0) + at - previous
+            previous = at
+        return result
+
+    def report(self, top=10):
+        self.stop_imports()
+        logger.info("Startup phases: %s", ", ".join(
+            f"{name} {seconds:.3f} s" for name, seconds in self.durations().items()
+        ))
+        if self.imports:
+            costly = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+            rest = sum(seconds for _, seconds in costly[top:])
+            logger.info("Import time by package (%.3f s total): %s, other %.3f s",
+                        sum(self.imports.values()),
+                        ", ".join(f"{name} {seconds:.3f} s" for name, seconds in costly[:top]), rest)
+
+
+profile = StartupProfile(PROFILE_IMPORTS)
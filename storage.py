@@ -0,0 +1,628 @@
+# Хранилища состояний FSM: память процесса (компактная с вытеснением или MemoryStorage aiogram),
+# Redis (по протоколу RESP) и SQLite (WAL)
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger("telegram_bot.storage")
+
+# Брошенные сессии OrderForm живут не дольше суток
+DEFAULT_TTL = 24 * 60 * 60
+# Сколько сессий держит в памяти CompactStorage; сверх этого вытесняются давно не активные
+DEFAULT_MAX_SESSIONS = 100_000
+
+# Данные OrderForm. Значения с небольшим набором вариантов хранятся номерами в словаре поля,
+# остальные — как есть; другие ключи, если появятся, попадают в обычный dict записи
+CODED_FIELDS = ("action", "project", "server", "amount_kk", "payment_type")
+PLAIN_FIELDS = ("price_rub", "user_id", "username", "order_id")
+
+
+def _state_name(state):
+    if isinstance(state, State):
+        return state.state
+    return state
+
+
+class RespError(Exception):
+    pass
+
+
+# Минимальный клиент RESP2: пул соединений и конвейерная отправка команд
+class RespClient:
+    def __init__(self, host="localhost", port=6379, db=0, password=None, pool_size=10):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.pool_size = pool_size
+        self._idle = []
+        self._opened = 0
+        self._released = asyncio.Condition()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=db,
+            password=parsed.password,
+            **kwargs
+        )
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        conn = (reader, writer)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._roundtrip(conn, setup)
+        return conn
+
+    async def _acquire(self):
+        async with self._released:
+            while not self._idle and self._opened >= self.pool_size:
+                await self._released.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return await self._connect()
+        except BaseException:
+            async with self._released:
+                self._opened -= 1
+                self._released.notify()
+            raise
+
+    async def _release(self, conn, broken=False):
+        async with self._released:
+            if broken:
+                self._opened -= 1
+                conn[1].close()
+            else:
+                self._idle.append(conn)
+            self._released.notify()
+
+    @staticmethod
+    def _encode(commands):
+        out = bytearray()
+        for command in commands:
+            out += b"*%d\r\n" % len(command)
+            for arg in command:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode()
+                out += b"$%d\r\n%s\r\n" % (len(arg), arg)
+        return bytes(out)
+
+    @classmethod
+    async def _read_reply(cls, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            return RespError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size == -1:
+                return None
+            data = await reader.readexactly(size + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            size = int(body)
+            if size == -1:
+                return None
+            return [await cls._read_reply(reader) for _ in range(size)]
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+    async def _roundtrip(self, conn, commands):
+        reader, writer = conn
+        writer.write(self._encode(commands))
+        await writer.drain()
+        replies = [await self._read_reply(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    # Все команды уходят одним пакетом и читаются одним проходом — один round trip
+    async def pipeline(self, *commands):
+        conn = await self._acquire()
+        try:
+            replies = await self._roundtrip(conn, commands)
+        except BaseException:
+            # Ответы могли остаться непрочитанными — соединение больше не годится
+            await self._release(conn, broken=True)
+            raise
+        await self._release(conn)
+        return replies
+
+    async def execute(self, *args):
+        return (await self.pipeline(args))[0]
+
+    # MULTI/EXEC внутри одного конвейера: атомарно и за один round trip
+    async def transaction(self, *commands):
+        replies = await self.pipeline(("MULTI",), *commands, ("EXEC",))
+        return replies[-1]
+
+    async def close(self):
+        async with self._released:
+            for _, writer in self._idle:
+                writer.close()
+            for _, writer in self._idle:
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+            self._idle.clear()
+            self._opened = 0
+
+
+# Хранилище FSM поверх Redis: состояние — строка, данные — hash с JSON-полями
+class RespStorage(BaseStorage):
+    def __init__(self, client, ttl=DEFAULT_TTL, key_builder=None):
+        self.client = client
+        self.ttl_ms = int(ttl * 1000) if ttl else None
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix="fsm")
+
+    @classmethod
+    def from_url(cls, url, ttl=DEFAULT_TTL, **kwargs):
+        return cls(RespClient.from_url(url, **kwargs), ttl=ttl)
+
+    def _keys(self, key):
+        return self.key_builder.build(key, "state"), self.key_builder.build(key, "data")
+
+    def _expire(self, redis_key):
+        return ("PEXPIRE", redis_key, self.ttl_ms)
+
+    async def set_state(self, key, state=None):
+        state_key, data_key = self._keys(key)
+        state = _state_name(state)
+        if state is None:
+            await self.client.execute("DEL", state_key)
+            return
+        commands = [("SET", state_key, state)]
+        if self.ttl_ms:
+            commands[0] += ("PX", self.ttl_ms)
+            # Активность пользователя продлевает и его данные
+            commands.append(self._expire(data_key))
+        await self.client.pipeline(*commands)
+
+    async def get_state(self, key):
+        state_key, _ = self._keys(key)
+        return await self.client.execute("GET", state_key)
+
+    def _write_data_commands(self, data_key, data, replace):
+        commands = []
+        if replace:
+            commands.append(("DEL", data_key))
+        if data:
+            fields = []
+            for field, value in data.items():
+                fields += (field, json.dumps(value, ensure_ascii=False))
+            commands.append(("HSET", data_key, *fields))
+            if self.ttl_ms:
+                commands.append(self._expire(data_key))
+        return commands
+
+    async def set_data(self, key, data):
+        _, data_key = self._keys(key)
+        await self.client.transaction(*self._write_data_commands(data_key, data, replace=True))
+
+    @staticmethod
+    def _decode_hash(reply):
+        reply = reply or []
+        return {reply[i]: json.loads(reply[i + 1]) for i in range(0, len(reply), 2)}
+
+    async def get_data(self, key):
+        _, data_key = self._keys(key)
+        return self._decode_hash(await self.client.execute("HGETALL", data_key))
+
+    # Все поля пишутся одним HSET, результат читается в том же конвейере
+    async def update_data(self, key, data):
+        _, data_key = self._keys(key)
+        commands = self._write_data_commands(data_key, data, replace=False)
+        replies = await self.client.transaction(*commands, ("HGETALL", data_key))
+        return self._decode_hash(replies[-1])
+
+    # Состояние и данные одной транзакцией — используется StateTransaction
+    async def set_state_and_data(self, key, state, data):
+        state_key, data_key = self._keys(key)
+        state = _state_name(state)
+        if state is None:
+            commands = [("DEL", state_key)]
+        elif self.ttl_ms:
+            commands = [("SET", state_key, state, "PX", self.ttl_ms)]
+        else:
+            commands = [("SET", state_key, state)]
+        commands += self._write_data_commands(data_key, data, replace=True)
+        await self.client.transaction(*commands)
+
+    # Пользователи с незавершённым сценарием; SCAN не блокирует Redis, в отличие от KEYS
+    async def active_sessions(self):
+        builder = self.key_builder
+        pattern = f"{builder.prefix}{builder.separator}*{builder.separator}state"
+        cursor, count = "0", 0
+        while True:
+            cursor, keys = await self.client.execute("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)
+            count += len(keys)
+            if cursor == "0":
+                return count
+
+    async def close(self):
+        await self.client.close()
+
+
+# Встроенное хранилище FSM в SQLite (WAL); все запросы идут через один поток
+class SQLiteStorage(BaseStorage):
+    # Как часто вычищать просроченные сессии, секунд
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path="fsm.sqlite3", ttl=DEFAULT_TTL, key_builder=None):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix="fsm")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = None
+        self._closed = False
+        self._last_purge = 0.0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " data TEXT NOT NULL DEFAULT '{}',"
+                " expires REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires)")
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _expires(self, now):
+        return now + self.ttl if self.ttl else None
+
+    def _maybe_purge(self, conn, now):
+        if self.ttl and now - self._last_purge >= self.PURGE_INTERVAL:
+            self._last_purge = now
+            deleted = conn.execute("DELETE FROM fsm WHERE expires < ?", (now,)).rowcount
+            if deleted:
+                logger.info("Purged %s expired FSM sessions", deleted)
+
+    def _read(self, conn, db_key, now):
+        row = conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+            (db_key, now)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, conn, db_key, state, data, now):
+        conn.execute(
+            "INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET"
+            " state = excluded.state, data = excluded.data, expires = excluded.expires",
+            (db_key, state, json.dumps(data, ensure_ascii=False), self._expires(now))
+        )
+
+    # Чтение и запись в одной транзакции и одном переходе в поток SQLite
+    def _modify(self, db_key, change):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, data = self._read(conn, db_key, now)
+            state, data = change(state, data)
+            self._write(conn, db_key, state, data, now)
+            self._maybe_purge(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return data
+
+    def _db_key(self, key):
+        return self.key_builder.build(key)
+
+    async def set_state(self, key, state=None):
+        state = _state_name(state)
+        await self._run(self._modify, self._db_key(key), lambda _, data: (state, data))
+
+    async def get_state(self, key):
+        return (await self._run(self._load, self._db_key(key)))[0]
+
+    async def set_data(self, key, data):
+        data = dict(data)
+        await self._run(self._modify, self._db_key(key), lambda state, _: (state, data))
+
+    async def get_data(self, key):
+        return (await self._run(self._load, self._db_key(key)))[1]
+
+    async def update_data(self, key, data):
+        def change(state, current):
+            current.update(data)
+            return state, current
+        return dict(await self._run(self._modify, self._db_key(key), change))
+
+    async def set_state_and_data(self, key, state, data):
+        state, data = _state_name(state), dict(data)
+        await self._run(self._modify, self._db_key(key), lambda *_: (state, data))
+
+    def _load(self, db_key):
+        return self._read(self._connection(), db_key, time.time())
+
+    def _count_active(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM fsm WHERE state IS NOT NULL AND (expires IS NULL OR expires >= ?)",
+            (time.time(),)
+        ).fetchone()[0]
+
+    async def active_sessions(self):
+        return await self._run(self._count_active)
+
+    # Закрывают и диспетчер на shutdown, и main(): второй вызов ничего не делает
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        def shutdown():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(shutdown)
+        self._executor.shutdown(wait=True)
+
+
+# Словарь значений поля: в записи хранится номер, сама строка — одна на все сессии.
+# Заполненный словарь больше не растёт, чтобы произвольный ввод пользователей не копился в нём
+class Codebook:
+    def __init__(self, limit=4096):
+        self.limit = limit
+        self.values = []
+        self._codes = {}
+
+    # Номер значения или None, если словарь заполнен
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None and len(self.values) < self.limit:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+# Запись сессии с полем на каждый известный ключ; незаданный слот означает отсутствующий ключ
+def _record_type(fields):
+    return type("SessionRecord", (), {"__slots__": ("state", "touched", "extra", *fields)})
+
+
+_MISSING = object()
+
+
+# Хранилище FSM в памяти процесса с ограниченным объёмом: компактная запись со __slots__
+# на сессию, вытеснение давно не активных сверх max_sessions (LRU) и по ttl.
+# В отличие от MemoryStorage, чтение не создаёт запись, а сессия без состояния и данных удаляется
+class CompactStorage(BaseStorage):
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS,
+                 coded=CODED_FIELDS, plain=PLAIN_FIELDS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._record = _record_type((*coded, *plain))
+        self._states = Codebook()
+        self._books = {field: Codebook() for field in coded}
+        self._plain = frozenset(plain)
+        # Порядок — от давно не активных к недавним
+        self._sessions = OrderedDict()
+        self._bot_id = None
+        self._clock = 0
+        self._active = 0
+        self.evicted = 0
+        self.expired = 0
+
+    # Личный чат без тем, бизнес-аккаунта и своего destiny — ключ просто id пользователя
+    def _key(self, key):
+        if self._bot_id is None:
+            self._bot_id = key.bot_id
+        if (key.chat_id == key.user_id and key.bot_id == self._bot_id and key.thread_id is None
+                and key.business_connection_id is None and key.destiny == DEFAULT_DESTINY):
+            return key.user_id
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+
+    # Секунды с точностью до целых: записи одной секунды делят один объект int
+    def _now(self):
+        now = int(time.monotonic())
+        if now != self._clock:
+            self._clock = now
+        return self._clock
+
+    # Записи упорядочены по последнему обращению, поэтому просроченные — в начале
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        sessions = self._sessions
+        while sessions:
+            record = sessions[next(iter(sessions))]
+            if now - record.touched < self.ttl:
+                break
+            self._drop(sessions.popitem(last=False)[1])
+            self.expired += 1
+
+    def _drop(self, record):
+        if record.state is not None:
+            self._active -= 1
+
+    def _get(self, key):
+        now = self._now()
+        self._expire(now)
+        record = self._sessions.get(key)
+        if record is not None:
+            record.touched = now
+            self._sessions.move_to_end(key)
+        return record
+
+    def _encode(self, state, data):
+        record = self._record()
+        if state is not None:
+            code = self._states.encode(state)
+            record.state = code if code is not None else state
+        else:
+            record.state = None
+        extra = None
+        for name, value in data.items():
+            book = self._books.get(name)
+            if book is not None:
+                code = book.encode(value) if type(value) is str else None
+                if code is not None:
+                    setattr(record, name, code)
+                    continue
+            elif name in self._plain:
+                setattr(record, name, value)
+                continue
+            if extra is None:
+                extra = {}
+            extra[name] = value
+        record.extra = extra
+        return record
+
+    def _decode_state(self, record):
+        if record is None or record.state is None:
+            return None
+        state = record.state
+        return self._states.values[state] if type(state) is int else state
+
+    def _decode_data(self, record):
+        if record is None:
+            return {}
+        data = {}
+        for name, book in self._books.items():
+            code = getattr(record, name, _MISSING)
+            if code is not _MISSING:
+                data[name] = book.values[code]
+        for name in self._plain:
+            value = getattr(record, name, _MISSING)
+            if value is not _MISSING:
+                data[name] = value
+        if record.extra:
+            data.update(record.extra)
+        return data
+
+    def _put(self, key, state, data):
+        now = self._now()
+        self._expire(now)
+        sessions = self._sessions
+        previous = sessions.pop(key, None)
+        if previous is not None:
+            self._drop(previous)
+        if state is None and not data:
+            return
+        record = self._encode(state, data)
+        record.touched = now
+        sessions[key] = record
+        if state is not None:
+            self._active += 1
+        while len(sessions) > self.max_sessions:
+            self._drop(sessions.popitem(last=False)[1])
+            self.evicted += 1
+
+    # Смена состояния без данных — на месте, без пересборки записи
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        state = _state_name(state)
+        record = self._get(key)
+        if state is None or record is None:
+            if record is not None and record.state is not None:
+                self._put(key, None, self._decode_data(record))
+            elif record is None and state is not None:
+                self._put(key, state, {})
+            return
+        if record.state is None:
+            self._active += 1
+        code = self._states.encode(state)
+        record.state = code if code is not None else state
+
+    async def get_state(self, key):
+        return self._decode_state(self._get(self._key(key)))
+
+    async def set_data(self, key, data):
+        key = self._key(key)
+        self._put(key, self._decode_state(self._get(key)), data)
+
+    async def get_data(self, key):
+        return self._decode_data(self._get(self._key(key)))
+
+    async def update_data(self, key, data):
+        key = self._key(key)
+        record = self._get(key)
+        current = self._decode_data(record)
+        current.update(data)
+        self._put(key, self._decode_state(record), current)
+        return current.copy()
+
+    async def set_state_and_data(self, key, state, data):
+        self._put(self._key(key), _state_name(state), data)
+
+    async def active_sessions(self):
+        return self._active
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "active": self._active,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "codes": {name: len(book.values) for name, book in self._books.items()},
+        }
+
+    async def close(self):
+        pass
+
+
+# Число пользователей с незавершённым сценарием в любом из хранилищ
+async def active_sessions(storage):
+    if isinstance(storage, MemoryStorage):
+        return sum(1 for record in storage.storage.values() if record.state is not None)
+    count = getattr(storage, "active_sessions", None)
+    return await count() if count is not None else None
+
+
+# Выбор хранилища по переменным окружения
+def create_storage():
+    backend = os.getenv("FSM_STORAGE", "compact")
+    ttl = int(os.getenv("FSM_TTL", DEFAULT_TTL))
+    if backend == "redis":
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        logger.info("Using Redis FSM storage at %s", url)
+        return RespStorage.from_url(url, ttl=ttl)
+    if backend == "sqlite":
+        path = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+        logger.info("Using SQLite FSM storage at %s", path)
+        return SQLiteStorage(path, ttl=ttl)
+    if backend == "memory":
+        return MemoryStorage()
+    return CompactStorage(ttl=ttl, max_sessions=int(os.getenv("FSM_MAX_SESSIONS", DEFAULT_MAX_SESSIONS)))
@@ -0,0 +1,228 @@
+# Шаблоны сообщений: разбираются один раз при загрузке, при отправке только подставляются значения.
+#
+# Разметка в исходном тексте шаблона — *жирный* и [текст](ссылка), поля — {name}.
+# Шаблон собирается под один из форматов отправки:
+#   "html", "markdownv2" — текст с parse_mode; значения полей экранируются под формат,
+#                          так что «_» в нике или «*» в названии сервера не ломают отправку
+#   "entities"           — обычный текст и готовый список entities, Telegram ничего не разбирает
+# Шаблон без разметки отправляется без parse_mode и без экранирования.
+import string
+from functools import lru_cache
+
+from aiogram.types import MessageEntity
+
+HTML = "html"
+MARKDOWN_V2 = "markdownv2"
+ENTITIES = "entities"
+FORMATS = (HTML, MARKDOWN_V2, ENTITIES)
+
+PARSE_MODES = {HTML: "HTML", MARKDOWN_V2: "MarkdownV2", ENTITIES: None}
+
+# Значения повторяются (серверы, проекты, способы оплаты); экранированная строка берётся из кэша
+CACHE_SIZE = 4096
+
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+_MARKDOWN_V2_ESCAPE = str.maketrans({char: "\\" + char for char in "\\_*[]()~`>#+-=|{}.!"})
+_MARKDOWN_V2_URL_ESCAPE = str.maketrans({"\\": "\\\\", ")": "\\)"})
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def escape_html(value):
+    return value.translate(_HTML_ESCAPE)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def escape_markdown_v2(value):
+    return value.translate(_MARKDOWN_V2_ESCAPE)
+
+
+def _plain(value):
+    return value
+
+
+_ESCAPERS = {HTML: escape_html, MARKDOWN_V2: escape_markdown_v2, ENTITIES: _plain}
+
+
+# Длина в UTF-16: в этих единицах Telegram считает offset и length у entities
+@lru_cache(maxsize=CACHE_SIZE)
+def utf16_len(value):
+    return len(value.encode("utf-16-le")) // 2
+
+
+# Исходный текст → список токенов: строка, ("field", имя, формат), ("bold",), ("link", url), ("end",)
+def _tokenize(source, markup):
+    tokens = []
+    for literal, field, spec, conversion in string.Formatter().parse(source):
+        if markup:
+            tokens.extend(_markup_tokens(literal))
+        elif literal:
+            tokens.append(literal)
+        if field is not None:
+            if conversion:
+                raise ValueError(f"Conversion !{conversion} is not supported: {source!r}")
+            tokens.append(("field", field, spec or ""))
+    return tokens
+
+
+def _markup_tokens(literal):
+    tokens = []
+    text = []
+    i = 0
+    while i < len(literal):
+        char = literal[i]
+        if char == "*":
+            tokens.append("".join(text))
+            tokens.append(("bold",))
+            text = []
+        elif char == "[":
+            close = literal.find("](", i)
+            end = literal.find(")", close) if close != -1 else -1
+            if end == -1:
+                text.append(char)
+                i += 1
+                continue
+            tokens.append("".join(text))
+            tokens.extend((("link", literal[close + 2:end]), literal[i + 1:close], ("end",)))
+            text = []
+            i = end
+        else:
+            text.append(char)
+        i += 1
+    tokens.append("".join(text))
+    return [token for token in tokens if token != ""]
+
+
+class Template:
+    __slots__ = ("source", "format", "parse_mode", "_text", "_fields", "_escape",
+                 "_segments", "_spans", "_entities", "_static")
+
+    def __init__(self, source, format=HTML, markup=True):
+        tokens = _tokenize(source, markup)
+        has_markup = any(isinstance(token, tuple) and token[0] != "field" for token in tokens)
+        self.source = source
+        self.format = format if has_markup else None
+        self.parse_mode = PARSE_MODES[format] if has_markup else None
+        self._escape = _ESCAPERS[self.format] if self.format is not None else _plain
+        self._compile(tokens)
+        # Без полей текст и entities одинаковы при каждой отправке
+        self._static = self._render({}) if not self._fields else None
+
+    # Литералы сразу переводятся в разметку формата и склеиваются в строку для str.format;
+    # для entities запоминаются длины литералов и границы сущностей в номерах кусков
+    def _compile(self, tokens):
+        fmt = self.format
+        escape = self._escape
+        text = []
+        literal = []
+        fields = []
+        segments = []
+        spans = []
+        opened = []
+        bold = False
+
+        def add(part):
+            literal.append(part)
+            text.append(part.replace("{", "{{").replace("}", "}}"))
+
+        # Закрывает текущий литерал; возвращает номер границы перед следующим куском
+        def boundary():
+            if literal:
+                segments.append(utf16_len("".join(literal)))
+                literal.clear()
+            return len(segments)
+
+        for token in tokens:
+            if isinstance(token, str):
+                add(escape(token))
+                continue
+            kind = token[0]
+            if kind == "field":
+                boundary()
+                fields.append(token[1:])
+                segments.append(None)
+                text.append("{}")
+            elif kind == "bold":
+                bold = not bold
+                if fmt == HTML:
+                    add("<b>" if bold else "</b>")
+                elif fmt == MARKDOWN_V2:
+                    add("*")
+                elif bold:
+                    opened.append(("bold", None, boundary()))
+                else:
+                    spans.append((*opened.pop(), boundary()))
+            elif kind == "link":
+                url = token[1]
+                if fmt == HTML:
+                    add(f'<a href="{escape_html(url)}">')
+                elif fmt == MARKDOWN_V2:
+                    add("[")
+                else:
+                    opened.append(("text_link", url, boundary()))
+            elif kind == "end":
+                if fmt == HTML:
+                    add("</a>")
+                elif fmt == MARKDOWN_V2:
+                    add(f"]({url.translate(_MARKDOWN_V2_URL_ESCAPE)})")
+                else:
+                    spans.append((*opened.pop(), boundary()))
+        if bold:
+            raise ValueError(f"Unclosed * in template: {self.source!r}")
+        boundary()
+
+        self._text = "".join(text)
+        self._fields = fields
+        self._segments = segments
+        self._spans = spans
+        # Набор entities зависит только от длин подставленных значений; они повторяются
+        self._entities = {} if fmt == ENTITIES else None
+
+    # (text, parse_mode, entities); missing(name) — значение для поля, которого нет в data
+    def render(self, data, missing=None):
+        if self._static is not None:
+            return self._static
+        return self._render(data, missing)
+
+    def _render(self, data, missing=None):
+        values = []
+        for name, spec in self._fields:
+            if name in data:
+                value = data[name]
+            elif missing is not None:
+                value = missing(name)
+            else:
+                raise KeyError(name)
+            values.append(format(value, spec) if spec else str(value))
+
+        if self._entities is None:
+            escape = self._escape
+            return self._text.format(*[escape(value) for value in values]), self.parse_mode, None
+
+        text = self._text.format(*values)
+        lengths = tuple(utf16_len(value) for value in values)
+        entities = self._entities.get(lengths)
+        if entities is None:
+            if len(self._entities) >= CACHE_SIZE:
+                self._entities.clear()
+            entities = self._entities[lengths] = self._build_entities(lengths)
+        return text, None, entities
+
+    def _build_entities(self, lengths):
+        positions = [0]
+        values = iter(lengths)
+        for length in self._segments:
+            positions.append(positions[-1] + (length if length is not None else next(values)))
+        entities = []
+        for kind, url, start, end in self._spans:
+            if positions[end] > positions[start]:
+                entities.append(MessageEntity(
+                    type=kind, offset=positions[start], length=positions[end] - positions[start], url=url
+                ))
+        entities.sort(key=lambda entity: entity.offset)
+        return entities
+
+
+# Один и тот же текст (например, сообщение об ошибке) собирается один раз
+@lru_cache(maxsize=256)
+def template(source, format=HTML, markup=True):
+    return Template(source, format, markup)
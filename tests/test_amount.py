@@ -0,0 +1,120 @@
+# Свойства amount.parse_kk на случайных суммах и строках и совместимость с прежним разбором
+import random
+import re
+from decimal import Decimal
+
+import pytest
+
+from amount import UNITS_PER_KK, format_kk, parse_kk, price_rub
+
+CASES = 20000
+SEED = 1
+
+# Прежний разбор: только целые «кк» без пробелов; \d — любые десятичные цифры Unicode
+LEGACY_PATTERN = re.compile(r"^(\d{1,3})кк$")
+
+KK_SUFFIXES = ["кк", "kk", "KK", "Кк", "кk", "kк", "млн", "m", "М"]
+SPACES = ["", " ", "  ", " "]
+GARBAGE = "0123456789 .,кkKmм+-_eE abcxyz/"
+# Десятичные цифры других письменностей: арабско-индийские, деванагари, полноширинные
+UNICODE_DIGITS = ["٠١٢٣٤٥٦٧٨٩", "०१२३४५६७८९", "０１２３４５６７８９"]
+
+
+def legacy_parse(text):
+    match = LEGACY_PATTERN.match(text or "")
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+def group_thousands(digits, separator):
+    head = len(digits) % 3 or 3
+    parts = [digits[:head]] + [digits[i:i + 3] for i in range(head, len(digits), 3)]
+    return separator.join(parts)
+
+
+# Сумма в кк с точностью до вирта и её случайная запись пользователем
+def random_amount(rng):
+    units = rng.randint(1, 999) * UNITS_PER_KK if rng.random() < 0.5 else rng.randint(1, 999_999_999)
+    return Decimal(units) / UNITS_PER_KK
+
+
+def random_spelling(rng, amount):
+    kind = rng.random()
+    space = rng.choice(SPACES)
+    if kind < 0.6:
+        number = format_kk(amount)
+        if rng.random() < 0.5:
+            number = number.replace(".", ",")
+        return number + space + rng.choice(KK_SUFFIXES)
+    units = int(amount * UNITS_PER_KK)
+    if kind < 0.8 and units % 1000 == 0:
+        return str(units // 1000) + space + rng.choice(["к", "k", "K"])
+    if units < 1000:
+        return format_kk(amount) + rng.choice(["кк", "kk"])
+    digits = str(units)
+    return group_thousands(digits, rng.choice([" ", " "])) if rng.random() < 0.5 else digits
+
+
+def to_script(text, digits):
+    return text.translate(str.maketrans("0123456789", digits))
+
+
+@pytest.fixture
+def spellings():
+    rng = random.Random(SEED)
+    cases = []
+    for _ in range(CASES):
+        amount = random_amount(rng)
+        cases.append((amount, random_spelling(rng, amount)))
+    return cases
+
+
+def test_round_trip(spellings):
+    for amount, text in spellings:
+        assert parse_kk(text) == amount, text
+        assert parse_kk(f"  {text}  ") == amount, text
+
+
+def test_canonical_form_is_stable(spellings):
+    for amount, text in spellings:
+        canonical = format_kk(parse_kk(text))
+        assert format_kk(parse_kk(canonical + "кк")) == canonical, text
+
+
+def test_exact_price(spellings):
+    for amount, text in spellings:
+        parsed = parse_kk(text)
+        assert price_rub(format_kk(parsed), 1600) == round(parsed * 1600), text
+
+
+# Всё, что принимал прежний разбор, понимается так же — и с цифрами других письменностей
+@pytest.mark.parametrize("digits", ["0123456789", *UNICODE_DIGITS])
+def test_legacy_compatibility(digits):
+    for value in range(0, 1000):
+        for text in (f"{value}кк", f"{value:03d}кк"):
+            text = to_script(text, digits)
+            legacy = legacy_parse(text)
+            assert legacy == value, text
+            assert parse_kk(text) == legacy, text
+
+
+@pytest.mark.parametrize("digits", UNICODE_DIGITS)
+def test_unicode_digits(digits, spellings):
+    for amount, text in spellings[:1000]:
+        assert parse_kk(to_script(text, digits)) == amount, text
+
+
+@pytest.mark.parametrize("text", ["²кк", "¹²кк", "1²кк", "⑤кк"])
+def test_non_decimal_digits_rejected(text):
+    assert legacy_parse(text) is None
+    assert parse_kk(text) is None
+
+
+# Мусор не роняет разбор, а результат всегда кратен вирту
+def test_garbage():
+    rng = random.Random(SEED)
+    for _ in range(CASES):
+        text = "".join(rng.choice(GARBAGE) for _ in range(rng.randint(0, 16)))
+        parsed = parse_kk(text)
+        assert parsed is None or (parsed * UNITS_PER_KK) % 1 == 0, text
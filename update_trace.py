@@ -0,0 +1,204 @@
+# Трасса входящих обновлений для воспроизведения в бенчмарках (benchmarks/replay.py).
+#
+# Формат — JSON Lines, строка на обновление: {"t": unix-время получения, "u": Update как в Bot API}.
+# Путь с окончанием .gz пишется и читается через gzip. Записи только дописываются, так что
+# трассы нескольких запусков и воркеров сливаются при чтении по времени.
+# Перед записью обновление обезличивается: остаются только поля, которые читают хендлеры;
+# id пользователей и чатов заменяются псевдонимами (HMAC с солью — один пользователь остаётся
+# одним и тем же в пределах соли), имена — заглушками, номера телефонов и карт в тексте
+# (от 10 цифр) — нулями, адреса почты — x той же длины, чтобы не съехали entities.
+# Не трогаются только суммы, которые бот примет на шаге суммы («12кк», «12 000 000», 1–100кк), —
+# без них трасса не дойдёт до подтверждения. Число вне этих границ (телефон, номер карты
+# подряд или группами цифр) записывается нулями целиком.
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import BaseMiddleware
+
+from amount import MAX_ORDER_KK, MIN_ORDER_KK, parse_kk
+
+logger = logging.getLogger("telegram_bot.trace")
+
+USER_FIELDS = ("id", "is_bot", "first_name", "username", "language_code")
+CHAT_FIELDS = ("id", "type")
+ENTITY_FIELDS = ("type", "offset", "length")
+
+# Телефон с кодом страны или номер карты: 10 и больше цифр, между ними пробелы, дефисы, скобки
+_LONG_NUMBER = re.compile(r"\d(?:[ \-()]*\d){9,}")
+_EMAIL = re.compile(r"[^\s@]+@[^\s@]+\.[^\s@]+")
+_DIGIT = re.compile(r"\d")
+_EMAIL_CHAR = re.compile(r"[^@.]")
+
+
+def open_trace(path, mode="rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+# Воркер пишет свою трассу рядом: trace.jsonl.gz → trace-1.jsonl.gz
+def worker_path(path, worker_index=None):
+    if worker_index is None:
+        return path
+    root, ext = os.path.splitext(path)
+    if ext == ".gz":
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}-{worker_index}{ext}"
+
+
+# Обновления из одной или нескольких трасс: список (t, dict Update), по возрастанию t
+def read_trace(*paths):
+    records = []
+    for path in paths:
+        with open_trace(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records.append((record["t"], record["u"]))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+class Anonymizer:
+    # Без secret соль случайная: псевдонимы стабильны только в пределах процесса
+    def __init__(self, secret=None):
+        self.secret = secret.encode() if isinstance(secret, str) else (secret or os.urandom(16))
+
+    # Псевдоним id того же знака (у групп id отрицательные), не больше 2**40
+    def id(self, value):
+        digest = hmac.new(self.secret, str(abs(value)).encode(), hashlib.sha256).digest()
+        pseudonym = int.from_bytes(digest[:5], "big") + 1
+        return -pseudonym if value < 0 else pseudonym
+
+    @staticmethod
+    def text(value):
+        amount_kk = parse_kk(value)
+        if amount_kk is not None:
+            if MIN_ORDER_KK <= amount_kk <= MAX_ORDER_KK:
+                return value
+            return _DIGIT.sub("0", value)
+        value = _LONG_NUMBER.sub(lambda m: _DIGIT.sub("0", m.group()), value)
+        return _EMAIL.sub(lambda m: _EMAIL_CHAR.sub("x", m.group()), value)
+
+    def user(self, raw):
+        user = {key: raw[key] for key in USER_FIELDS if key in raw}
+        user["id"] = self.id(raw["id"])
+        user["first_name"] = "User"
+        if "username" in raw:
+            user["username"] = f"user{user['id']:x}"
+        return user
+
+    def chat(self, raw):
+        chat = {key: raw[key] for key in CHAT_FIELDS if key in raw}
+        chat["id"] = self.id(raw["id"])
+        return chat
+
+    def message(self, raw):
+        message = {"message_id": raw["message_id"], "date": raw["date"], "chat": self.chat(raw["chat"])}
+        if "from" in raw:
+            message["from"] = self.user(raw["from"])
+        if "text" in raw:
+            message["text"] = self.text(raw["text"])
+            if "entities" in raw:
+                message["entities"] = [
+                    {key: entity[key] for key in ENTITY_FIELDS} for entity in raw["entities"]
+                ]
+        return message
+
+    # dict Update (model_dump(mode="json", by_alias=True)) → обезличенный dict; None — тип не пишется
+    def update(self, raw):
+        if "message" in raw:
+            return {"update_id": raw["update_id"], "message": self.message(raw["message"])}
+        if "callback_query" in raw:
+            query = raw["callback_query"]
+            anonymized = {
+                "id": query["id"],
+                "from": self.user(query["from"]),
+                "chat_instance": query["chat_instance"],
+            }
+            if "data" in query:
+                anonymized["data"] = query["data"]
+            if "message" in query:
+                anonymized["message"] = self.message(query["message"])
+            return {"update_id": raw["update_id"], "callback_query": anonymized}
+        return None
+
+
+# Outer middleware диспетчера, ставится первым: пишет каждое принятое обновление.
+# Обработку не задерживает: обновление кладётся в очередь, разбор и запись идут в отдельном потоке;
+# при переполнении очереди обновление в трассу не попадает (счётчик dropped)
+class UpdateRecorder(BaseMiddleware):
+    def __init__(self, path, secret=None, batch_size=500, queue_size=10000):
+        self.path = path
+        self.anonymizer = Anonymizer(secret)
+        self.batch_size = batch_size
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+        self._file = None
+        self._writer = None
+        self.written = 0
+        self.dropped = 0
+
+    async def __call__(self, handler, event, data):
+        self.record(event)
+        return await handler(event, data)
+
+    # at — время получения; бенчмарки задают его сами, когда собирают трассу
+    def record(self, update, at=None):
+        try:
+            self._queue.put_nowait((time.time() if at is None else at, update))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        if self._writer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(self._executor, open_trace, self.path, "at")
+        self._writer = asyncio.create_task(self._write_loop())
+        logger.info("Recording updates to %s", self.path)
+
+    def _write_batch(self, batch):
+        lines = []
+        for at, update in batch:
+            raw = self.anonymizer.update(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            if raw is not None:
+                lines.append(json.dumps({"t": round(at, 3), "u": raw}, ensure_ascii=False, separators=(",", ":")))
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+        return len(lines)
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                self.written += await loop.run_in_executor(self._executor, self._write_batch, batch)
+            except Exception as e:
+                logger.error("Failed to write %s updates to trace %s: %s", len(batch), self.path, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def close(self):
+        if self._writer is not None:
+            await self._queue.join()
+            self._writer.cancel()
+            self._writer = None
+        if self._file is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._file.close)
+            self._file = None
+        self._executor.shutdown(wait=False)
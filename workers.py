@@ -0,0 +1,554 @@
+# Режим нескольких процессов: супервизор принимает обновления (polling или вебхук)
+# и раздаёт их воркерам по chat_id, чтобы шаги одного заказа шли по порядку в одном процессе.
+#
+# Обмен с воркером — строки JSON: супервизор пишет обновления в stdin воркера,
+# воркер отвечает в stdout строкой "@ack <update_id> ok|error" после обработки.
+# Если хендлер оставил фоновые задачи (меню после /start), сначала приходит
+# "@handled <update_id> ok|error", а "@ack" — когда они закончатся.
+# Строки stdout без префикса протокола (print из библиотек и т.п.) супервизор пропускает.
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from lifecycle import Backoff, collect_followups
+
+logger = logging.getLogger("telegram_bot.workers")
+
+READY = b"@ready\n"
+ACK = b"@ack "
+HANDLED = b"@handled "
+
+
+# chat_id обновления из сырого JSON; обновления без чата распределяются по update_id
+def update_chat_id(update):
+    for kind in ("message", "edited_message", "callback_query", "my_chat_member"):
+        event = update.get(kind)
+        if event is None:
+            continue
+        if kind == "callback_query":
+            event = event.get("message") or {"chat": event.get("from")}
+        chat = event.get("chat")
+        if chat is not None:
+            return chat["id"]
+    return update["update_id"]
+
+
+def shard_for(update, count):
+    return update_chat_id(update) % count
+
+
+# Переменные окружения воркера: свои файл лога, порт метрик и номер для генератора id заказов
+def worker_env(index, count):
+    env = dict(os.environ)
+    env["BOT_WORKER_INDEX"] = str(index)
+    env["BOT_WORKERS"] = str(count)
+    env["WORKER_ID"] = str(int(os.getenv("WORKER_ID", "0")) + index)
+    log_file = os.getenv("LOG_FILE", "bot.log")
+    if log_file:
+        root, ext = os.path.splitext(log_file)
+        env["LOG_FILE"] = f"{root}.worker{index}{ext}"
+    metrics_port = int(os.getenv("METRICS_PORT", "9091"))
+    if metrics_port:
+        env["METRICS_PORT"] = str(metrics_port + 1 + index)
+    return env
+
+
+class WorkerProcess:
+    def __init__(self, index, count, command, supervisor):
+        self.index = index
+        self.count = count
+        self.command = command
+        self.supervisor = supervisor
+        self.process = None
+        self.inflight = {}
+        # Обработаны, но фоновые задачи ещё идут: место не занимают, из контрольной точки не выпадают
+        self.following = {}
+        # Пока воркер перезапускается, его обновления копятся здесь
+        self.backlog = []
+        self.accepting = False
+        # Перезапуск не удался: обновления воркера раздаются другим, пока он не поднимется
+        self.down = False
+        self.stopping = False
+        self.restarts = 0
+        self._reader = None
+
+    # Процесс воркера, который уже импортировал всё и готов читать обновления
+    async def launch(self):
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=worker_env(self.index, self.count)
+        )
+        while True:
+            line = await process.stdout.readline()
+            if line == READY:
+                return process
+            if not line:
+                raise RuntimeError(f"Worker {self.index} failed to start")
+            self._stray(line)
+
+    def _stray(self, line):
+        logger.warning("Worker %s wrote to stdout: %r", self.index, line[:200])
+
+    async def spawn(self, process=None):
+        self.process = process if process is not None else await self.launch()
+        self._reader = asyncio.create_task(self._read_acks(self.process))
+        self.accepting = True
+        self.down = False
+        # Неподтверждённое прежним процессом и накопленное за перезапуск уходит первым, по порядку
+        pending = self.take_pending()
+        for update_id, line in pending:
+            self._write(update_id, line)
+        logger.info("Worker %s started (pid %s)", self.index, self.process.pid)
+        if pending:
+            logger.info("Resent %s unprocessed updates to worker %s", len(pending), self.index)
+
+    # Всё, что воркер принял, но не подтвердил, и всё, что ждёт его запуска; воркер это забывает.
+    # Обработанное с недоработанными фоновыми задачами обрабатывается заново и снова занимает место
+    def take_pending(self):
+        self.supervisor.reopened(len(self.following))
+        pending = sorted([*self.following.values(), *self.inflight.values()]) + self.backlog
+        self.following.clear()
+        self.inflight.clear()
+        self.backlog = []
+        return pending
+
+    def _write(self, update_id, line):
+        self.inflight[update_id] = (update_id, line)
+        self.process.stdin.write(line)
+
+    def send(self, update_id, line):
+        if self.accepting:
+            self._write(update_id, line)
+        else:
+            self.backlog.append((update_id, line))
+
+    async def _read_acks(self, process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            prefix = ACK if line.startswith(ACK) else HANDLED if line.startswith(HANDLED) else None
+            if prefix is None:
+                self._stray(line)
+                continue
+            try:
+                update_id, status = line[len(prefix):].split()
+                update_id = int(update_id)
+            except ValueError:
+                self._stray(line)
+                continue
+            entry = self.inflight.pop(update_id, None)
+            if entry is not None:
+                self.supervisor.acknowledged(status == b"ok")
+                if prefix == HANDLED:
+                    self.following[update_id] = entry
+            elif prefix == ACK:
+                self.following.pop(update_id, None)
+        code = await process.wait()
+        if process is self.process and not self.stopping:
+            logger.error("Worker %s exited with code %s, restarting", self.index, code)
+            self.accepting = False
+            self.restarts += 1
+            await self._respawn()
+
+    # Запуск вместо упавшего процесса, пока не получится, с растущей паузой. После первой
+    # неудачи неподтверждённое и накопленное отдаётся супервизору, и до запуска чаты этого
+    # воркера обслуживают другие — иначе очередь росла бы без предела
+    async def _respawn(self):
+        backoff = Backoff()
+        await asyncio.sleep(1)
+        while not self.stopping:
+            try:
+                await self.spawn()
+                return
+            except (OSError, RuntimeError) as e:
+                delay = backoff.next()
+                logger.error("Failed to restart worker %s (attempt %s), retrying in %.1f s: %s",
+                             self.index, backoff.attempts, delay, e)
+            if not self.down:
+                self.down = True
+                self.supervisor.redistribute(self, self.take_pending())
+            await asyncio.sleep(delay)
+
+    # Мягкая остановка: закрываем stdin, воркер дорабатывает принятое и выходит
+    async def drain(self, timeout):
+        self.accepting = False
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.stdin.close()
+        except (ConnectionError, OSError):
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Worker %s did not drain in %s s, killing it", self.index, timeout)
+            process.kill()
+            await process.wait()
+        if self._reader is not None:
+            await self._reader
+
+    async def stop(self, timeout):
+        self.stopping = True
+        await self.drain(timeout)
+        # Упавший воркер может ждать паузы перед следующей попыткой запуска
+        if self._reader is not None and not self._reader.done():
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    # Перезапуск с сохранением порядка: новый процесс запускается, пока старый ещё принимает
+    # обновления, и получает их только после выхода старого. Пауза в приёме — только доработка
+    # принятого старым процессом, а не запуск нового. Не запустился новый — старый работает дальше
+    async def restart(self, timeout):
+        process = await self.launch()
+        self.stopping = True
+        await self.drain(timeout)
+        self.stopping = False
+        self.restarts += 1
+        await self.spawn(process)
+
+
+class Supervisor:
+    def __init__(self, bot, count, command, drain_timeout=30.0, max_inflight=1000):
+        self.bot = bot
+        self.drain_timeout = drain_timeout
+        self.max_inflight = max_inflight * count
+        self.workers = [WorkerProcess(i, count, command, self) for i in range(count)]
+        self._stop = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._restarting = False
+        self._checkpoint = None
+        self._offset = None
+        self._saved_offset = None
+        self.dispatched = 0
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def inflight(self):
+        return self.dispatched - self.processed - self.failed
+
+    async def start(self):
+        await asyncio.gather(*(worker.spawn() for worker in self.workers))
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.rolling_restart()))
+        logger.info("Supervisor started %s workers", len(self.workers))
+
+    def dispatch(self, update):
+        line = json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        self.dispatched += 1
+        self._idle.clear()
+        self._deliver(update, line)
+        if self.inflight >= self.max_inflight:
+            self._room.clear()
+
+    # Воркер чата, а если он не смог перезапуститься — следующий по кругу из работающих.
+    # Все обновления чата идут к одному и тому же заместителю, так что их порядок сохраняется
+    def _deliver(self, update, line):
+        index = shard_for(update, len(self.workers))
+        for shift in range(len(self.workers)):
+            worker = self.workers[(index + shift) % len(self.workers)]
+            if not worker.down:
+                worker.send(update["update_id"], line)
+                return
+        logger.error("No worker is running, update %s is dropped", update["update_id"])
+        self.acknowledged(False)
+
+    # Обновления воркера, который не смог перезапуститься, уходят заместителям
+    def redistribute(self, worker, pending):
+        if pending:
+            logger.warning("Worker %s is down, handing %s updates to other workers", worker.index, len(pending))
+        for _, line in pending:
+            self._deliver(json.loads(line), line)
+
+    # Обновления снова в работе: воркер упал, не доделав их фоновые задачи
+    def reopened(self, count):
+        self.dispatched += count
+        if count:
+            self._idle.clear()
+        if self.inflight >= self.max_inflight:
+            self._room.clear()
+
+    def acknowledged(self, ok):
+        if ok:
+            self.processed += 1
+        else:
+            self.failed += 1
+        inflight = self.inflight
+        if inflight < self.max_inflight:
+            self._room.set()
+        if inflight == 0:
+            self._idle.set()
+
+    async def wait_idle(self):
+        await self._idle.wait()
+
+    # SIGHUP: воркеры перезапускаются по одному, остальные продолжают работать.
+    # Повторный SIGHUP во время перезапуска не начинает второй поверх первого
+    async def rolling_restart(self):
+        if self._restarting:
+            logger.warning("Rolling restart is already in progress, ignoring the request")
+            return
+        self._restarting = True
+        try:
+            for worker in self.workers:
+                await worker.restart(self.drain_timeout)
+        finally:
+            self._restarting = False
+        logger.info("Rolling restart finished")
+
+    # Ждёт future или остановку, что наступит раньше
+    async def _until_stop(self, future):
+        stop = asyncio.ensure_future(self._stop.wait())
+        await asyncio.wait((future, stop), return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+
+    # Пауза, которую прерывает остановка, как Lifecycle.sleep
+    async def _sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop(self.drain_timeout) for worker in self.workers))
+        # Недоработанное воркерами переживает перезапуск через контрольную точку polling'а
+        left = len(self._unacknowledged())
+        if self._checkpoint is not None:
+            await self._save()
+        elif left:
+            logger.error("%s unfinished updates are lost: POLL_CHECKPOINT is not set", left)
+        logger.info(
+            "Supervisor stopped: %s updates dispatched, %s processed, %s failed, %s left for the next start",
+            self.dispatched, self.processed, self.failed, left
+        )
+
+    # Сырые обновления, которые воркеры ещё не подтвердили, по порядку update_id
+    def _unacknowledged(self):
+        entries = sorted(
+            entry for worker in self.workers
+            for entry in (*worker.following.values(), *worker.inflight.values(), *worker.backlog)
+        )
+        return [line.decode().rstrip("\n") for _, line in entries]
+
+    async def _save(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, self._checkpoint.save, self.bot.id, self._offset, self._unacknowledged()
+            )
+        except OSError as e:
+            logger.error("Failed to write checkpoint %s: %s", self._checkpoint.path, e)
+            return
+        self._saved_offset = self._offset
+
+    def stats(self):
+        return {
+            "dispatched": self.dispatched,
+            "processed": self.processed,
+            "failed": self.failed,
+            "inflight": self.inflight,
+            "restarts": sum(worker.restarts for worker in self.workers),
+        }
+
+    # Long polling одним процессом; сырые обновления не разбираются в объекты aiogram
+    # cleanup — корутинная функция (удаление вебхука), которая идёт параллельно с первым getUpdates.
+    # checkpoint (lifecycle.OffsetCheckpoint) — как у UpdatePoller: перед каждым getUpdates
+    # в него пишутся offset и неподтверждённые воркерами обновления, при запуске они раздаются первыми
+    async def poll(self, allowed_updates=None, timeout=30, limit=100, cleanup=None, checkpoint=None):
+        url = self.bot.session.api.api_url(token=self.bot.token, method="getUpdates")
+        self._checkpoint = checkpoint
+        if checkpoint is not None:
+            self._offset, pending = checkpoint.load(self.bot.id)
+            self._saved_offset = self._offset
+            for update in pending:
+                self.dispatch(update)
+            if pending:
+                logger.info("Replaying %s updates from checkpoint %s", len(pending), checkpoint.path)
+        backoff = Backoff()
+        cleanup = asyncio.create_task(cleanup()) if cleanup is not None else None
+        async with ClientSession(timeout=ClientTimeout(total=timeout + 10)) as http:
+            while not self._stop.is_set():
+                # Воркеры не успевают — не забираем новые обновления, пусть копятся у Telegram
+                if not self._room.is_set():
+                    room = asyncio.ensure_future(self._room.wait())
+                    await self._until_stop(room)
+                    room.cancel()
+                    continue
+                # Offset подтверждает всё полученное раньше; сначала запоминаем, что из этого не готово
+                if self._checkpoint is not None and self._offset != self._saved_offset:
+                    await self._save()
+                params = {"timeout": timeout, "limit": limit}
+                if self._offset is not None:
+                    params["offset"] = self._offset
+                if allowed_updates is not None:
+                    params["allowed_updates"] = allowed_updates
+                fetch = asyncio.ensure_future(http.post(url, json=params))
+                await self._until_stop(fetch)
+                if not fetch.done():
+                    fetch.cancel()
+                    break
+                try:
+                    async with fetch.result() as resp:
+                        payload = await resp.json()
+                except (ClientError, asyncio.TimeoutError, ValueError) as e:
+                    delay = backoff.next()
+                    logger.error("getUpdates failed, retrying in %.1f s: %s", delay, e)
+                    await self._sleep(delay)
+                    continue
+                # Вебхук ещё не удалён: повторяем сразу, как только удаление закончится
+                if payload.get("error_code") == 409 and cleanup is not None and not cleanup.done():
+                    await self._until_stop(cleanup)
+                    continue
+                if not payload.get("ok"):
+                    retry_after = payload.get("parameters", {}).get("retry_after")
+                    logger.error("getUpdates error: %s", payload.get("description"))
+                    await self._sleep(retry_after or backoff.next())
+                    continue
+                backoff.reset()
+                for update in payload["result"]:
+                    self.dispatch(update)
+                    self._offset = update["update_id"] + 1
+            # Полученное подтверждается и у Telegram, чтобы без файла не получить его повторно
+            if self._offset is not None:
+                if self._checkpoint is not None:
+                    await self._save()
+                try:
+                    async with http.post(url, json={"offset": self._offset, "timeout": 0, "limit": 1}) as resp:
+                        await resp.read()
+                except (ClientError, asyncio.TimeoutError) as e:
+                    logger.error("Failed to confirm offset %s: %s", self._offset, e)
+        if cleanup is not None:
+            cleanup.cancel()
+
+    # Вебхук: Telegram получает 200 сразу после передачи обновления воркеру
+    async def serve_webhook(self, host, port, path, secret=None):
+        from aiohttp import web
+
+        async def handle(request):
+            if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                return web.Response(status=401)
+            self.dispatch(json.loads(await request.read()))
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        logger.info("Supervisor listening for webhook updates on %s:%s%s", host, port, path)
+        try:
+            await self._stop.wait()
+        finally:
+            await runner.cleanup()
+
+
+# Порядок внутри чата: следующее обновление чата ждёт окончания предыдущего
+class ChatSerializer:
+    def __init__(self):
+        self._tails = {}
+        self.tasks = set()
+
+    def submit(self, chat_id, process):
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._run(chat_id, previous, process))
+        self._tails[chat_id] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, chat_id, previous, process):
+        if previous is not None:
+            await asyncio.wait((previous,))
+        try:
+            await process()
+        finally:
+            if self._tails.get(chat_id) is asyncio.current_task():
+                del self._tails[chat_id]
+
+    async def join(self):
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+
+# Цикл воркера: читает обновления из stdin, пока супервизор не закроет поток
+async def run_worker(dp, bot):
+    # Остановкой управляет супервизор: Ctrl+C в терминале не должен обрывать обработку
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 22)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    serializer = ChatSerializer()
+    # Подтверждения, которые ждут фоновых задач обновления; очередь чата их не ждёт
+    acks = set()
+
+    def ack(prefix, update_id, status):
+        writer.write(b"%s%d %s\n" % (prefix, update_id, status))
+
+    async def ack_followed(update_id, status, followups):
+        await asyncio.wait(followups)
+        ack(ACK, update_id, status)
+
+    async def process(update):
+        status = b"ok"
+        with collect_followups() as followups:
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                status = b"error"
+                logger.exception("Failed to process update %s: %s", update["update_id"], e)
+        followups = [task for task in followups if not task.done()]
+        if not followups:
+            ack(ACK, update["update_id"], status)
+            return
+        # До подтверждения супервизор держит обновление в своей контрольной точке
+        ack(HANDLED, update["update_id"], status)
+        task = asyncio.create_task(ack_followed(update["update_id"], status, followups))
+        acks.add(task)
+        task.add_done_callback(acks.discard)
+
+    # SIGTERM воркеру напрямую (остановка всей группы процессов): перестаём читать stdin
+    # и дорабатываем принятое. Непрочитанное супервизор перешлёт следующему процессу
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    stopped = asyncio.ensure_future(stop.wait())
+    writer.write(READY)
+    while True:
+        read = asyncio.ensure_future(reader.readline())
+        await asyncio.wait((read, stopped), return_when=asyncio.FIRST_COMPLETED)
+        if read.done():
+            line = read.result()
+            if not line:
+                break
+            update = json.loads(line)
+            serializer.submit(update_chat_id(update), lambda update=update: process(update))
+        if stop.is_set():
+            read.cancel()
+            logger.warning("Received SIGTERM, draining accepted updates")
+            break
+    stopped.cancel()
+    # stdin закрыт или пришёл SIGTERM: дорабатываем принятые обновления и выходим
+    started = time.monotonic()
+    await serializer.join()
+    while acks:
+        await asyncio.wait(list(acks))
+    try:
+        await writer.drain()
+    except ConnectionError:
+        logger.warning("Supervisor is gone, acknowledgements were not delivered")
+    logger.info("Worker drained in %.2f s", time.monotonic() - started)